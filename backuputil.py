@@ -10,29 +10,72 @@ The (hopefully) not-so-garbage configurable backup utility.
 
 # Standard Library
 import argparse
+import collections
 import datetime
+import errno
+import fcntl
+import fnmatch
 import getpass
-import glob
+import hashlib
+import importlib
+import json
 import logging
+import math
 import os
 import re
+import resource
+import select
 import shutil
-import socket
-import subprocess
+import signal
+import stat
+import struct
 import sys
+import threading
 import time
 
-# Additional Dependencies
 try:
-    import yaml
-except ImportError as e:
-    sys.exit('Unable to import PyYAML library - ' + str(e) + '.')
+    import cPickle as pickle
+except ImportError:
+    import pickle
 
-# Custom Modules
-try:
-    import emails
-except ImportError as e:
-    sys.exit('Unable to import email definitions - ' + str(e) + '.')
+
+class _LazyModule(object):
+    '''
+    A stand-in for a module that is only imported once one of its attributes is
+    first accessed, so that invocations not needing the module (such as
+    "--list-targets") do not pay for importing it. If an error message is given,
+    the script exits with it when the module cannot be imported.
+    '''
+    def __init__(self, name, error=None):
+        self._lazy_name = name
+        self._lazy_error = error
+        self._lazy_module = None
+
+    def __getattr__(self, attr):
+        if self._lazy_module is None:
+            try:
+                self._lazy_module = importlib.import_module(self._lazy_name)
+            except ImportError as e:
+                if self._lazy_error is None: raise
+                sys.exit(self._lazy_error + ' - ' + str(e) + '.')
+        return getattr(self._lazy_module, attr)
+
+
+# Standard Library (imported on first use)
+ctypes = _LazyModule('ctypes')
+ctypes_util = _LazyModule('ctypes.util')
+gzip = _LazyModule('gzip')
+multiprocessing = _LazyModule('multiprocessing')
+socket = _LazyModule('socket')
+sqlite3 = _LazyModule('sqlite3')
+subprocess = _LazyModule('subprocess')
+tempfile = _LazyModule('tempfile')
+
+# Additional Dependencies (imported on first use)
+yaml = _LazyModule('yaml', 'Unable to import PyYAML library')
+
+# Custom Modules (imported on first use)
+emails = _LazyModule('emails', 'Unable to import email definitions')
     
 # --------------------------------------
 
@@ -55,12 +98,421 @@ C_RED    = '\033[91m'
 C_END    = '\033[0m'
 C_BOLD   = '\033[1m'
 
+# The chunker parameters tried by "--bench-target" (from small chunks suited to
+# small or frequently modified files up to large chunks suited to disk images),
+# the minimum share of the highest throughput a setting must achieve in order to
+# be chosen, the approximate size (in bytes) of an entry of the chunk index, and
+# the share of the sampled files modified between the two benchmark backups.
+BENCH_CHUNKER_PARAMS = ['10,23,16,4095', '14,23,18,4095', '19,23,21,4095', '20,23,22,4095']
+BENCH_MIN_THROUGHPUT = 0.5
+BENCH_INDEX_ENTRY = 44
+BENCH_CHANGED = 0.1
+
+# The parameters of "--checkpoint-int auto": the number of past runs of a target
+# considered, the estimated cost (in seconds) of writing a checkpoint, the
+# targeted average amount of data re-sent after a failed backup, the interval
+# used in the absence of history, and the bounds of the chosen interval.
+CHECKPOINT_RUNS = 50
+CHECKPOINT_COST = 30
+CHECKPOINT_RESEND = 256 * 1024 * 1024
+CHECKPOINT_DEFAULT = 900
+CHECKPOINT_MIN = 60
+CHECKPOINT_MAX = 3600
+
+# The parameters of "compression: auto": the compression used when it cannot be
+# evaluated, the settings evaluated, the fraction of the files of a target
+# sampled, the maximum number of bytes read from each sampled file and in total,
+# the bandwidth (in bytes per second) assumed when it is not limited by
+# "rate_limit", and the minimum share of the highest effective throughput a
+# setting must achieve in order to be chosen for its better compression ratio.
+COMPRESSION_DEFAULT = 'lz4'
+COMPRESSION_CANDIDATES = ['none', 'lz4', 'zstd,1', 'zstd,3', 'zstd,6', 'zlib,1', 'zlib,6']
+COMPRESSION_SAMPLE_FRACTION = 0.01
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+COMPRESSION_SAMPLE_SIZE = 32 * 1024 * 1024
+COMPRESSION_BANDWIDTH = 125 * 1000 * 1000
+COMPRESSION_TOLERANCE = 0.9
+
+# The format version of the compiled configuration cache.
+CONFIG_CACHE_VERSION = 1
+
+# The command through which emails are delivered (reading the message, including
+# its headers, from stdin), and the number of seconds after which an email that
+# is still being delivered is assumed to have been abandoned and is retried.
+SENDMAIL = '/usr/sbin/sendmail -t'
+MAIL_STALE_AGE = 3600
+
+# The maximum number of seconds to wait for the hostname of a destination
+# server to resolve, and for the FQDN of the machine to resolve when sending an
+# email.
+DNS_TIMEOUT = 5
+FQDN_TIMEOUT = 2
+
+# The maximum number of concurrent SSH connections of "--probe-servers", and the
+# number of seconds after which each of them times out.
+PROBE_JOBS = 16
+PROBE_TIMEOUT = 10
+
+# The number of seconds between scheduling passes of "--daemon", and the maximum
+# number of seconds it waits before retrying a failed target.
+DAEMON_INTERVAL = 30
+DAEMON_RETRY_DELAY = 900
+
+# The minimum number of seconds between restarts of a running backup in order to
+# apply a rebalanced share of the bandwidth budget of its destination server.
+RESHARE_INTERVAL = 60
+
+# The inotify(7) flags used by "--watch".
+IN_ATTRIB      = 0x00000004
+IN_CLOEXEC     = 0o2000000
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_IGNORED     = 0x00008000
+IN_ISDIR       = 0x40000000
+IN_MODIFY      = 0x00000002
+IN_MOVE_SELF   = 0x00000800
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_Q_OVERFLOW  = 0x00004000
+
+# The maximum number of bytes read from (or written to) a subprocess pipe at a
+# time by "_pump_processes()".
+PIPE_CHUNK_SIZE = 65536
+
+# The number of recent runs listed by "--history", and the percentiles of past
+# runs it reports.
+HISTORY_RUNS = 10
+HISTORY_PERCENTILES = [50, 90, 99]
+
+# The number of seconds between samples of the memory usage of the subprocesses
+# of the script when "--profile" is specified.
+PROFILE_SAMPLE_INTERVAL = 0.5
+
+# The pattern of the separator lines delimiting the statistics blocks printed by
+# borg (via "--stats"), the maximum number of lines of a single block, and the
+# maximum number of statistics lines retained by an output capture.
+STATS_SEPARATOR = re.compile(r'^-{20,}$')
+STATS_BLOCK_LINES = 32
+STATS_MAX_LINES = 256
+
+# The number of seconds between periodic journal writes of "--watch", and the
+# maximum number of seconds a backup waits for the watcher to sync its journal.
+WATCH_FLUSH_INTERVAL = 60
+WATCH_SYNC_TIMEOUT = 10
+
+# The number of threads over which "_resolve_pattern()" fans out the expansion
+# of a wildcard, and the minimum number of directories to expand before it does.
+RESOLVER_THREADS = 8
+RESOLVER_FANOUT = 32
+
+# Environment variables passed to worker processes when executing multiple
+# targets, along with the corresponding attribute of "args".
+WORKER_ENVIRONMENT = [
+    ('BACKUPUTIL_BORG_PATH', 'borg_executable'),
+    ('BACKUPUTIL_CERT_PATH', 'cert_path'),
+    ('BACKUPUTIL_COMP_TTL', 'compression_ttl'),
+    ('BACKUPUTIL_CP_INTERVAL', 'checkpoint_interval'),
+    ('BACKUPUTIL_CONFIG_FILE', 'config_file'),
+    ('BACKUPUTIL_EMAIL_DGST', 'email_digest'),
+    ('BACKUPUTIL_EMAIL_LVL', 'email_level'),
+    ('BACKUPUTIL_EMAIL_THR', 'email_thresholds'),
+    ('BACKUPUTIL_EMAIL_TO', 'email_to'),
+    ('BACKUPUTIL_LOG_FILE', 'log_file'),
+    ('BACKUPUTIL_LOG_LVL', 'log_level'),
+    ('BACKUPUTIL_METRICS_DIR', 'metrics_dir'),
+    ('BACKUPUTIL_OUT_LINES', 'output_lines'),
+    ('BACKUPUTIL_PASSWORD', 'password'),
+    ('BACKUPUTIL_POST_RUN', 'post_run'),
+    ('BACKUPUTIL_PRE_RUN', 'pre_run'),
+    ('BACKUPUTIL_RATE_LIMIT', 'rate_limit'),
+    ('BACKUPUTIL_REPORT_FILE', 'report_file'),
+    ('BACKUPUTIL_SSH_PERSIST', 'ssh_persist'),
+    ('BACKUPUTIL_STATE_DIR', 'state_dir'),
+    ('BACKUPUTIL_TIMESTAMP', 'timestamp_format'),
+    ('BACKUPUTIL_USER', 'user'),
+    ('BACKUPUTIL_VERIFY_TTL', 'verify_ttl'),
+    ('BACKUPUTIL_WAIT_LOCK', 'wait_lock')
+]
+
+# The maximum length of the path of an SSH control socket (leaving room for the
+# temporary suffix appended by ssh while creating it within the limit of 104
+# bytes imposed by some platforms).
+SSH_CONTROL_PATH_MAX = 80
+
+# The FQDN of the machine, once resolved by "_fqdn()".
+fqdn = None
+
+# The number of emails (or digest notifications) spooled by this process so far,
+# keeping the names of their spool files unique.
+mail_sequence = 0
+
+# The pipes of the subprocesses started by "_start_process()", keyed by their
+# file descriptors.
+process_streams = {}
+
+# The memoized results of "_resolve_pattern()" and "_list_directory()".
+resolved_patterns = {}
+directory_listings = {}
+
+# The (pending or completed) hostname resolutions of "_resolve_host()", keyed
+# by hostname.
+resolved_hosts = {}
+resolved_hosts_lock = threading.Lock()
+
+# The report of the current backup run (see "write_run_report()"), along with
+# the name, start time, and resource usage snapshot of its current phase.
+run_report = None
+run_phase = None
+
+# The resource usage of the completed phases of the run (see "--profile"), and
+# the peak memory usage of the subprocesses sampled during the current phase.
+run_profile = []
+profile_peak = {'rss': 0, 'sampler': None}
+
 # --------------------------------------
 
 
 
 # ---------- Private Functions ---------
 
+def _auto_checkpoint_interval():
+    '''
+    Returns a tuple of the checkpoint interval (in seconds) to use for the
+    target, as derived from its run history, and a description of how it was
+    derived.
+
+    The interval follows Young's approximation "sqrt(2 * C * MTBF)", where "C" is
+    the cost of writing a checkpoint and "MTBF" the mean time between failures of
+    the backup phase (estimated from the failure rate and the median duration
+    of the phase). If backups of the target have failed, the interval is further
+    limited so that a failure re-sends "CHECKPOINT_RESEND" bytes on average at
+    the median throughput of the target.
+    '''
+    db = _history_db()
+    rows = db.execute(
+        "SELECT runs.exit_code, runs.deduplicated_size, phases.duration FROM runs LEFT JOIN phases ON phases.run_id = runs.id AND phases.phase = 'create' WHERE runs.target = ? AND runs.skipped = 0 AND (runs.exit_code = 0 OR runs.failed_phase = 'create') ORDER BY runs.started DESC LIMIT ?",
+        (args.target, CHECKPOINT_RUNS)
+    ).fetchall()
+    db.close()
+    successes = [(size, duration) for (exit_code, size, duration) in rows if exit_code == 0 and size and duration]
+    if not successes:
+        return (CHECKPOINT_DEFAULT, 'no recorded throughput')
+    failures = len([r for r in rows if r[0] != 0])
+    throughput = _percentile([size / duration for (size, duration) in successes], 50)
+    failure_rate = (failures + 1.0) / (len(rows) + 2)
+    interval = math.sqrt(2 * CHECKPOINT_COST * _percentile([d for (s, d) in successes], 50) / failure_rate)
+    if failures:
+        interval = min(interval, 2.0 * CHECKPOINT_RESEND / throughput)
+    interval = int(max(CHECKPOINT_MIN, min(CHECKPOINT_MAX, interval)))
+    return (interval, 'throughput: ' + _format_bytes(throughput) + '/s, ' + str(failures) + ' of ' + str(len(rows)) + ' runs failed, expected re-send per failure: ' + _format_bytes(throughput * interval / 2))
+
+
+def _auto_compression():
+    '''
+    Returns a tuple of the borg compression setting to use for the target and a
+    description of how it was chosen. The choice is re-used for "--compression-
+    ttl" seconds, as long as the source paths, bandwidth, and CPU cores available
+    to the target stay the same.
+
+    Each setting is evaluated by backing up blocks sampled from the source paths
+    of the target into a throwaway repository with the borg executable, yielding
+    its compression ratio and speed (settings the borg executable does not
+    support are left out). The speed is scaled
+    by the share of the CPU cores of the host available to each borg process of
+    the target (borg compresses on a single core), and the effective throughput
+    of the setting is the lower of this speed and the bandwidth multiplied by the
+    compression ratio. Among the settings achieving "COMPRESSION_TOLERANCE" of
+    the highest effective throughput, the one with the best ratio is chosen.
+    '''
+    state_path = os.path.join('compression', args.target + '.json')
+    cores = multiprocessing.cpu_count()
+    if dst_srv and rate_limit != '0':
+        bandwidth = int(rate_limit) * 1024
+    else:
+        bandwidth = COMPRESSION_BANDWIDTH
+    key = {'sources': src_paths, 'exclude': exclude_paths, 'bandwidth': bandwidth, 'cores': cores, 'processes': len(shard_repos)}
+    state = _load_state(state_path, {})
+    age = time.time() - state.get('evaluated', 0)
+    if state.get('key') == key and 0 <= age < args.compression_ttl:
+        return (state['compression'], state['reason'] + ', evaluated ' + str(datetime.timedelta(seconds=int(age))) + ' ago')
+    (sample, sample_size) = _sample_sources(COMPRESSION_SAMPLE_FRACTION)
+    if not sample:
+        (sample, sample_size) = _sample_sources(1)
+    blocks = []
+    total = 0
+    for path in sorted(sample, key=lambda p: hashlib.sha1(p if isinstance(p, bytes) else p.encode('utf-8')).hexdigest()):
+        try:
+            with open(path, 'rb') as f:
+                block = f.read(min(COMPRESSION_BLOCK_SIZE, COMPRESSION_SAMPLE_SIZE - total))
+        except (IOError, OSError):
+            continue
+        if block:
+            blocks.append(block)
+            total += len(block)
+        if total >= COMPRESSION_SAMPLE_SIZE: break
+    if not total:
+        return (COMPRESSION_DEFAULT, 'no source data to sample')
+    cpu_share = min(1.0, cores / float(len(shard_repos)))
+    results = []
+    eval_dir = tempfile.mkdtemp(prefix='backuputil-compression-')
+    try:
+        sample_path = os.path.join(eval_dir, 'sample')
+        with open(sample_path, 'wb') as f:
+            for block in blocks: f.write(block)
+        env = _scratch_environment(eval_dir)
+        for (i, name) in enumerate(COMPRESSION_CANDIDATES):
+            repo = os.path.join(eval_dir, 'repo-' + str(i))
+            cmds = [
+                '{borg} --log-json init --encryption none \'{repo}\'',
+                '{borg} --log-json create --json --compression {compression} \'{repo}\'::sample \'{sample}\''
+            ]
+            stats = None
+            for cmd in cmds:
+                cmd = cmd.format(borg=args.borg_executable, compression=name, repo=repo, sample=sample_path)
+                logging.debug('Compression Command: ' + cmd)
+                cmd_results = []
+                (output, exit_codes) = _stream_processes([cmd], 'COMPRESSION', results=cmd_results, env=env)
+                if exit_codes[0] > 1: break
+                stats = cmd_results[0]['json']
+            shutil.rmtree(repo, ignore_errors=True)
+            if exit_codes[0] > 1 or not stats:
+                logging.debug('Not evaluating "' + name + '" compression - borg returned exit code ' + str(exit_codes[0]) + '.')
+                continue
+            original_size = stats['archive']['stats']['original_size']
+            speed = original_size / max(stats['archive']['duration'], 0.001) * cpu_share
+            ratio = original_size / float(max(stats['archive']['stats']['compressed_size'], 1))
+            results.append({'compression': name, 'ratio': ratio, 'speed': speed, 'throughput': min(speed, bandwidth * ratio)})
+    finally:
+        shutil.rmtree(eval_dir, ignore_errors=True)
+    if not results:
+        raise Exception('the borg executable was unable to back up the sample')
+    for r in results:
+        logging.debug('Compression "' + r['compression'] + '": ratio %.2f, speed %s/s, effective throughput %s/s' % (
+            r['ratio'],
+            _format_bytes(r['speed']),
+            _format_bytes(r['throughput'])
+        ))
+    fastest = max([r['throughput'] for r in results])
+    best = max([r for r in results if r['throughput'] >= fastest * COMPRESSION_TOLERANCE], key=lambda r: r['ratio'])
+    reason = 'ratio %.2f, effective throughput %s/s at %s/s bandwidth and %d core(s), sampled %s' % (
+        best['ratio'],
+        _format_bytes(best['throughput']),
+        _format_bytes(bandwidth),
+        cores,
+        _format_bytes(total)
+    )
+    _save_state(state_path, {'key': key, 'evaluated': time.time(), 'compression': best['compression'], 'reason': reason, 'results': results})
+    return (best['compression'], reason)
+
+
+def _bench_changes(sample, changed_dir):
+    '''
+    Writes a modified copy of a slice ("BENCH_CHANGED") of the specified sampled
+    files into the specified directory, standing in for the changes made to the
+    target between two backups. Each copy has a few bytes inserted at an offset
+    derived from a hash of its path, so that repeated benchmarks make the same
+    changes. Returns a dictionary mapping each changed file to its copy.
+    '''
+    def digest(path):
+        return hashlib.sha1(b'bench:' + (path if isinstance(path, bytes) else path.encode('utf-8'))).digest()
+    ranked = sorted(sample, key=digest)
+    changes = {}
+    os.mkdir(changed_dir)
+    for path in ranked[:max(1, int(round(len(sample) * BENCH_CHANGED)))]:
+        insert = digest(path)
+        copy = os.path.join(changed_dir, str(len(changes)))
+        remaining = struct.unpack('>I', insert[:4])[0] % (os.path.getsize(path) + 1)
+        with open(path, 'rb') as src:
+            with open(copy, 'wb') as dst:
+                while remaining > 0:
+                    block = src.read(min(remaining, 1048576))
+                    if not block: break
+                    dst.write(block)
+                    remaining -= len(block)
+                dst.write(insert)
+                shutil.copyfileobj(src, dst)
+        changes[path] = copy
+    return changes
+
+
+def _bench_chunker_params(bench_dir, patterns_paths, chunker_params):
+    '''
+    Backs up the sample described by the first of the specified patterns files,
+    then the changed sample described by the second, into a throwaway repository
+    within the specified directory using the specified chunker parameters.
+    Returns a dictionary of the throughput of the first backup, the combined
+    original and deduplicated size of both backups, the deduplicated size of the
+    second backup, and the number of unique chunks stored in the repository.
+    '''
+    repo = os.path.join(bench_dir, 'repo')
+    env = _scratch_environment(bench_dir)
+    cmds = [
+        ('init', '{borg} --log-json init --encryption none {repo}'),
+        ('create', '{borg} --log-json create --json --chunker-params {params} --patterns-from {patterns[0]} {repo}::bench-1'),
+        ('create', '{borg} --log-json create --json --chunker-params {params} --patterns-from {patterns[1]} {repo}::bench-2'),
+        ('info', '{borg} --log-json info --json {repo}')
+    ]
+    documents = []
+    try:
+        for (command, cmd) in cmds:
+            cmd = cmd.format(
+                borg = args.borg_executable,
+                params = chunker_params,
+                patterns = patterns_paths,
+                repo = repo
+            )
+            logging.debug('Benchmark Command: ' + cmd)
+            results = []
+            (output, exit_codes) = _stream_processes([cmd], 'BENCH', results=results, env=env)
+            if exit_codes[0] > 1:
+                raise Exception('"borg ' + command + '" returned exit code ' + str(exit_codes[0]))
+            if command != 'init':
+                if results[0]['json'] is None:
+                    raise Exception('"borg ' + command + '" did not report any statistics')
+                documents.append(results[0]['json'])
+    finally:
+        shutil.rmtree(repo, ignore_errors=True)
+        shutil.rmtree(env['BORG_CACHE_DIR'], ignore_errors=True)
+    stats = [d['archive']['stats'] for d in documents[:2]]
+    return {
+        'chunker_params': chunker_params,
+        'throughput': stats[0]['original_size'] / max(documents[0]['archive']['duration'], 0.001),
+        'original_size': stats[0]['original_size'] + stats[1]['original_size'],
+        'deduplicated_size': stats[0]['deduplicated_size'] + stats[1]['deduplicated_size'],
+        'changed_size': stats[1]['deduplicated_size'],
+        'chunks': documents[2]['cache']['stats']['total_unique_chunks']
+    }
+
+
+def _borg_log_line(line, result=None):
+    '''
+    Converts the specified line of "--log-json" output of borg into its plain
+    text equivalent, returning "None" for progress records. If a result
+    dictionary is given, the archives pruned and kept are counted within it.
+    '''
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return line
+    if not isinstance(record, dict): return line
+    if record.get('type') == 'log_message':
+        message = record.get('message', '')
+        if result is not None and record.get('name') == 'borg.output.list':
+            if message.startswith('Pruning archive') or message.startswith('Would prune'):
+                result['pruned'] += 1
+            elif message.startswith('Keeping archive'):
+                result['kept'] += 1
+        return message
+    if record.get('type') == 'file_status':
+        return record.get('status', '') + ' ' + record.get('path', '')
+    if record.get('type') in ['archive_progress', 'progress_message', 'progress_percent']:
+        return None
+    return line
+
+
 def _c(instring, color=C_BLUE):
     '''
     Colorizes the specified string.
@@ -71,32 +523,600 @@ def _c(instring, color=C_BLUE):
         return instring
 
 
+def _capture_line(capture, line, source=0):
+    '''
+    Records the specified line of output (produced by the specified source) in
+    the specified output capture. Only the first and last "--output-lines" lines
+    and the statistics blocks printed by borg are retained in memory, while the
+    complete output is spilled to the compressed file at the path of the capture
+    once the first lines have been retained.
+    '''
+    capture['count'] += 1
+    raw = line.rstrip('\n')
+    if capture['prefix'] and raw.startswith('[' + str(source) + '] '): raw = raw[len(str(source)) + 3:]
+    block = capture['blocks'].get(source)
+    if block is None and STATS_SEPARATOR.match(raw):
+        block = capture['blocks'][source] = {'chunks': False, 'lines': 0}
+    elif block is not None:
+        block['lines'] += 1
+        if raw.startswith('Chunk index:') or raw.startswith('Deleted data:'):
+            block['chunks'] = True
+        elif (STATS_SEPARATOR.match(raw) and block['chunks']) or block['lines'] >= STATS_BLOCK_LINES:
+            del capture['blocks'][source]
+    if len(capture['head']) < args.output_lines:
+        capture['head'].append(line)
+        return
+    if capture['spill'] is None:
+        _makedirs(os.path.dirname(capture['path']))
+        fd = os.open(capture['path'], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        capture['spill'] = gzip.GzipFile(fileobj=os.fdopen(fd, 'wb'), mode='wb')
+        for l in capture['head']: capture['spill'].write(l if isinstance(l, bytes) else l.encode('utf-8'))
+    capture['spill'].write(line if isinstance(line, bytes) else line.encode('utf-8'))
+    if block is not None:
+        capture['stats'].append((capture['count'], line))
+    else:
+        capture['tail'].append((capture['count'], line))
+
+
+def _capture_output(capture):
+    '''
+    Closes the specified output capture, returning the retained output as a
+    string. If any lines were omitted, the path of the file holding the complete
+    (gzip-compressed) output is noted in their place, otherwise the file (along
+    with the file left behind by a previous run) is removed.
+    '''
+    retained = sorted(list(capture['tail']) + list(capture['stats']))
+    omitted = capture['count'] - len(capture['head']) - len(retained)
+    output = ''.join(capture['head'])
+    if capture['spill'] is not None:
+        fileobj = capture['spill'].fileobj
+        capture['spill'].close()
+        fileobj.close()
+    if omitted:
+        output += '[... ' + str(omitted) + ' lines omitted - the complete output has been saved to "' + capture['path'] + '" ...]\n'
+    elif os.path.exists(capture['path']):
+        os.remove(capture['path'])
+    return output + ''.join([line for (i, line) in retained])
+
+
+def _config_cache_path():
+    '''
+    Returns the path of the compiled configuration cache of the configuration
+    file.
+    '''
+    return os.path.join(args.state_dir, 'config', hashlib.sha1(os.path.abspath(args.config_file).encode('utf-8')).hexdigest()[:16] + '.cache')
+
+
+def _config_dir():
+    '''
+    Returns the path of the "conf.d"-style directory accompanying the
+    configuration file (for example "/etc/backuputil.d" for
+    "/etc/backuputil.yaml").
+    '''
+    return os.path.splitext(args.config_file)[0] + '.d'
+
+
+def _config_files():
+    '''
+    Returns the list of paths of the configuration file followed by the target
+    files within its accompanying directory (if any), in sorted order.
+    '''
+    try:
+        names = sorted([n for n in os.listdir(_config_dir()) if n.endswith('.yaml') or n.endswith('.yml')])
+    except OSError:
+        names = []
+    return [args.config_file] + [os.path.join(_config_dir(), n) for n in names]
+
+
+def _config_stamp():
+    '''
+    Returns a tuple identifying the current version of the configuration file and
+    its accompanying target files (or "None" if it cannot be accessed).
+    '''
+    stamp = []
+    try:
+        for path in _config_files():
+            st = os.stat(path)
+            stamp.append((path, st.st_mtime, st.st_size))
+    except OSError:
+        return None
+    return tuple(stamp)
+
+
+def _deliver_mail():
+    '''
+    Hands each email within the spool of outgoing emails to sendmail in the
+    background, returning the number of emails handed over. If sendmail fails,
+    the email is left in the spool (along with the error output of sendmail) to
+    be logged and retried by the next delivery. When "--email-digest" is set,
+    the queued notifications are first combined into one summary email per
+    recipient once the oldest of them is older than "--email-digest" seconds, or
+    once the number of queued notifications of any level reaches its threshold
+    in "--email-thresholds".
+    '''
+    mail_dir = os.path.join(args.state_dir, 'mail')
+    digest_dir = os.path.join(mail_dir, 'digest')
+    outgoing_dir = os.path.join(mail_dir, 'outgoing')
+    if os.path.isdir(digest_dir):
+        with open(os.path.join(mail_dir, 'digest.lock'), 'a') as digest_lock:
+            fcntl.flock(digest_lock.fileno(), fcntl.LOCK_EX)
+            names = sorted([n for n in os.listdir(digest_dir) if n.endswith('.json')])
+            events = [e for e in [_load_state(os.path.join('mail', 'digest', n)) for n in names] if e]
+            if events:
+                thresholds = _email_thresholds()
+                counts = collections.Counter([e['level'] for e in events])
+                if time.time() - min([e['time'] for e in events]) >= args.email_digest or [l for l in counts if thresholds.get(l) and counts[l] >= thresholds[l]]:
+                    for to in sorted(set([e['to'] for e in events])):
+                        _spool_email(_format_digest([e for e in events if e['to'] == to]))
+                    for name in names:
+                        os.remove(os.path.join(digest_dir, name))
+    delivered = 0
+    if not os.path.isdir(outgoing_dir): return delivered
+    for name in sorted(os.listdir(outgoing_dir)):
+        path = os.path.join(outgoing_dir, name)
+        if name.endswith('.sending') and time.time() - os.path.getmtime(path) > MAIL_STALE_AGE:
+            try:
+                os.rename(path, path.rsplit('.', 2)[0] + '.eml')
+            except OSError:
+                pass
+            continue
+        if name.endswith('.failed'):
+            base = path[:-len('.failed')]
+            try:
+                with open(base + '.error', 'r') as f:
+                    error = ' '.join([l.strip() for l in f.read().splitlines() if l.strip()][-1:])
+            except (IOError, OSError):
+                error = ''
+            try:
+                os.rename(path, base + '.eml')
+            except OSError:
+                continue
+            logging.warning('Unable to deliver email "' + os.path.basename(base) + '" via sendmail' + (' - ' + error if error else '') + ' (retrying).')
+            (name, path) = (os.path.basename(base) + '.eml', base + '.eml')
+        if not name.endswith('.eml'): continue
+        base = path[:-len('.eml')]
+        sending = base + '.' + str(os.getpid()) + '.sending'
+        try:
+            os.rename(path, sending)
+        except OSError:
+            continue
+        os.utime(sending, None)
+        subprocess.Popen(
+            ['sh', '-c', '(' + SENDMAIL + ' < "$1" 2>"$3" && rm -f "$1" "$3" || mv -f "$1" "$2") </dev/null >/dev/null 2>&1 &', 'sh', sending, base + '.failed', base + '.error']
+        ).wait()
+        delivered += 1
+    return delivered
+
+
+def _dependency_cycle(targets):
+    '''
+    Returns a list of target names forming a cycle within the "depends_on"
+    graph of the specified target specifications, or "None" if the graph is
+    acyclic.
+    '''
+    state = {}
+    def visit(name, path):
+        state[name] = 'visiting'
+        for d in _target_list(targets[name].get('depends_on')):
+            if state.get(d) == 'visiting': return path[path.index(d):] + [d]
+            if not d in state:
+                cycle = visit(d, path + [d])
+                if cycle: return cycle
+        state[name] = 'visited'
+        return None
+    for name in sorted(targets):
+        if not name in state and isinstance(targets[name], dict):
+            cycle = visit(name, [name])
+            if cycle: return cycle
+    return None
+
+
+def _digest_tree(path, digest):
+    '''
+    Feeds the path, size, modification time, status change time (covering
+    permission and ownership changes), and inode number of the specified
+    path and everything beneath it (minus any excluded paths) into the specified
+    hash object in a stable order, without following symbolic links.
+    '''
+    pending = [path]
+    while pending:
+        p = pending.pop()
+        if _is_excluded(p): continue
+        try:
+            st = os.lstat(p)
+        except OSError as e:
+            line = 'error\0' + p + '\0' + str(e.errno) + '\n'
+        else:
+            line = '{path}\0{size}\0{mtime!r}\0{ctime!r}\0{inode}\n'.format(
+                path = p,
+                size = st.st_size,
+                mtime = st.st_mtime,
+                ctime = st.st_ctime,
+                inode = st.st_ino
+            )
+            if stat.S_ISDIR(st.st_mode):
+                try:
+                    if hasattr(os, 'scandir'):
+                        names = [e.name for e in os.scandir(p)]
+                    else:
+                        names = os.listdir(p)
+                    pending.extend([os.path.join(p, n) for n in sorted(names, reverse=True)])
+                except OSError as e:
+                    line += 'error\0' + p + '\0' + str(e.errno) + '\n'
+        if not isinstance(line, bytes): line = line.encode('utf-8', 'replace')
+        digest.update(line)
+
+
+def _email_thresholds():
+    '''
+    Returns the dictionary of the per-level thresholds specified by
+    "--email-thresholds".
+    '''
+    return dict([(l, int(n)) for (l, n) in re.findall(r'(error|warning|info)=(\d+)', args.email_thresholds)])
+
+
+def _estimate_size(path):
+    '''
+    Estimates the size (in bytes) of the specified file or directory tree.
+    '''
+    try:
+        if not os.path.isdir(path) or os.path.islink(path): return os.lstat(path).st_size
+    except OSError:
+        return 0
+    size = 0
+    for (root, dirs, files) in os.walk(path):
+        for f in files:
+            try:
+                size += os.lstat(os.path.join(root, f)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def _format_archive_stats(document):
+    '''
+    Formats the statistics of the archive described by the specified "--json"
+    output of "borg create" as human-readable lines.
+    '''
+    archive = document['archive']
+    stats = archive['stats']
+    return ''.join([
+        'Archive name: ' + archive['name'] + '\n',
+        'Duration: ' + str(datetime.timedelta(seconds=int(archive['duration']))) + '\n',
+        'Number of files: ' + str(stats['nfiles']) + '\n',
+        'Original size: ' + _format_bytes(stats['original_size']) + '\n',
+        'Compressed size: ' + _format_bytes(stats['compressed_size']) + '\n',
+        'Deduplicated size: ' + _format_bytes(stats['deduplicated_size']) + '\n'
+    ])
+
+
+def _format_bytes(size):
+    '''
+    Formats the specified number of bytes as a human-readable string.
+    '''
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if abs(size) < 1024 or unit == 'TiB': break
+        size = size / 1024.0
+    if unit == 'B': return str(int(size)) + ' B'
+    return '%.1f %s' % (size, unit)
+
+
+def _format_digest(events):
+    '''
+    Formats the specified list of queued notifications into a single summary
+    email message.
+    '''
+    events = sorted(events, key=lambda e: e['time'])
+    counts = collections.Counter([e['level'] for e in events])
+    if counts['error']:
+        level = 'error'
+    elif counts['warning']:
+        level = 'warning'
+    else:
+        level = 'info'
+    subject = 'Digest of {n} notifications ({errors} errors, {warnings} warnings)'.format(
+        n = len(events),
+        errors = counts['error'],
+        warnings = counts['warning']
+    )
+    body = 'The backuputil script reports the following notifications since ' + datetime.datetime.fromtimestamp(events[0]['time']).strftime('%Y-%m-%d %H:%M:%S') + ':'
+    for e in events:
+        if e['level'] == 'info':
+            body += '\n\n[' + datetime.datetime.fromtimestamp(e['time']).strftime('%Y-%m-%d %H:%M:%S') + '] ' + e['subject']
+        else:
+            body += '\n\n[' + datetime.datetime.fromtimestamp(e['time']).strftime('%Y-%m-%d %H:%M:%S') + '] ' + e['level'].upper() + ': ' + e['subject']
+        body += '\n' + '\n'.join([('    ' + l).rstrip() for l in e['body'].split('\n')])
+    return _format_email(events[-1]['to'], subject, body, level)
+
+
+def _format_email(to, subject, body, level):
+    '''
+    Formats an email message with the specified recipients, subject, body, and
+    alert level.
+    '''
+    subject = 'backuputil@' + _fqdn() + ' - ' + subject
+    if level == 'error':
+        full_subject = 'ERROR: ' + subject
+        full_body = body + '\n\nSee "' + args.log_file + '" on the machine for more details.'
+    elif level == 'warning':
+        full_subject = 'WARNING: ' + subject
+        full_body = body + '\n\nSee "' + args.log_file + '" on the machine for more details.'
+    else:
+        full_subject = subject
+        full_body = body
+    message = 'To: ' + to + '\n'
+    message += 'Subject: ' + full_subject + '\n\n'
+    message += full_body
+    return message
+
+
+def _fqdn():
+    '''
+    Returns the FQDN of the machine, resolving it on first use. Since
+    "socket.getfqdn()" may block for a long time on a broken resolver, the
+    hostname is returned instead if it takes longer than "FQDN_TIMEOUT" seconds.
+    '''
+    global fqdn
+    if fqdn is None:
+        result = []
+        resolver = threading.Thread(target=lambda: result.append(socket.getfqdn()))
+        resolver.daemon = True
+        resolver.start()
+        resolver.join(FQDN_TIMEOUT)
+        if result:
+            fqdn = result[0]
+        else:
+            fqdn = os.uname()[1]
+            logging.warning('Unable to resolve FQDN within ' + str(FQDN_TIMEOUT) + ' seconds - using hostname instead.')
+        logging.debug('FQDN: ' + fqdn)
+    return fqdn
+
+
+def _history_db():
+    '''
+    Returns a connection to the run history database within the state
+    directory, creating its tables if necessary.
+    '''
+    _makedirs(args.state_dir)
+    db = sqlite3.connect(os.path.join(args.state_dir, 'history.db'), timeout=60)
+    db.execute('CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY, target TEXT, hostname TEXT, started REAL, finished REAL, duration REAL, exit_code INTEGER, failed_phase TEXT, skipped INTEGER, archive TEXT, files INTEGER, original_size INTEGER, compressed_size INTEGER, deduplicated_size INTEGER, pruned_archives INTEGER)')
+    db.execute('CREATE TABLE IF NOT EXISTS phases (run_id INTEGER, phase TEXT, duration REAL)')
+    db.execute('CREATE INDEX IF NOT EXISTS runs_target ON runs (target, started)')
+    db.execute('CREATE INDEX IF NOT EXISTS phases_run_id ON phases (run_id)')
+    return db
+
+
+def _inotify_events():
+    '''
+    Reads the pending inotify events, returning a list of tuples of the watch
+    descriptor, the event mask, and the name of the affected directory entry.
+    '''
+    data = os.read(inotify_fd, 65536)
+    events = []
+    offset = 0
+    while offset < len(data):
+        (wd, mask, cookie, length) = struct.unpack_from('iIII', data, offset)
+        name = data[offset + 16:offset + 16 + length].rstrip(b'\0')
+        if not isinstance(name, str): name = name.decode('utf-8', 'replace')
+        events.append((wd, mask, name))
+        offset += 16 + length
+    return events
+
+
+def _inotify_watch(path):
+    '''
+    Adds inotify watches for the specified path and every directory beneath it
+    (minus any excluded paths). Returns whether all of them could be added.
+    '''
+    complete = True
+    pending = [path]
+    while pending:
+        p = pending.pop()
+        if _is_excluded(p): continue
+        wd = inotify_libc.inotify_add_watch(
+            inotify_fd,
+            getattr(os, 'fsencode', str)(p),
+            IN_ATTRIB | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_DONT_FOLLOW | IN_EXCL_UNLINK | IN_MODIFY | IN_MOVE_SELF | IN_MOVED_FROM | IN_MOVED_TO
+        )
+        if wd < 0:
+            e = ctypes.get_errno()
+            if e in [errno.ENOENT, errno.ENOTDIR]: continue
+            logging.warning('Unable to watch "' + p + '" - ' + os.strerror(e) + '.')
+            complete = False
+            continue
+        inotify_watches[wd] = p
+        if not os.path.isdir(p) or os.path.islink(p): continue
+        try:
+            if hasattr(os, 'scandir'):
+                pending.extend([e.path for e in os.scandir(p) if e.is_dir(follow_symlinks=False)])
+            else:
+                pending.extend([c for c in [os.path.join(p, n) for n in os.listdir(p)] if os.path.isdir(c) and not os.path.islink(c)])
+        except OSError as e:
+            logging.warning('Unable to watch the contents of "' + p + '" - ' + str(e) + '.')
+            complete = False
+    return complete
+
+
+def _is_excluded(path):
+    '''
+    Returns whether the specified path is matched by any of the exclusion
+    patterns of the target (following the semantics of borg's default "fm:"
+    pattern style).
+    '''
+    p = path.lstrip('/')
+    for e in exclude_paths:
+        pattern = e.lstrip('/').rstrip('/')
+        if p == pattern or p.startswith(pattern + '/') or fnmatch.fnmatch(p, pattern): return True
+    return False
+
+
+def _list_directory(path):
+    '''
+    Returns the (memoized) list of tuples of the name of each entry of the
+    specified directory, whether it is a directory, and whether it is a
+    symbolic link, or an empty list if the directory can not be read.
+    '''
+    path = path or '.'
+    if not path in directory_listings:
+        try:
+            if hasattr(os, 'scandir'):
+                entries = [(e.name, e.is_dir(), e.is_symlink()) for e in os.scandir(path)]
+            else:
+                entries = [(n, os.path.isdir(os.path.join(path, n)), os.path.islink(os.path.join(path, n))) for n in os.listdir(path)]
+        except OSError:
+            entries = []
+        directory_listings[path] = entries
+    return directory_listings[path]
+
+
+def _load_state(path, default=None):
+    '''
+    Loads the JSON data stored at the specified path relative to the state
+    directory, returning the specified default if it does not exist or cannot
+    be read.
+    '''
+    try:
+        with open(os.path.join(args.state_dir, path), 'r') as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def _lock_turn(queue_dir, ticket):
+    '''
+    Returns whether the specified lock ticket is at the front of the specified
+    lock queue directory, discarding any stale tickets of dead processes ahead of
+    it along the way.
+    '''
+    for t in sorted(os.listdir(queue_dir)):
+        if t == os.path.basename(ticket): return True
+        if _pid_alive(int(t.rsplit('-', 1)[1])): return False
+        logging.debug('Discarding stale lock ticket "' + t + '"...')
+        try:
+            os.remove(os.path.join(queue_dir, t))
+        except OSError:
+            pass
+    return True
+
+
+def _makedirs(path):
+    '''
+    Creates the specified directory (and any missing parents) if it does not
+    already exist.
+    '''
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not os.path.isdir(path): raise
+
+
+def _match_component(base, part, last):
+    '''
+    Returns the paths beneath the specified directory matching the specified
+    component of a source path pattern, only considering directories unless it
+    is the last component of the pattern.
+    '''
+    if part == '**':
+        if last: return [base or '.']
+        matches = [base]
+        pending = [base]
+        while pending:
+            d = pending.pop()
+            for (name, is_dir, is_link) in _list_directory(d):
+                if is_dir and not is_link and not name.startswith('.'):
+                    matches.append(os.path.join(d, name))
+                    pending.append(os.path.join(d, name))
+        return matches
+    if not [c for c in '*?[' if c in part]:
+        p = os.path.join(base, part)
+        if (last and os.path.exists(p)) or (not last and os.path.isdir(p)): return [p]
+        return []
+    return [os.path.join(base, name) for (name, is_dir, is_link) in _list_directory(base) if (last or is_dir) and (part.startswith('.') or not name.startswith('.')) and fnmatch.fnmatch(name, part)]
+
+
+def _parallel_map(function, items):
+    '''
+    Returns the list of results of calling the specified function on each of the
+    specified items, fanning the calls out over "RESOLVER_THREADS" threads when
+    there are at least "RESOLVER_FANOUT" items.
+    '''
+    if len(items) < RESOLVER_FANOUT: return [function(i) for i in items]
+    results = [None] * len(items)
+    def work(offset):
+        for i in range(offset, len(items), RESOLVER_THREADS):
+            results[i] = function(items[i])
+    threads = [threading.Thread(target=work, args=(o,)) for o in range(RESOLVER_THREADS)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return results
+
+
 def _parse_arguments():
     '''
     Parses the command-line arguments into a global namespace called "args".
     '''
-    if not os.getenv('BACKUPUTIL_CP_INTERVAL', '600').isdigit():
+    if not os.getenv('BACKUPUTIL_COMP_TTL', '604800').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_COMP_TTL".')
+    if not os.getenv('BACKUPUTIL_CP_INTERVAL', '600').isdigit() and os.getenv('BACKUPUTIL_CP_INTERVAL') != 'auto':
         sys.exit('Invalid value set for environment variable "BACKUPUTIL_CP_INTERVAL".')
+    if not os.getenv('BACKUPUTIL_EMAIL_DGST', '0').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_EMAIL_DGST".')
     if not os.getenv('BACKUPUTIL_EMAIL_LVL', 'never') in ['never', 'error', 'warning', 'completion']:
         sys.exit('Invalid value set for environment variable "BACKUPUTIL_EMAIL_LVL".')
     if not os.getenv('BACKUPUTIL_LOG_LVL', 'info') in ['info', 'debug']:
         sys.exit('Invalid value set for environment variable "BACKUPUTIL_LOG_LVL".')
     if not os.getenv('BACKUPUTIL_LOG_MODE', 'append') in ['append', 'overwrite']:
         sys.exit('Invalid value set for environment variable "BACKUPUTIL_LOG_MODE".')
+    if not os.getenv('BACKUPUTIL_OUTPUT', 'text') in ['text', 'json']:
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_OUTPUT".')
+    if not os.getenv('BACKUPUTIL_OUT_LINES', '100').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_OUT_LINES".')
     if not os.getenv('BACKUPUTIL_RATE_LIMIT', '0').isdigit():
         sys.exit('Invalid value set for environment variable "BACKUPUTIL_RATE_LIMIT".')
+    if not os.getenv('BACKUPUTIL_JOBS', '4').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_JOBS".')
+    if not os.getenv('BACKUPUTIL_SERVER_JOBS', '2').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_SERVER_JOBS".')
+    if not os.getenv('BACKUPUTIL_SSH_PERSIST', '60').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_SSH_PERSIST".')
+    if not os.getenv('BACKUPUTIL_VERIFY_TTL', '86400').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_VERIFY_TTL".')
+    if not os.getenv('BACKUPUTIL_WAIT_LOCK', '0').isdigit():
+        sys.exit('Invalid value set for environment variable "BACKUPUTIL_WAIT_LOCK".')
     argparser = argparse.ArgumentParser(
         description = HELP_DESCRIPTION,
         epilog = HELP_EPILOG,
-        usage = 'backuputil [-c FILE] (TARGET | --list-targets) [...]',
+        usage = 'backuputil [-c FILE] (TARGET | --targets LIST | --all-targets | --list-targets) [...]',
         add_help = False,
         formatter_class = lambda prog: argparse.RawDescriptionHelpFormatter(prog, max_help_position=45, width=100)
     )
-    if not '--list-targets' in sys.argv:
-        argparser.add_argument(
-            'target',
-            help = 'Specifies target specification to execute within the parsed configuration file.'
-        )
+    argparser.add_argument(
+        'target',
+        default = '',
+        help = 'Specifies target specification to execute within the parsed configuration file.',
+        nargs = '?'
+    )
+    argparser.add_argument(
+        '-a',
+        '--all-targets',
+        action = 'store_true',
+        dest = 'all_targets',
+        help = 'Executes every target defined in the specified configuration file (instead of a single target).'
+    )
+    argparser.add_argument(
+        '--bench-sample',
+        default = 0.1,
+        dest = 'bench_sample',
+        help = 'Specifies the fraction of the files beneath the source paths of the target to back up when running "--bench-target". Defaults to 0.1.',
+        metavar = 'FRACTION',
+        type = float
+    )
+    argparser.add_argument(
+        '--bench-target',
+        action = 'store_true',
+        dest = 'bench_target',
+        help = 'Benchmarks several chunker parameters by backing up a sample of the source paths of the specified target into throwaway local repositories, and writes the best of them into the target specification as "chunker_params" (instead of performing a backup).'
+    )
     argparser.add_argument(
         '-b',
         '--borg-executable',
@@ -112,12 +1132,25 @@ def _parse_arguments():
         help = '[env: BACKUPUTIL_CERT_PATH] Specifies the path to the default certificate file to use for remote backups. Defaults to "~/.ssh/backuputil.pem".',
         metavar = 'FILE'
     )
+    argparser.add_argument(
+        '--check-config',
+        action = 'store_true',
+        dest = 'check_config',
+        help = 'Validates every target defined in the specified configuration file concurrently (source paths, certificate files, and destination server hostnames), printing a report of the problems found with each target (instead of performing a backup).'
+    )
     argparser.add_argument(
         '-C',
         '--checkpoint-int',
-        default = int(os.getenv('BACKUPUTIL_CP_INTERVAL', '900')),
+        default = os.getenv('BACKUPUTIL_CP_INTERVAL', '900'),
         dest = 'checkpoint_interval',
-        help = '[env: BACKUPUTIL_CP_INTERVAL] Specifies the time interval (in seconds) in which the underlying Borg subprocess will write checkpoints. Defaults to 900 seconds.',
+        help = '[env: BACKUPUTIL_CP_INTERVAL] Specifies the time interval (in seconds) in which the underlying Borg subprocess will write checkpoints, or "auto" to derive the interval of each target from the throughput and failure rate of its previous runs. Defaults to 900 seconds.',
+        metavar = 'SEC'
+    )
+    argparser.add_argument(
+        '--compression-ttl',
+        default = int(os.getenv('BACKUPUTIL_COMP_TTL', '604800')),
+        dest = 'compression_ttl',
+        help = '[env: BACKUPUTIL_COMP_TTL] Specifies the number of seconds for which the compression chosen for targets with "compression: auto" is re-used before it is evaluated again. Defaults to 604800 (one week).',
         metavar = 'SEC',
         type = int
     )
@@ -129,6 +1162,19 @@ def _parse_arguments():
         help = '[env: BACKUPUTIL_CONFIG_FILE] Specifies the configuration file to load target definitions from. Defaults to "/etc/backuputil.yaml".',
         metavar = 'FILE'
     )
+    argparser.add_argument(
+        '-D',
+        '--daemon',
+        action = 'store_true',
+        dest = 'daemon',
+        help = 'Runs as a long-lived scheduler which executes each target defining an "rpo" whenever its last successful backup becomes older than that recovery point objective.'
+    )
+    argparser.add_argument(
+        '--deliver-mail',
+        action = 'store_true',
+        dest = 'deliver_mail',
+        help = 'Delivers the queued emails (and the digest of "--email-digest", once due) and exits without running any target. Intended to be run periodically, such as via cron.'
+    )
     argparser.add_argument(
         '-d',
         '--dry-run',
@@ -136,6 +1182,14 @@ def _parse_arguments():
         dest = 'dry_run',
         help = 'Specifies that the script should only execute a dry-run, preventing any files from actually being backed-up.'
     )
+    argparser.add_argument(
+        '--email-digest',
+        default = int(os.getenv('BACKUPUTIL_EMAIL_DGST', '0')),
+        dest = 'email_digest',
+        help = '[env: BACKUPUTIL_EMAIL_DGST] Specifies the number of seconds over which notifications are combined into a single summary email (instead of sending one email per notification). Defaults to "0" (no digest).',
+        metavar = 'SEC',
+        type = int
+    )
     argparser.add_argument(
         '-e',
         '--email-level',
@@ -145,6 +1199,13 @@ def _parse_arguments():
         help = '[env: BACKUPUTIL_EMAIL_LVL] Specifies the condition at which the script should send an email, being "never", "error", "warning", or "completion". Defaults to "never".',
         metavar = 'LVL'
     )
+    argparser.add_argument(
+        '--email-thresholds',
+        default = os.getenv('BACKUPUTIL_EMAIL_THR', 'error=1'),
+        dest = 'email_thresholds',
+        help = '[env: BACKUPUTIL_EMAIL_THR] Specifies a comma-separated list of "LEVEL=COUNT" thresholds, sending the digest of "--email-digest" early once COUNT notifications of the "error", "warning", or "info" level are queued (with "0" disabling the threshold of a level). Defaults to "error=1".',
+        metavar = 'LIST'
+    )
     argparser.add_argument(
         '-t',
         '--email-to',
@@ -159,12 +1220,26 @@ def _parse_arguments():
         dest = 'force_prune',
         help = 'Specifies that the script should force the deletion of corrupted archives during the pruning process.'
     )
+    argparser.add_argument(
+        '-g',
+        '--group',
+        default = '',
+        dest = 'group',
+        help = 'Executes every target belonging to the specified group (or comma-separated list of groups) instead of a single target.',
+        metavar = 'LIST'
+    )
     argparser.add_argument(
         '-h',
         '--help',
         action = 'help',
         help = 'Displays help and usage information.'
     )
+    argparser.add_argument(
+        '--history',
+        action = 'store_true',
+        dest = 'history',
+        help = 'Displays the recent runs of the specified target (along with percentiles of their duration and size) as recorded within the state directory (instead of performing a new backup).'
+    )
     argparser.add_argument(
         '-i',
         '--info',
@@ -172,6 +1247,15 @@ def _parse_arguments():
         dest = 'info',
         help = 'Displays information regarding the repository relevant to the specified target (instead of performing a back-up).'
     )
+    argparser.add_argument(
+        '-j',
+        '--jobs',
+        default = int(os.getenv('BACKUPUTIL_JOBS', '4')),
+        dest = 'jobs',
+        help = '[env: BACKUPUTIL_JOBS] Specifies the maximum number of targets to execute concurrently when running multiple targets. Defaults to 4.',
+        metavar = 'INT',
+        type = int
+    )
     argparser.add_argument(
         '--list-archives',
         action = 'store_true',
@@ -210,12 +1294,35 @@ def _parse_arguments():
         help = '[env: BACKUPUTIL_LOG_MODE] Specifies whether to "append" or "overwrite" the specified log file. Defaults to "append".',
         metavar = 'MODE'
     )
+    argparser.add_argument(
+        '--metrics-dir',
+        default = os.getenv('BACKUPUTIL_METRICS_DIR', ''),
+        dest = 'metrics_dir',
+        help = '[env: BACKUPUTIL_METRICS_DIR] Specifies a directory (such as that of the node_exporter textfile collector) to write Prometheus metrics of each backup run to, as "backuputil_TARGET.prom".',
+        metavar = 'DIR'
+    )
     argparser.add_argument(
         '--no-color',
         action = 'store_false',
         dest = 'color_output',
         help = 'Disables color output to stdout/stderr.'
     )
+    argparser.add_argument(
+        '--output',
+        choices = ['text', 'json'],
+        default = os.getenv('BACKUPUTIL_OUTPUT', 'text'),
+        dest = 'output',
+        help = '[env: BACKUPUTIL_OUTPUT] Specifies the format of the output written to stdout. When set to "json", the run report of the backup is written to stdout once the script finishes, while all other output is redirected to stderr. Defaults to "text".',
+        metavar = 'FMT'
+    )
+    argparser.add_argument(
+        '--output-lines',
+        default = int(os.getenv('BACKUPUTIL_OUT_LINES', '100')),
+        dest = 'output_lines',
+        help = '[env: BACKUPUTIL_OUT_LINES] Specifies the number of lines at the start and at the end of the output of the underlying borg process to include in completion emails. Any lines in between (apart from the statistics printed by borg) are only saved to a compressed temporary file. Defaults to 100.',
+        metavar = 'INT',
+        type = int
+    )
     argparser.add_argument(
         '-p',
         '--password',
@@ -238,6 +1345,18 @@ def _parse_arguments():
         help = '[env: BACKUPUTIL_PRE_RUN] Specifies the default commmand to run before starting a backup process.',
         metavar = 'CMD'
     )
+    argparser.add_argument(
+        '--probe-servers',
+        action = 'store_true',
+        dest = 'probe_servers',
+        help = 'Additionally verifies that each unique destination server is reachable via SSH and able to run Borg when running "--check-config".'
+    )
+    argparser.add_argument(
+        '--profile',
+        action = 'store_true',
+        dest = 'profile',
+        help = 'Records the wall-clock time and the resource usage (CPU time, I/O, and peak memory) of the subprocesses of each phase of the run, writing a profile table to the log file along with a JSON profile within the state directory.'
+    )
     argparser.add_argument(
         '-r',
         '--rate-limit',
@@ -253,6 +1372,13 @@ def _parse_arguments():
         dest = 'repair',
         help = 'Attempts to repair any issues pertaining to archive or repository integrity (instead of performing a new backup). It is recommended to run the script with "--verify-integrity" first to determine the severity of any data corruption.'
     )
+    argparser.add_argument(
+        '--report-file',
+        default = os.getenv('BACKUPUTIL_REPORT_FILE', ''),
+        dest = 'report_file',
+        help = '[env: BACKUPUTIL_REPORT_FILE] Specifies a file path to write the JSON run report of the backup to once the script finishes. Any occurrence of "{target}" is replaced by the name of the target.',
+        metavar = 'FILE'
+    )
     argparser.add_argument(
         '--restore',
         default = '',
@@ -262,13 +1388,49 @@ def _parse_arguments():
     )
     argparser.add_argument(
         '--restore-to',
-        default = os.getcwd(),
+        default = '',
         dest = 'restore_to',
         help = 'Specifies the destination path for "--restore". Defaults to the current working directory.',
         metavar = 'PATH',
     )
     argparser.add_argument(
-        '-T',
+        '--reverify',
+        action = 'store_true',
+        dest = 'reverify',
+        help = 'Verifies the destination repository prior to performing a new backup, even if it was successfully verified within "--verify-ttl" seconds.'
+    )
+    argparser.add_argument(
+        '--server-jobs',
+        default = int(os.getenv('BACKUPUTIL_SERVER_JOBS', '2')),
+        dest = 'server_jobs',
+        help = '[env: BACKUPUTIL_SERVER_JOBS] Specifies the maximum number of targets to execute concurrently against the same destination server when running multiple targets (local targets are only bounded by "--jobs"). Defaults to 2.',
+        metavar = 'INT',
+        type = int
+    )
+    argparser.add_argument(
+        '--ssh-persist',
+        default = int(os.getenv('BACKUPUTIL_SSH_PERSIST', '60')),
+        dest = 'ssh_persist',
+        help = '[env: BACKUPUTIL_SSH_PERSIST] Specifies the number of seconds for which an idle shared SSH connection to a destination server is kept open between the borg subprocesses of a run. Defaults to 60 (set to 0 to open a new connection for every subprocess).',
+        metavar = 'SEC',
+        type = int
+    )
+    argparser.add_argument(
+        '--state-dir',
+        default = os.getenv('BACKUPUTIL_STATE_DIR', '/var/lib/backuputil'),
+        dest = 'state_dir',
+        help = '[env: BACKUPUTIL_STATE_DIR] Specifies the directory in which the script keeps persistent state, such as repository locks. Defaults to "/var/lib/backuputil".',
+        metavar = 'DIR'
+    )
+    argparser.add_argument(
+        '--targets',
+        default = '',
+        dest = 'targets',
+        help = 'Executes the specified comma-separated list of targets (instead of a single target).',
+        metavar = 'LIST'
+    )
+    argparser.add_argument(
+        '-T',
         '--timestamp-fmt',
         default = os.getenv('BACKUPUTIL_TIMESTAMP', '%Y-%m-%d.%H-%M-%S'),
         dest = 'timestamp_format',
@@ -284,7 +1446,7 @@ def _parse_arguments():
     argparser.add_argument(
         '-u',
         '--user',
-        default = os.getenv('BACKUPUTIL_USER', getpass.getuser()),
+        default = os.getenv('BACKUPUTIL_USER', ''),
         dest = 'user',
         help = '[env: BACKUPUTIL_USER] Specifies the default login user relative to the specified target server with which remote transfer connections are established. Defaults to the current user.',
         metavar = 'NAME'
@@ -296,56 +1458,538 @@ def _parse_arguments():
         dest = 'verify_integrity',
         help = 'Verifies the integrity of the repository (and any previous archives) associated with the specified target (instead of performing a new backup).'
     )
+    argparser.add_argument(
+        '--verify-ttl',
+        default = int(os.getenv('BACKUPUTIL_VERIFY_TTL', '86400')),
+        dest = 'verify_ttl',
+        help = '[env: BACKUPUTIL_VERIFY_TTL] Specifies the number of seconds for which a successful verification of the destination repository is remembered, skipping the verification prior to subsequent backups. Defaults to 86400 (set to 0 to always verify).',
+        metavar = 'SEC',
+        type = int
+    )
+    argparser.add_argument(
+        '-w',
+        '--wait-lock',
+        default = int(os.getenv('BACKUPUTIL_WAIT_LOCK', '0')),
+        dest = 'wait_lock',
+        help = '[env: BACKUPUTIL_WAIT_LOCK] Specifies the number of seconds to wait for the repository lock held by another backuputil process before giving up. Defaults to 0 (fail immediately).',
+        metavar = 'SEC',
+        type = int
+    )
+    argparser.add_argument(
+        '--watch',
+        action = 'store_true',
+        dest = 'watch',
+        help = 'Runs as a long-lived process that watches the source paths of the specified target for changes, allowing subsequent backups of the target to skip scanning them (instead of performing a new backup).'
+    )
     global args
     args = argparser.parse_args()
 
 
-def _run_process(cmd, splitlines=True):
+def _parse_duration(value):
     '''
-    Runs the specified command as a subprocess, returning the output of the
-    command (optionally not split by lines) and its exit code.
+    Parses the specified duration (either an integer number of seconds or a
+    string such as "90m", "12h", or "7d") into a number of seconds, returning
+    "None" if it is invalid.
     '''
-    process = subprocess.Popen(
-        cmd,
-        stdout = subprocess.PIPE,
-        stderr = subprocess.STDOUT,
-        shell = True
-    )
-    output = process.communicate()[0]
-    exit_code = process.returncode
+    if isinstance(value, bool): return None
+    if isinstance(value, int): return value if value > 0 else None
+    if not isinstance(value, str): return None
+    match = re.match(r'^\s*(\d+)\s*([smhdw]?)\s*$', value)
+    if not match or int(match.group(1)) == 0: return None
+    return int(match.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}[match.group(2)]
+
+
+def _percentile(values, percentile):
+    '''
+    Returns the specified percentile (nearest-rank) of the specified list of
+    values, or "None" if the list is empty.
+    '''
+    if not values: return None
+    values = sorted(values)
+    return values[max(0, int(-(-len(values) * percentile // 100)) - 1)]
+
+
+def _phase(name):
+    '''
+    Ends the current phase of the run (recording its duration in the run report
+    and, for "--profile", its resource usage) and begins the specified phase
+    (unless "None").
+    '''
+    global run_phase
+    if run_report is None and not args.profile: return
+    now = time.time()
+    if run_phase is not None:
+        if run_report is not None:
+            run_report['phases'][run_phase[0]] = round(now - run_phase[1], 3)
+        if args.profile:
+            run_profile.append(_profile_usage(run_phase, now))
+    if name is None:
+        run_phase = None
+    else:
+        run_phase = (name, now, _profile_snapshot() if args.profile else None)
+        logging.debug('Beginning phase "' + name + '"...')
+
+
+def _pid_alive(pid):
+    '''
+    Returns whether a process with the specified PID exists.
+    '''
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _probe_servers(destinations):
+    '''
+    Verifies that Borg can be run on each of the specified destinations (tuples
+    of a user, server, and certificate path) via SSH, running at most
+    "PROBE_JOBS" connections at once and killing those still running after
+    "PROBE_TIMEOUT" seconds. Returns a dictionary mapping each destination to a
+    description of its problem (or "None" if it is reachable).
+    '''
+    results = {}
+    pending = sorted(destinations)
+    running = {}
+    def start(destination):
+        (user, server, cert) = destination
+        output = []
+        def on_line(line):
+            if line.strip(): output.append(line.strip())
+        def on_exit(exit_code):
+            del running[destination]
+            if destination in results:
+                return
+            elif exit_code == 0:
+                results[destination] = None
+            elif output:
+                results[destination] = output[-1]
+            else:
+                results[destination] = 'ssh returned exit code ' + str(exit_code)
+        try:
+            running[destination] = (_start_process(
+                ['ssh', '-n', '-i', cert, '-o', 'BatchMode=yes', '-o', 'ConnectTimeout=' + str(PROBE_TIMEOUT), '-o', 'StrictHostKeyChecking=no', user + '@' + server, 'borg --version'],
+                on_line,
+                on_exit,
+                shell = False
+            ), time.time() + PROBE_TIMEOUT)
+        except Exception as e:
+            results[destination] = str(e)
+    while pending or running:
+        while pending and len(running) < PROBE_JOBS: start(pending.pop(0))
+        if not running: continue
+        deadlines = [deadline for (destination, (process, deadline)) in running.items() if not destination in results]
+        _pump_processes(max(0, min(deadlines) - time.time()) if deadlines else 1)
+        for (destination, (process, deadline)) in list(running.items()):
+            if destination in results or time.time() < deadline: continue
+            results[destination] = 'timed out after ' + str(PROBE_TIMEOUT) + ' seconds'
+            try:
+                process.kill()
+            except OSError:
+                pass
+    return results
+
+
+def _proc_io():
+    '''
+    Returns a dictionary of the I/O counters of the script (including those of
+    its reaped subprocesses) as reported by "/proc/self/io", or "None" if they
+    are unavailable.
+    '''
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return dict([(k.strip(), int(v)) for (k, v) in [l.split(':', 1) for l in f if ':' in l]])
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _process_lines(cmd, status, stdin_data=None):
+    '''
+    Runs the specified command as a subprocess (optionally writing the specified
+    data to its stdin), yielding each line of its output as soon as it is
+    produced. Once the generator is exhausted, the exit code of the command is
+    stored under the "exit_code" key of the specified dictionary.
+    '''
+    lines = []
+    result = {}
+    _start_process(cmd, lines.append, lambda ec: result.update(exit_code=ec), stdin_data=stdin_data)
+    while True:
+        while lines:
+            (pending, lines[:]) = (lines[:], [])
+            for line in pending: yield line
+        if 'exit_code' in result: break
+        _pump_processes()
+    status['exit_code'] = result['exit_code']
+
+
+def _process_tree_rss():
+    '''
+    Returns the combined resident set size (in bytes) of all descendant processes
+    of the script, or "None" if it cannot be determined.
+    '''
+    children = {}
+    try:
+        pids = [int(p) for p in os.listdir('/proc') if p.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open('/proc/' + str(pid) + '/stat', 'r') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (IOError, OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(pid)
+    rss = 0
+    pending = list(children.get(os.getpid(), []))
+    while pending:
+        pid = pending.pop()
+        pending.extend(children.get(pid, []))
+        try:
+            with open('/proc/' + str(pid) + '/status', 'r') as f:
+                for l in f:
+                    if l.startswith('VmRSS:'): rss += int(l.split()[1]) * 1024
+        except (IOError, OSError, ValueError):
+            continue
+    return rss
+
+
+def _profile_snapshot():
+    '''
+    Returns a snapshot of the resource usage of the subprocesses of the script
+    at the beginning of a phase, resetting the sampled peak memory usage (and
+    starting the sampler thread if necessary).
+    '''
+    if profile_peak['sampler'] is None:
+        def sample():
+            while True:
+                rss = _process_tree_rss()
+                if rss is not None and rss > profile_peak['rss']: profile_peak['rss'] = rss
+                time.sleep(PROFILE_SAMPLE_INTERVAL)
+        profile_peak['sampler'] = threading.Thread(target=sample)
+        profile_peak['sampler'].daemon = True
+        profile_peak['sampler'].start()
+    profile_peak['rss'] = _process_tree_rss() or 0
+    return {'rusage': resource.getrusage(resource.RUSAGE_CHILDREN), 'io': _proc_io()}
+
+
+def _profile_usage(phase, now):
+    '''
+    Returns a dictionary of the resource usage of the subprocesses of the script
+    over the specified (ending) phase.
+    '''
+    (name, start, snapshot) = phase
+    rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    io = _proc_io()
+    usage = {
+        'phase': name,
+        'wall': round(now - start, 3),
+        'user': round(rusage.ru_utime - snapshot['rusage'].ru_utime, 3),
+        'system': round(rusage.ru_stime - snapshot['rusage'].ru_stime, 3),
+        'peak_rss': profile_peak['rss']
+    }
+    for key in ['rchar', 'wchar', 'read_bytes', 'write_bytes']:
+        if io is not None and snapshot['io'] is not None and key in io and key in snapshot['io']:
+            usage[key] = io[key] - snapshot['io'][key]
+        else:
+            usage[key] = None
+    return usage
+
+
+def _pump_processes(timeout=None):
+    '''
+    Waits (up to the specified number of seconds, or indefinitely if "None") for
+    any of the subprocesses started by "_start_process()" to become ready,
+    dispatching their output lines and exit codes to the corresponding callbacks
+    and writing any pending data to their stdin. Returns whether any
+    subprocesses remain.
+    '''
+    if not process_streams:
+        if timeout: time.sleep(timeout)
+        return False
+    reading = [fd for (fd, s) in process_streams.items() if not 'data' in s]
+    writing = [fd for (fd, s) in process_streams.items() if 'data' in s]
+    try:
+        if hasattr(select, 'poll'):
+            poller = select.poll()
+            for fd in reading: poller.register(fd, select.POLLIN | select.POLLPRI)
+            for fd in writing: poller.register(fd, select.POLLOUT)
+            ready = [fd for (fd, event) in poller.poll(None if timeout is None else int(timeout * 1000))]
+        else:
+            (r, w, x) = select.select(reading, writing, [], timeout)
+            ready = r + w
+    except (select.error, IOError, OSError) as e:
+        if e.args[0] == errno.EINTR: return True
+        raise
+    for fd in ready:
+        stream = process_streams.get(fd)
+        if stream is None: continue
+        if 'data' in stream:
+            try:
+                written = os.write(fd, stream['data'][:PIPE_CHUNK_SIZE])
+                stream['data'] = stream['data'][written:]
+            except OSError as e:
+                if e.errno != errno.EPIPE: raise
+                stream['data'] = ''
+            if not stream['data']: _release_stream(fd)
+            continue
+        data = os.read(fd, PIPE_CHUNK_SIZE)
+        if not isinstance(data, str): data = data.decode('utf-8', 'replace')
+        if not data:
+            if stream['buffer']: stream['callback'](stream['buffer'].rstrip('\r'))
+            _release_stream(fd)
+            continue
+        lines = (stream['buffer'] + data).split('\n')
+        stream['buffer'] = lines.pop()
+        for line in lines: stream['callback'](line.rstrip('\r'))
+    return bool(process_streams)
+
+
+def _rate_share(server, running, waiting=0):
+    '''
+    Returns the share (in KiB/s) of the bandwidth budget of the specified
+    destination server (per the "server_limits" configuration key) to grant to a
+    worker about to start against it, or "None" if the server has no budget. The
+    budget is divided evenly between the running workers, the new worker, and as
+    many of the specified number of other waiting workers as may run alongside
+    them (the shares of the running workers being lowered accordingly by
+    "_rebalance_shares()").
+    '''
+    limits = config.get('server_limits') or {}
+    if not server or not server in limits: return None
+    if args.jobs: waiting = min(waiting, args.jobs - len(running) - 1)
+    workers = len([r for r in running.values() if r['server'] == server]) + 1 + max(0, waiting)
+    if args.server_jobs: workers = min(workers, args.server_jobs)
+    return max(1, limits[server] // workers)
+
+
+def _read_config_cache(load_targets=True):
+    '''
+    Returns a tuple of the header of the compiled configuration cache and a
+    dictionary of the specifications of the targets relevant to this run (only
+    reading the specifications of those targets), or "None" if the cache is
+    missing, untrusted, or out of date.
+    '''
+    try:
+        st = os.stat(_config_cache_path())
+        if st.st_uid != os.getuid() or st.st_mode & 0o077: return None
+        with open(_config_cache_path(), 'rb') as f:
+            header = pickle.load(f)
+            if header.get('version') != CONFIG_CACHE_VERSION or header.get('stamp') != _config_stamp(): return None
+            if not load_targets:
+                names = []
+            elif args.target:
+                names = [args.target]
+            elif args.targets:
+                names = _target_names(args.targets)
+            elif args.group:
+                groups = [g.strip() for g in args.group.split(',') if g.strip()]
+                names = [t for t in header['groups'] if [g for g in header['groups'][t] if g in groups]]
+            else:
+                names = header['names']
+            start = f.tell()
+            targets = {}
+            for name in names:
+                if not name in header['offsets']: continue
+                (offset, length) = header['offsets'][name]
+                f.seek(start + offset)
+                targets[name] = pickle.loads(f.read(length))
+    except Exception:
+        return None
+    return (header, targets)
+
+
+def _rebalance_shares(running):
+    '''
+    Divides the bandwidth budget of each destination server (per the
+    "server_limits" configuration key) evenly between the workers in the
+    specified dictionary of running workers granted a share of it, writing each
+    changed share to the share file of the worker (see "_share_path()"). Each
+    worker applies its new share by restarting its backup from its latest
+    checkpoint (see "handle_backup()").
+    '''
+    limits = config.get('server_limits') or {}
+    for server in set([r['server'] for r in running.values()]):
+        names = [n for n in running if running[n]['server'] == server and running[n]['rate_share'] is not None]
+        if not names or not server in limits: continue
+        share = max(1, limits[server] // len(names))
+        for name in names:
+            if running[name]['rate_share'] == share: continue
+            logging.info('Rebalancing bandwidth share of ' + name + ' to ' + str(share) + ' KiB/s...')
+            running[name]['rate_share'] = share
+            try:
+                _write_share(name, share)
+            except Exception as e:
+                logging.warning('Unable to write bandwidth share of ' + name + ' - ' + str(e) + '.')
+
+
+def _release_share(name):
+    '''
+    Removes the share file of the specified worker once it has exited.
+    '''
+    try:
+        os.remove(_share_path(name))
+    except OSError:
+        pass
+
+
+def _release_stream(fd):
+    '''
+    Closes the specified subprocess pipe, reaping the subprocess and calling its
+    exit callback once all of its output pipes have been closed.
+    '''
+    stream = process_streams.pop(fd)
+    stream['file'].close()
+    entry = stream['process']
+    if 'data' in stream: return
+    entry['open'] -= 1
+    if entry['open']: return
+    for (other_fd, other) in list(process_streams.items()):
+        if other['process'] is entry: _release_stream(other_fd)
+    entry['process'].wait()
+    if entry['on_exit']: entry['on_exit'](entry['process'].returncode)
+
+
+def _repo_key(repo):
+    '''
+    Returns a file name (unique to the specified repository reference string)
+    under which state about the repository is kept.
+    '''
+    return re.sub(r'[^A-Za-z0-9._-]', '_', repo)[-64:] + '.' + hashlib.sha1(repo.encode('utf-8')).hexdigest()[:8]
+
+
+def _resolve_host(host):
+    '''
+    Returns the IP address of the specified hostname, raising an exception if it
+    cannot be resolved within "DNS_TIMEOUT" seconds. Each hostname is only
+    resolved once, with concurrent callers sharing the pending resolution (see
+    "_start_resolution()").
+    '''
+    entry = _start_resolution(host)
+    if not entry['done'].wait(DNS_TIMEOUT):
+        raise Exception('timed out after ' + str(DNS_TIMEOUT) + ' seconds')
+    if entry['error'] is not None:
+        raise Exception(entry['error'])
+    return entry['address']
+
+
+def _resolve_pattern(pattern):
+    '''
+    Returns the (memoized) sorted list of existing paths matched by the specified
+    source path pattern after expanding "~" and environment variables. As with
+    "glob.glob()", "*", "?", and "[...]" match within a single path component,
+    while "**" additionally matches any number of nested directories.
+    '''
+    path = os.path.expanduser(os.path.expandvars(pattern))
+    if not path in resolved_patterns:
+        if not [c for c in '*?[' if c in path]:
+            matches = [p for p in [path] if os.path.exists(p)]
+        else:
+            if os.path.isabs(path):
+                matches = ['/']
+            else:
+                matches = ['']
+            parts = [c for c in path.split('/') if c]
+            for (i, part) in enumerate(parts):
+                last = i == len(parts) - 1
+                matches = [m for ms in _parallel_map(lambda b: _match_component(b, part, last), matches) for m in ms]
+        resolved_patterns[path] = sorted(set(matches))
+    return resolved_patterns[path]
+
+
+def _run_process(cmd, splitlines=True, stdin_data=None):
+    '''
+    Runs the specified command as a subprocess (optionally writing the specified
+    data to its stdin), returning the output of the command (optionally not
+    split by lines) and its exit code.
+    '''
+    status = {}
+    output = list(_process_lines(cmd, status, stdin_data))
     if splitlines:
-        return (output.splitlines(), exit_code)
+        return (output, status['exit_code'])
     else:
-        return (output, exit_code)
+        return ('\n'.join(output), status['exit_code'])
+
+
+def _sample_sources(fraction):
+    '''
+    Returns a tuple of the sorted list of regular files beneath the source paths
+    of the target (minus any excluded paths) selected by "--bench-sample", and
+    their combined size. Files are selected by a hash of their path, so that the
+    same files are selected on every call.
+    '''
+    threshold = int(fraction * 0x100000000)
+    sample = []
+    size = [0]
+    def consider(path):
+        if '\n' in path or _is_excluded(path): return
+        if int(hashlib.sha1(path if isinstance(path, bytes) else path.encode('utf-8')).hexdigest()[:8], 16) >= threshold: return
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return
+        if stat.S_ISREG(st.st_mode):
+            sample.append(path)
+            size[0] += st.st_size
+    for src in src_paths:
+        if not os.path.isdir(src) or os.path.islink(src):
+            consider(src)
+            continue
+        for (root, dirs, files) in os.walk(src):
+            dirs[:] = [d for d in dirs if not _is_excluded(os.path.join(root, d))]
+            for f in files: consider(os.path.join(root, f))
+    return (sorted(sample), size[0])
+
+
+def _save_state(path, data):
+    '''
+    Atomically writes the specified data as JSON to the specified path relative
+    to the state directory.
+    '''
+    full_path = os.path.join(args.state_dir, path)
+    _makedirs(os.path.dirname(full_path))
+    tmp_path = full_path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.rename(tmp_path, full_path)
+
+
+def _scratch_environment(path):
+    '''
+    Returns the environment of the borg subprocesses working on a throwaway
+    unencrypted repository within the specified directory, keeping their cache
+    and security directories within it as well.
+    '''
+    env = os.environ.copy()
+    env['BORG_CACHE_DIR'] = os.path.join(path, 'cache')
+    env['BORG_SECURITY_DIR'] = os.path.join(path, 'security')
+    env['BORG_PASSPHRASE'] = ''
+    env['BORG_UNKNOWN_UNENCRYPTED_REPO_ACCESS_IS_OK'] = 'yes'
+    return env
 
 
 def _send_email(subject, body, level='error', debug=False):
     '''
-    Sends an email to the configured recipients with the specified body, subject,
-    and alert level. Whether the email actually gets sent is dependent on the
-    alert level specified by "args.email_level".
+    Queues an email to the configured recipients with the specified body,
+    subject, and alert level (either as its own email, or as a notification
+    within the digest of "--email-digest"), delivering it in the background.
+    Whether the email actually gets queued is dependent on the alert level
+    specified by "args.email_level".
     '''
     if not level in ['error', 'warning', 'info']:
         raise Exception('Invalid email level: "' + str(level) + '"')
     if args.email_level == 'never' or (args.email_level == 'error' and level in ['warning', 'info']) or (args.email_level == 'warning' and level == 'info'):
         return
-    if level == 'error':
-        full_subject = 'ERROR: ' + subject
-        full_body = body + '\n\nSee "' + args.log_file + '" on the machine for more details.'
-    elif level == 'warning':
-        full_subject = 'WARNING: ' + subject
-        full_body = body + '\n\nSee "' + args.log_file + '" on the machine for more details.'
+    if args.email_digest:
+        global mail_sequence
+        mail_sequence += 1
+        _save_state(
+            os.path.join('mail', 'digest', '%.6f.%d.%d.json' % (time.time(), os.getpid(), mail_sequence)),
+            {'time': time.time(), 'to': args.email_to, 'level': level, 'subject': subject, 'body': body}
+        )
     else:
-        full_subject = subject
-        full_body = body
-    with open('/tmp/backuputil.email', 'w') as f:
-        f.write('To: ' + args.email_to + '\n')
-        f.write('Subject: ' + full_subject + '\n\n')
-        f.write(full_body)
-    with open(os.devnull, 'w') as DEVNULL:
-        email_exit_code = subprocess.call('cat /tmp/backuputil.email | /usr/sbin/sendmail -t', shell=True, stdout=DEVNULL, stderr=subprocess.STDOUT)
-    if email_exit_code != 0:
-        raise Exception('sendmail subprocess call returned non-zero exit code')
+        _spool_email(_format_email(args.email_to, subject, body, level))
+    _deliver_mail()
 
 
 def _setup_logging():
@@ -362,11 +2006,15 @@ def _setup_logging():
                 logging_level = logging.INFO
             else:
                 logging_level = logging.DEBUG
+            if os.getenv('BACKUPUTIL_WORKER'):
+                logging_format = '[%(levelname)s] [%(asctime)s] [%(process)d] [' + os.getenv('BACKUPUTIL_WORKER') + '] %(message)s'
+            else:
+                logging_format = '[%(levelname)s] [%(asctime)s] [%(process)d] %(message)s'
             logging.basicConfig(
                 filename = args.log_file,
                 filemode = logging_fmode,
                 level    = logging_level,
-                format   = '[%(levelname)s] [%(asctime)s] [%(process)d] %(message)s',
+                format   = logging_format,
                 datefmt  = '%m/%d/%Y %I:%M:%S %p'
             )
             logging.addLevelName(logging.CRITICAL, 'CRI')
@@ -381,6 +2029,175 @@ def _setup_logging():
         logger.disabled = True
 
 
+def _share_path(name):
+    '''
+    Returns the path of the file holding the current share of the bandwidth
+    budget of its destination server granted to the worker process executing the
+    specified target.
+    '''
+    return os.path.join(args.state_dir, 'shares', str(os.getpid()) + '-' + name)
+
+
+def _shared_rate_limit(share=None):
+    '''
+    Returns the rate limit (in KiB/s, with "0" being unlimited) of the selected
+    target, bounded by the specified share of the bandwidth budget of its
+    destination server.
+    '''
+    if 'rate_limit' in target:
+        limit = str(target['rate_limit'])
+    else:
+        limit = str(args.rate_limit)
+    if share is not None and (limit == '0' or share < int(limit)): limit = str(share)
+    return limit
+
+
+def _spawn_worker(name, rate_share=None):
+    '''
+    Spawns a separate backuputil process to execute the specified target
+    (optionally limited to the specified share of the bandwidth budget of its
+    destination server), relaying its output (prefixed by the name of the
+    target) to stdout. The exit code of the worker is appended to the
+    "worker_results" list once it exits.
+    '''
+    if getattr(sys, 'frozen', False):
+        cmd = [sys.executable, name]
+    else:
+        cmd = [sys.executable, os.path.abspath(__file__), name]
+    if args.dry_run: cmd.append('--dry-run')
+    if args.force_prune: cmd.append('--force-prune')
+    if not args.color_output: cmd.append('--no-color')
+    if args.profile: cmd.append('--profile')
+    if args.reverify: cmd.append('--reverify')
+    logging.debug('Worker Command (' + name + '): ' + str(cmd))
+    def relay(line):
+        sys.stdout.write(_c('[' + name + ']', C_BOLD) + ' ' + line + '\n')
+        sys.stdout.flush()
+    return _start_process(
+        cmd,
+        relay,
+        lambda exit_code: worker_results.append((name, exit_code)),
+        shell = False,
+        env = _worker_environment(name, rate_share)
+    )
+
+
+def _spool_email(message):
+    '''
+    Atomically writes the specified email message into the spool of outgoing
+    emails (see "_deliver_mail()").
+    '''
+    global mail_sequence
+    mail_sequence += 1
+    path = os.path.join(args.state_dir, 'mail', 'outgoing', '%.6f.%d.%d' % (time.time(), os.getpid(), mail_sequence))
+    _makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as f:
+        f.write(message)
+    os.rename(path + '.tmp', path + '.eml')
+
+
+def _ssh_control_path(destination, ssh_cmd):
+    '''
+    Returns the path of the SSH control socket shared by the borg subprocesses of
+    this run (including those of its worker processes) connecting to the
+    specified "user@server" destination with the specified ssh command (so that
+    connections authenticated with different certificates are never shared), or
+    an empty string if that path would be too long to be used as a socket or its
+    directory can not be created.
+    '''
+    owner = os.getenv('BACKUPUTIL_SSH_OWNER', str(os.getpid()))
+    ssh_dir = os.path.join(args.state_dir, 'ssh')
+    path = os.path.join(ssh_dir, owner + '-' + hashlib.sha1((destination + '|' + ssh_cmd).encode('utf-8')).hexdigest()[:12])
+    if len(path) > SSH_CONTROL_PATH_MAX: return ''
+    try:
+        _makedirs(ssh_dir)
+        os.chmod(ssh_dir, 0o700)
+    except OSError:
+        return ''
+    return path
+
+
+def _start_process(cmd, on_line, on_exit=None, on_error_line=None, stdin_data=None, shell=True, env=None):
+    '''
+    Starts the specified command as a subprocess driven by "_pump_processes()",
+    passing each line of its output to the specified callback (along with its
+    stderr, unless a separate callback is given for it), writing the optionally
+    specified data to its stdin, and passing its exit code to the specified exit
+    callback once it exits. Returns the process.
+    '''
+    if stdin_data is None:
+        stdin = None
+    else:
+        stdin = subprocess.PIPE
+    if on_error_line is None:
+        stderr = subprocess.STDOUT
+    else:
+        stderr = subprocess.PIPE
+    process = subprocess.Popen(
+        cmd,
+        stdin = stdin,
+        stdout = subprocess.PIPE,
+        stderr = stderr,
+        shell = shell,
+        env = env
+    )
+    entry = {'process': process, 'on_exit': on_exit, 'open': 0}
+    outputs = [(process.stdout, on_line)]
+    if on_error_line is not None: outputs.append((process.stderr, on_error_line))
+    for (f, callback) in outputs:
+        process_streams[f.fileno()] = {'file': f, 'process': entry, 'callback': callback, 'buffer': ''}
+        entry['open'] += 1
+    if stdin_data is not None:
+        if not isinstance(stdin_data, bytes): stdin_data = stdin_data.encode('utf-8')
+        if stdin_data:
+            process_streams[process.stdin.fileno()] = {'file': process.stdin, 'process': entry, 'data': stdin_data}
+        else:
+            process.stdin.close()
+    return process
+
+
+def _start_resolution(host):
+    '''
+    Starts resolving the specified hostname in a background thread (unless it
+    has already been started), returning its entry within "resolved_hosts".
+    '''
+    with resolved_hosts_lock:
+        if not host in resolved_hosts:
+            entry = {'address': None, 'error': None, 'done': threading.Event()}
+            def resolve():
+                try:
+                    entry['address'] = socket.gethostbyname(host)
+                except Exception as e:
+                    entry['error'] = str(e)
+                entry['done'].set()
+            resolver = threading.Thread(target=resolve)
+            resolver.daemon = True
+            resolver.start()
+            resolved_hosts[host] = entry
+        return resolved_hosts[host]
+
+
+def _start_worker(name, running, rate_share=None):
+    '''
+    Starts the worker process for the specified target (optionally limited to
+    the specified bandwidth share), recording it within the specified dictionary
+    of running workers. Returns whether the worker was successfully started.
+    '''
+    if rate_share is None:
+        logging.info('Starting ' + name + '...')
+    else:
+        logging.info('Starting ' + name + ' (bandwidth share: ' + str(rate_share) + ' KiB/s)...')
+    try:
+        if rate_share is not None: _write_share(name, rate_share)
+        _spawn_worker(name, rate_share)
+    except Exception as e:
+        printe(_subsubstep('Unable to start ' + name + ' - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to start ' + name + ' - ' + str(e) + '.')
+        return False
+    running[name] = {'server': _target_server(name), 'start': time.time(), 'rate_share': rate_share}
+    return True
+
+
 def _step(instring, color=C_BLUE):
     '''
     Formats the specified string as a "step".
@@ -388,6 +2205,97 @@ def _step(instring, color=C_BLUE):
     return _c('::', color) + ' ' + _c(instring, C_BOLD)
 
 
+def _stream_processes(cmds, label, keep_output=False, results=None, restart=None, env=None):
+    '''
+    Runs the specified commands as concurrent subprocesses, logging each line of
+    their output (prefixed by the specified label, along with the index of the
+    command if more than one command is given) as soon as it is produced.
+    Returns a tuple of the combined output (only retained if requested, and
+    bounded as described in "_capture_line()") and the list of exit codes of the
+    commands.
+
+    If a results list is given, the commands are expected to be borg commands
+    run with "--log-json" (and optionally "--json"). Their stderr is then
+    converted back into plain text, while the JSON document written to their
+    stdout is parsed into the "json" key of the result dictionary appended to
+    the list for each command.
+
+    If a restart callback is given, it is called with the index of each running
+    command about once per second, and may return a replacement for it. The
+    running command is then interrupted (making borg write a checkpoint before
+    it exits) and the replacement is started in its place.
+
+    If an environment is given, the commands are run with it instead of the
+    environment of the script.
+    '''
+    capture = {
+        'blocks': {},
+        'count': 0,
+        'head': [],
+        'path': os.path.join(args.state_dir, 'output', args.target + '.' + label.lower() + '.log.gz'),
+        'prefix': len(cmds) > 1,
+        'spill': None,
+        'stats': collections.deque(maxlen=STATS_MAX_LINES),
+        'tail': collections.deque(maxlen=args.output_lines)
+    }
+    exit_codes = [None] * len(cmds)
+    def relay(i):
+        if len(cmds) > 1:
+            (log_prefix, output_prefix) = (label + ' OUTPUT [' + str(i) + ']: ', '[' + str(i) + '] ')
+        else:
+            (log_prefix, output_prefix) = (label + ' OUTPUT: ', '')
+        def on_line(line):
+            if results is not None:
+                line = _borg_log_line(line, results[i])
+                if line is None: return
+            if keep_output: _capture_line(capture, output_prefix + line + '\n', i)
+            logging.info(log_prefix + line)
+        def on_json_line(line):
+            results[i]['stdout'].append(line)
+        def on_exit(exit_code):
+            if results is not None:
+                stdout = results[i].pop('stdout')
+                try:
+                    if stdout: results[i]['json'] = json.loads('\n'.join(stdout))
+                except ValueError:
+                    for line in stdout: on_line(line)
+            exit_codes[i] = exit_code
+        return (on_line, on_json_line, on_exit)
+    processes = [None] * len(cmds)
+    def start(i, cmd):
+        (on_line, on_json_line, on_exit) = relay(i)
+        if restart is not None: cmd = 'exec ' + cmd
+        if results is None:
+            processes[i] = _start_process(cmd, on_line, on_exit, env=env)
+        else:
+            results[i] = {'json': None, 'kept': 0, 'pruned': 0, 'stdout': []}
+            processes[i] = _start_process(cmd, on_json_line, on_exit, on_error_line=on_line, env=env)
+    if results is not None:
+        del results[:]
+        results.extend([None] * len(cmds))
+    for (i, cmd) in enumerate(cmds): start(i, cmd)
+    replacements = {}
+    try:
+        while None in exit_codes or replacements:
+            for i in [i for i in replacements if exit_codes[i] is not None]:
+                logging.info(label + ' [' + str(i) + ']: restarting interrupted process...')
+                exit_codes[i] = None
+                start(i, replacements.pop(i))
+            if restart is None:
+                _pump_processes()
+                continue
+            _pump_processes(1)
+            for i in range(len(cmds)):
+                if exit_codes[i] is not None or i in replacements: continue
+                replacement = restart(i)
+                if replacement is None: continue
+                replacements[i] = replacement
+                processes[i].send_signal(signal.SIGINT)
+    finally:
+        output = _capture_output(capture)
+    return (output, exit_codes)
+
+
 def _substep(instring, color=C_BLUE):
     '''
     Formats the specified string as a "sub-step".
@@ -395,34 +2303,481 @@ def _substep(instring, color=C_BLUE):
     return '  ' + _c('-->', color) + ' ' + instring
 
 
-def _subsubstep(instring, color=None):
+def _subsubstep(instring, color=None):
+    '''
+    Formats the specified string as a "sub-sub-step".
+    '''
+    return '      ' + _c(instring, color)
+
+
+def _target_list(value):
+    '''
+    Normalizes the specified target parameter value (either a single string or a
+    list of strings) into a list.
+    '''
+    if value is None: return []
+    if isinstance(value, list): return value
+    return [value]
+
+
+def _target_names(value):
+    '''
+    Returns the list of target names within the specified comma-separated list
+    (as passed to "--targets"), dropping any duplicates while preserving order.
+    '''
+    names = []
+    for name in [t.strip() for t in value.split(',') if t.strip()]:
+        if not name in names: names.append(name)
+    return names
+
+
+def _target_problems(spec):
+    '''
+    Validates the specified target specification, returning the list of
+    problems found with it (which is empty if the specification is valid).
+    '''
+    if not isinstance(spec, dict):
+        return ['value of target key not dictionary of target parameters']
+    if not 'src_path' in spec or not 'dst_path' in spec:
+        return ['target does not specify a value for "src_path" or "dst_path"']
+    problems = []
+    if not isinstance(spec['dst_path'], str):
+        problems.append('destination path is not a path string')
+    if isinstance(spec['src_path'], str):
+        if not _resolve_pattern(spec['src_path']):
+            if '*' in spec['src_path']:
+                problems.append('specified source path wildcard "' + spec['src_path'] + '" does not resolve to existing paths on the local filesystem')
+            else:
+                problems.append('specified source path "' + spec['src_path'] + '" does not exist on the local filesystem')
+    elif isinstance(spec['src_path'], list):
+        for p in spec['src_path']:
+            if not isinstance(p, str):
+                problems.append('one or more specified source paths is not a path string')
+            elif not _resolve_pattern(p):
+                if '*' in p:
+                    problems.append('specified source path wildcard "' + p + '" does not resolve to existing paths on the local filesystem')
+                else:
+                    problems.append('specified source path "' + p + '" does not exist on the local filesystem')
+    else:
+        problems.append('"src_path" does not correspond to a path string or list of path strings')
+    if 'keep' in spec:
+        if not isinstance(spec['keep'], dict):
+            problems.append('"keep" specification not a dictionary of time slices')
+        elif [s for s in spec['keep'] if not s in ['hourly', 'daily', 'weekly', 'monthly', 'yearly']]:
+            problems.append('"keep" specification contains one or more unknown time slices')
+    if 'chunker_params' in spec:
+        if not isinstance(spec['chunker_params'], str) or not re.match(r'^((buzhash,)?\d+,\d+,\d+,\d+|fixed,\d+(,\d+)?)$', spec['chunker_params']):
+            problems.append('"chunker_params" specification not a valid chunker parameter string')
+    if 'compression' in spec:
+        if not isinstance(spec['compression'], str) or not re.match(r'^(auto|(auto,)?(none|lz4|zstd(,\d+)?|zlib(,\d)?|lzma(,\d)?))$', spec['compression']):
+            problems.append('"compression" specification not a valid compression string')
+    if 'exclude' in spec:
+        if not isinstance(spec['exclude'], list):
+            problems.append('"exclude" specification not a list of paths')
+    if 'post_run' in spec:
+        if not isinstance(spec['post_run'], str):
+            problems.append('"post_run" specification not a command string')
+    if 'pre_run' in spec:
+        if not isinstance(spec['pre_run'], str):
+            problems.append('"pre_run" specification not a command string')
+    if 'rate_limit' in spec:
+        if not isinstance(spec['rate_limit'], int) or spec['rate_limit'] < 0:
+            problems.append('"rate_limit" specification not a positive integer value')
+    if 'shards' in spec:
+        if isinstance(spec['shards'], bool) or not isinstance(spec['shards'], int) or spec['shards'] < 1:
+            problems.append('"shards" specification not a positive integer value')
+    if 'skip_if_unchanged' in spec:
+        if not isinstance(spec['skip_if_unchanged'], bool):
+            problems.append('"skip_if_unchanged" specification not a boolean value')
+    if 'rpo' in spec:
+        if _parse_duration(spec['rpo']) is None:
+            problems.append('"rpo" specification not a positive duration')
+    if 'dst_srv' in spec:
+        if not 'cert_path' in spec:
+            cert_path = args.cert_path
+        else:
+            cert_path = spec['cert_path']
+        if not isinstance(cert_path, str) or not os.path.isfile(os.path.expanduser(os.path.expandvars(cert_path))):
+            problems.append('certificate file path "' + str(cert_path) + '" does not correspond to an existing file')
+        try:
+            _resolve_host(spec['dst_srv'])
+        except Exception as e:
+            problems.append('unable to resolve hostname of destination server "' + str(spec['dst_srv']) + '" via DNS (' + str(e) + ')')
+    return problems
+
+
+def _target_server(name):
+    '''
+    Returns the destination server of the specified target (or an empty string
+    for local targets).
+    '''
+    return config['targets'][name].get('dst_srv', '')
+
+
+def _wait_worker(timeout=1):
+    '''
+    Waits (up to the specified number of seconds) for a worker process to exit,
+    returning a tuple of the corresponding target name and exit code, or "None"
+    if no worker exited in time.
+    '''
+    deadline = time.time() + timeout
+    while not worker_results:
+        remaining = deadline - time.time()
+        if remaining <= 0: return None
+        _pump_processes(remaining)
+    return worker_results.pop(0)
+
+
+def _worker_environment(name, rate_share=None):
+    '''
+    Returns the environment of the worker process for the specified target.
+    '''
+    env = os.environ.copy()
+    for (var, attr) in WORKER_ENVIRONMENT:
+        env[var] = str(getattr(args, attr))
+    env['BACKUPUTIL_LOG_MODE'] = 'append'
+    env['BACKUPUTIL_SSH_OWNER'] = os.getenv('BACKUPUTIL_SSH_OWNER', str(os.getpid()))
+    env['BACKUPUTIL_WORKER'] = name
+    env['BACKUPUTIL_WORKER_SPEC'] = _yaml_dump({'targets': {name: config['targets'][name]}})
+    if rate_share is None:
+        env.pop('BACKUPUTIL_WORKER_RATE_SHARE', None)
+        env.pop('BACKUPUTIL_WORKER_SHARE_FILE', None)
+    else:
+        env['BACKUPUTIL_WORKER_RATE_SHARE'] = str(rate_share)
+        env['BACKUPUTIL_WORKER_SHARE_FILE'] = _share_path(name)
+    return env
+
+
+def _worker_slot_available(server, running):
+    '''
+    Returns whether another worker process may be started against the specified
+    destination server, given the dictionary of currently running workers.
+    '''
+    if args.jobs and len(running) >= args.jobs: return False
+    if args.server_jobs and server and len([r for r in running.values() if r['server'] == server]) >= args.server_jobs: return False
+    return True
+
+
+def _write_config_cache(stamp):
+    '''
+    Writes the (validated) configuration, corresponding to the specified
+    configuration stamp, to the compiled configuration cache. The cache consists
+    of a header (holding the base configuration and an index of the targets)
+    followed by the separately-pickled specification of each target.
+    '''
+    blobs = []
+    offsets = {}
+    offset = 0
+    for name in sorted(config['targets']):
+        blob = pickle.dumps(config['targets'][name], 2)
+        offsets[name] = (offset, len(blob))
+        offset += len(blob)
+        blobs.append(blob)
+    header = {
+        'version': CONFIG_CACHE_VERSION,
+        'stamp': stamp,
+        'base': dict([(k, v) for (k, v) in config.items() if k != 'targets']),
+        'names': sorted(config['targets']),
+        'offsets': offsets,
+        'groups': dict([(n, _target_list(t.get('group'))) for (n, t) in config['targets'].items() if isinstance(t, dict)])
+    }
+    path = _config_cache_path()
+    _makedirs(os.path.dirname(path))
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+        os.fchmod(f.fileno(), 0o600)
+        pickle.dump(header, f, 2)
+        for blob in blobs: f.write(blob)
+    os.rename(tmp_path, path)
+
+
+def _write_share(name, share):
+    '''
+    Atomically writes the specified bandwidth share to the share file of the
+    worker executing the specified target.
+    '''
+    path = _share_path(name)
+    _makedirs(os.path.dirname(path))
+    with open(path + '.tmp', 'w') as f:
+        f.write(str(share) + '\n')
+    os.rename(path + '.tmp', path)
+
+
+def _write_target_option(key, value):
+    '''
+    Sets the specified parameter of the target to the specified string within
+    the configuration file (or the file within its accompanying directory)
+    defining the target, leaving the rest of the file (including comments) as
+    it is. Returns the path of the updated file.
+    '''
+    for path in _config_files():
+        with open(path, 'r') as f:
+            text = f.read()
+        document = _yaml_load(text)
+        if isinstance(document, dict) and isinstance(document.get('targets'), dict) and args.target in document['targets']: break
+    else:
+        raise Exception('target not found within the configuration files')
+    expected = _yaml_load(text)
+    expected['targets'][args.target][key] = value
+    lines = text.splitlines(True)
+    header = re.compile(r'^( +)(["\']?)' + re.escape(args.target) + r'\2 *: *(#.*)?$')
+    content = lambda l: l.strip() and not l.strip().startswith('#')
+    for (start, line) in enumerate(lines):
+        match = header.match(line.rstrip('\r\n'))
+        if not match: continue
+        indent = len(match.group(1))
+        block = [i for i in range(start + 1, len(lines)) if content(lines[i])]
+        if not block: continue
+        child_indent = len(lines[block[0]]) - len(lines[block[0]].lstrip(' '))
+        if child_indent <= indent: continue
+        end = start + 1
+        existing = None
+        for i in block:
+            if len(lines[i]) - len(lines[i].lstrip(' ')) <= indent: break
+            end = i + 1
+            if re.match(r'^ {' + str(child_indent) + r'}' + re.escape(key) + r' *:', lines[i]): existing = i
+        newline = '\r\n' if line.endswith('\r\n') else '\n'
+        entry = ' ' * child_indent + key + ': "' + value + '"' + newline
+        if existing is None:
+            if not lines[end - 1].endswith('\n'): lines[end - 1] += newline
+            updated = lines[:end] + [entry] + lines[end:]
+        else:
+            updated = lines[:existing] + [entry] + lines[existing + 1:]
+        try:
+            if _yaml_load(''.join(updated)) != expected: continue
+        except yaml.YAMLError:
+            continue
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(''.join(updated))
+        shutil.copymode(path, tmp_path)
+        os.rename(tmp_path, path)
+        return path
+    raise Exception('unable to locate the specification of the target within "' + path + '"')
+
+
+def _yaml_dump(data):
+    '''
+    Serializes the specified data as YAML, preferring the (much faster)
+    LibYAML-based dumper when PyYAML was built with it.
+    '''
+    return yaml.dump(data, Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper))
+
+
+def _yaml_load(text):
+    '''
+    Parses the specified YAML document, preferring the (much faster)
+    LibYAML-based loader when PyYAML was built with it.
+    '''
+    return yaml.load(text, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+
+
+# --------------------------------------
+
+
+
+# ---------- Public Functions ----------
+
+def acquire_repository_lock():
+    '''
+    Acquires an exclusive lock keyed on the resolved repository reference string,
+    which is held until the script exits. If the lock is held by another
+    process, the script waits up to "--wait-lock" seconds for it, in first-come,
+    first-served order with any other waiting processes.
+    '''
+    print(_substep('Acquiring repository lock...'))
+    logging.debug('Acquiring repository lock...')
+    lock_dir = os.path.join(args.state_dir, 'locks')
+    lock_name = _repo_key(repo_str)
+    queue_dir = os.path.join(lock_dir, lock_name + '.queue')
+    ticket = os.path.join(queue_dir, '%020d-%d' % (int(time.time() * 1000000), os.getpid()))
+    logging.debug('Repository Lock File: ' + os.path.join(lock_dir, lock_name + '.lock'))
+    global repo_lock
+    acquired = False
+    waiting = False
+    try:
+        _makedirs(queue_dir)
+        repo_lock = open(os.path.join(lock_dir, lock_name + '.lock'), 'a+')
+        open(ticket, 'w').close()
+        deadline = time.time() + args.wait_lock
+        while True:
+            if _lock_turn(queue_dir, ticket):
+                try:
+                    fcntl.flock(repo_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    acquired = True
+                    break
+                except (IOError, OSError) as e:
+                    if not e.errno in [errno.EAGAIN, errno.EACCES]: raise
+            if time.time() >= deadline: break
+            if not waiting:
+                waiting = True
+                print(_subsubstep('Waiting (up to ' + str(args.wait_lock) + ' seconds) for repository lock...'))
+                logging.info('Waiting (up to ' + str(args.wait_lock) + ' seconds) for repository lock...')
+            time.sleep(1)
+        os.remove(ticket)
+    except Exception as e:
+        printe(_subsubstep('Unable to acquire repository lock - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to acquire repository lock - ' + str(e) + '.')
+        send_email(
+            'Unable to acquire repository lock',
+            emails.CANT_LOCK_REPO,
+            'error'
+        )
+        sys.exit(2)
+    if not acquired:
+        repo_lock.seek(0)
+        holder = repo_lock.read().strip() or 'holder unknown'
+        printe(_subsubstep('Unable to proceed - repository is locked by another process (' + holder + ').', C_RED))
+        logging.critical('Unable to proceed - repository is locked by another process (' + holder + ').')
+        send_email(
+            'Unable to acquire repository lock',
+            emails.REPO_LOCKED,
+            'error'
+        )
+        sys.exit(2)
+    repo_lock.seek(0)
+    repo_lock.truncate()
+    repo_lock.write('pid ' + str(os.getpid()) + ', target ' + args.target + '\n')
+    repo_lock.flush()
+    logging.debug('Acquired repository lock.')
+
+
+def assign_shards():
+    '''
+    Splits the resolved source paths of a sharded target into one group per
+    shard, returning the list of groups. If there are fewer source paths than
+    shards, source directories are split into their immediate contents. Paths
+    keep the shard they were previously assigned to (so that every shard
+    repository keeps deduplicating against its own history), while new paths are
+    assigned to the shard with the smallest estimated total size, largest paths
+    first.
+    '''
+    print(_substep('Assigning source paths to shards...'))
+    logging.info('Assigning source paths to shards...')
+    count = len(shard_repos)
+    units = list(src_paths)
+    if len(units) < count:
+        expanded = []
+        for p in units:
+            children = []
+            if os.path.isdir(p) and not os.path.islink(p):
+                try:
+                    children = sorted([os.path.join(p, c) for c in os.listdir(p)])
+                except OSError as e:
+                    logging.warning('Unable to list "' + p + '" - ' + str(e) + '.')
+            expanded.extend(children or [p])
+        units = expanded
+    state_path = os.path.join('shards', args.target + '.json')
+    state = _load_state(state_path, {})
+    if state.get('count') != count:
+        if state: logging.warning('Number of shards changed - reassigning all source paths.')
+        state = {'count': count, 'paths': {}}
+    assigned = dict([(p, state['paths'][p]) for p in units if p in state['paths']])
+    totals = [0] * count
+    for a in assigned.values(): totals[a['shard']] += a['size']
+    new_paths = [p for p in units if not p in assigned]
+    if new_paths: logging.info('Estimating size of ' + str(len(new_paths)) + ' unassigned source paths...')
+    sizes = dict([(p, _estimate_size(p)) for p in new_paths])
+    for p in sorted(new_paths, key=lambda p: sizes[p], reverse=True):
+        shard = totals.index(min(totals))
+        assigned[p] = {'shard': shard, 'size': sizes[p]}
+        totals[shard] += sizes[p]
+    try:
+        _save_state(state_path, {'count': count, 'paths': assigned})
+    except Exception as e:
+        logging.warning('Unable to save shard assignments - ' + str(e) + '.')
+    groups = [[] for i in range(count)]
+    for p in units: groups[assigned[p]['shard']].append(p)
+    for i in range(count):
+        logging.info('Shard ' + str(i) + ': ' + str(len(groups[i])) + ' paths (~' + _format_bytes(totals[i]) + ')')
+    return groups
+
+
+def close_ssh_masters():
     '''
-    Formats the specified string as a "sub-sub-step".
+    Closes the shared SSH connections opened during this run (including those
+    opened by its worker processes). Worker processes leave this to the process
+    that started them.
     '''
-    return '      ' + _c(instring, color)
+    if not 'args' in globals() or os.getenv('BACKUPUTIL_SSH_OWNER'): return
+    ssh_dir = os.path.join(args.state_dir, 'ssh')
+    try:
+        sockets = [s for s in os.listdir(ssh_dir) if s.startswith(str(os.getpid()) + '-')]
+    except OSError:
+        return
+    for s in sockets:
+        logging.debug('Closing shared SSH connection "' + s + '"...')
+        try:
+            (ssh_out, ssh_ec) = _run_process('ssh -o ControlPath=' + os.path.join(ssh_dir, s) + ' -O exit backuputil')
+            if ssh_ec != 0 and os.path.exists(os.path.join(ssh_dir, s)):
+                os.remove(os.path.join(ssh_dir, s))
+        except Exception as e:
+            logging.warning('Unable to close shared SSH connection - ' + str(e) + '.')
 
 
-# --------------------------------------
+def deliver_mail():
+    '''
+    Delivers the spooled emails (see "_deliver_mail()"), sending the digest of
+    queued notifications once it is due.
+    '''
+    if not 'args' in globals() or args.email_level == 'never': return
+    try:
+        _deliver_mail()
+    except Exception as e:
+        logging.warning('Unable to deliver spooled emails - ' + str(e) + '.')
 
 
+def execute_post_run():
+    '''
+    Executes the post-run command of the target (if any).
+    '''
+    if post_run and not args.dry_run:
+        _phase('post_run')
+        logging.info('Executing post-run command "' + post_run + '"...')
+        print(_substep(post_run))
+        try:
+            (post_out, post_ec) = _run_process(post_run)
+        except Exception as e:  
+            printe(_subsubstep('Unable to execute post-run command - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to execute post-run command - ' + str(e) + '.')
+            send_email(
+                'Unable to execute post-run command',
+                emails.POST_RUN_EXCEPTION,
+                'error'
+            )
+            sys.exit(4)
+        logging.debug('POST RUN EXIT CODE: ' + str(post_ec))
+        if post_ec != 0:
+            if post_out:
+                for l in post_out:
+                    logging.critical('POST RUN OUTPUT: ' + l)
+            printe(_subsubstep('Unable to proceed - post-run command returned non-zero exit code.', C_RED))
+            logging.critical('Unable to proceed - post-run command returned non-zero exit code.')
+            send_email(
+                'Specified post-run command returned non-zero exit code',
+                emails.POST_RUN_EXIT,
+                'error'
+            )
+            sys.exit(4)
+        else:
+            if post_out:
+                for l in post_out:
+                    logging.info('POST RUN OUTPUT: ' + l)
 
-# ---------- Public Functions ----------
 
 def get_hostname():
     '''
-    Obtains the hostname of the machine.
+    Obtains the hostname of the machine. Its FQDN is only resolved once an email
+    is sent (see "_fqdn()").
     '''
-    logging.debug('Getting hostname and FQDN...')
+    logging.debug('Getting hostname...')
     try:
         global hostname
-        hostname = socket.gethostname().split('.', 1)[0]
-        global fqdn
-        fqdn = socket.getfqdn()
+        hostname = os.uname()[1].split('.', 1)[0]
     except Exception as e:
         logging.critical('Unable to discern hostname - ' + str(e) + '.')
         sys.exit(1)
     logging.debug('Hostname: ' + hostname)
-    logging.debug('FQDN: ' + fqdn)
 
 
 def handle_backup():
@@ -435,11 +2790,26 @@ def handle_backup():
     else:
         print(_step('Executing ' + args.target + '...'))
         logging.info('Executing ' + args.target + '...')
-    prepare_execution()
+    global run_report
+    run_report = {
+        'target': args.target,
+        'hostname': hostname,
+        'dry_run': args.dry_run,
+        'started': time.time(),
+        'phases': {},
+        'archives': [],
+        'pruned_archives': None,
+        'kept_archives': None,
+        'exit_codes': {}
+    }
+    _phase('prepare')
+    prepare_execution(lock=True)
     global backup_output
     backup_output = ''
     global prune_output
     prune_output = ''
+    global backup_skipped
+    backup_skipped = False
     timestamp = datetime.datetime.now().strftime(args.timestamp_format)
     logging.debug('Timestamp: ' + timestamp)
     if args.log_level == 'debug':
@@ -450,79 +2820,177 @@ def handle_backup():
     if args.dry_run:
         additional_create_options = '--dry-run'
     else:
-        additional_create_options = '--stats'
+        additional_create_options = '--json'
     if args.log_level == 'debug': additional_create_options += ' --list'
     logging.debug('Additional Borg "create" Options: ' + additional_create_options)
-    archive_str = '{repo_str}::{timestamp}'.format(
-        repo_str = repo_str,
-        timestamp = timestamp
-    )
     create_options = additional_create_options
     if exclude_paths:
         for e in exclude_paths:
             create_options += " --exclude '" + e + "'"
-    create_options += ' --checkpoint-interval ' + str(args.checkpoint_interval)
-    borg_create_cmd = '{borg} {common_options} --remote-ratelimit {rate_limit} create {create_options} {archive} {paths}'.format(
-        borg = args.borg_executable,
-        common_options = common_options,
-        rate_limit = rate_limit,
-        create_options = create_options,
-        archive = archive_str,
-        paths = ' '.join(src_paths)
-    )
-    logging.debug('Borg Backup Command: ' + borg_create_cmd)
+    if 'chunker_params' in target:
+        create_options += ' --chunker-params ' + target['chunker_params']
+    if target.get('compression') == 'auto':
+        try:
+            (compression, compression_reason) = _auto_compression()
+        except Exception as e:
+            (compression, compression_reason) = (COMPRESSION_DEFAULT, 'unable to evaluate compression - ' + str(e))
+        logging.info('Compression: ' + compression + ' (' + compression_reason + ').')
+    else:
+        compression = target.get('compression')
+    if compression:
+        create_options += ' --compression ' + compression
+        run_report['compression'] = compression
+    if args.checkpoint_interval == 'auto':
+        try:
+            (checkpoint_interval, checkpoint_reason) = _auto_checkpoint_interval()
+        except Exception as e:
+            (checkpoint_interval, checkpoint_reason) = (CHECKPOINT_DEFAULT, 'unable to read run history - ' + str(e))
+        logging.info('Checkpoint interval: ' + str(checkpoint_interval) + ' seconds (' + checkpoint_reason + ').')
+    else:
+        checkpoint_interval = args.checkpoint_interval
+    run_report['checkpoint_interval'] = checkpoint_interval
+    create_options += ' --checkpoint-interval ' + str(checkpoint_interval)
+    if len(shard_repos) > 1:
+        shard_paths = assign_shards()
+    else:
+        shard_paths = [src_paths]
+    shards = [s for s in range(len(shard_repos)) if shard_paths[s]]
+    for shard in range(len(shard_repos)):
+        if not shard in shards: logging.warning('Skipping shard ' + str(shard) + ' - no source paths are assigned to it.')
+    def create_cmd(shard, limit):
+        if limit != '0' and len(shard_repos) > 1: limit = str(max(1, int(limit) // len(shard_repos)))
+        return '{borg} {common_options} --log-json --remote-ratelimit {rate_limit} create {create_options} {archive} {paths}'.format(
+            borg = args.borg_executable,
+            common_options = common_options,
+            rate_limit = limit,
+            create_options = create_options,
+            archive = shard_repos[shard] + '::' + timestamp,
+            paths = ' '.join(shard_paths[shard])
+        )
+    global archive_str
+    archive_str = ', '.join([shard_repos[shard] + '::' + timestamp for shard in shards])
+    borg_create_cmds = [create_cmd(shard, rate_limit) for shard in shards]
+    for borg_create_cmd in borg_create_cmds: logging.debug('Borg Backup Command: ' + borg_create_cmd)
+    reshare = None
+    if os.getenv('BACKUPUTIL_WORKER_SHARE_FILE') and not args.dry_run:
+        shares = {'current': [os.getenv('BACKUPUTIL_WORKER_RATE_SHARE')] * len(shards), 'restarted': [time.time()] * len(shards)}
+        def reshare(i):
+            if time.time() - shares['restarted'][i] < RESHARE_INTERVAL: return None
+            try:
+                with open(os.getenv('BACKUPUTIL_WORKER_SHARE_FILE'), 'r') as f:
+                    share = f.read().strip()
+            except IOError:
+                return None
+            if not share.isdigit() or share == shares['current'][i]: return None
+            logging.info('Bandwidth share of destination server changed to ' + share + ' KiB/s - restarting backup from its latest checkpoint...')
+            shares['current'][i] = share
+            shares['restarted'][i] = time.time()
+            return create_cmd(shards[i], _shared_rate_limit(int(share)))
+    index_state_path = os.path.join('index', args.target + '.json')
+    def scan_sources():
+        _phase('scan')
+        changed_dirs = None
+        if os.path.isfile(os.path.join(args.state_dir, 'journal', args.target + '.json')):
+            logging.info('Reading change journal...')
+            print(_substep('Reading change journal...'))
+            changed_dirs = read_watch_journal()
+            if changed_dirs is None:
+                print(_subsubstep('Warning: Change journal unavailable - falling back to a full scan.', C_ORANGE))
+            else:
+                print(_subsubstep(str(len(changed_dirs)) + ' directories changed since the last archive.'))
+                logging.info(str(len(changed_dirs)) + ' directories changed since the last archive.')
+                for d in changed_dirs:
+                    logging.debug('Changed Directory: ' + d)
+        if target.get('skip_if_unchanged') and changed_dirs == []:
+            print(_subsubstep('Skipping backup - source paths are unchanged since the last archive.'))
+            logging.info('Skipping backup - source paths are unchanged since the last archive.')
+            return (True, None)
+        if not target.get('skip_if_unchanged') or changed_dirs is not None:
+            return (False, None)
+        logging.info('Indexing source paths...')
+        print(_substep('Indexing source paths...'))
+        source_index = index_sources()
+        previous_index = _load_state(index_state_path, {})
+        if previous_index.get('repo') == repo_str and previous_index.get('sources') == source_index:
+            print(_subsubstep('Skipping backup - source paths are unchanged since archive "' + previous_index['archive'] + '".'))
+            logging.info('Skipping backup - source paths are unchanged since archive "' + previous_index['archive'] + '".')
+            return (True, source_index)
+        if previous_index.get('repo') == repo_str:
+            changed = sorted([p for p in set(source_index) | set(previous_index.get('sources', {})) if source_index.get(p) != previous_index['sources'].get(p)])
+            logging.info('Changed source paths: ' + ', '.join(changed))
+        return (False, source_index)
+    # The sources are scanned before the repository is verified, unless a
+    # pre-run command (such as a database dump) may still change them.
+    scan_first = not pre_run or args.dry_run
+    if scan_first:
+        (backup_skipped, source_index) = scan_sources()
+        if backup_skipped: return
+    _phase('verify')
     if dst_srv:
         logging.info('Verifying remote repository...')
         print(_substep('Verifying remote repository...'))
     else:
         logging.info('Verifying local repository...')
         print(_substep('Verifying local repository...'))
-    borg_info_cmd = '{borg} {common_options} info {repo_str}'.format(
-        borg = args.borg_executable,
-        common_options = common_options,
-        repo_str = repo_str
-    )
-    try:
-        (info_out, info_ec) = _run_process(borg_info_cmd)
-    except Exception as e:
-        printe(_subsubstep('Unable to verify repository - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to verify repository - ' + str(e) + '.')
-        send_email(
-            'Unable to verify repository',
-            emails.INFO_EXCEPTION,
-            'error'
-        )
-        sys.exit(4)
-    logging.debug('INFO EXIT CODE: ' + str(info_ec))
-    if info_ec == 1:
-        if info_out:
-            for l in info_out:
-                logging.warning('INFO OUTPUT: ' + l)
-        printe(_subsubstep('Warning: Repository verification subprocess returned warning-level exit code.', C_ORANGE))
-        logging.warning('Repository verification subprocess returned warning-level exit code.')
-        send_email(
-            'Repository verification subproces returned warning-level exit code',
-            emails.INFO_WARN,
-            'warning'
-        )
-    elif info_ec > 1:
-        if info_out:
-            for l in info_out:
-                logging.critical('INFO OUTPUT: ' + l)
-        printe(_subsubstep('Unable to verify repository - subprocess returned error-level exit code.', C_RED))
-        printe(_subsubstep('Make sure the destination repository was created via "borg init" prior to running the script.', C_RED))
-        logging.critical('Unable to verify repository - subprocess returned error-level exit code.')
-        send_email(
-            'UUnable to verify repository',
-            emails.INFO_ERR,
-            'error'
+    for shard_repo in shard_repos:
+        verified = _load_state(os.path.join('verified', _repo_key(shard_repo) + '.json'), {})
+        if args.verify_ttl and not args.reverify and verified.get('repo') == shard_repo and 0 <= time.time() - verified.get('verified', 0) < args.verify_ttl:
+            print(_subsubstep('Skipping ' + shard_repo + ' - verified ' + str(datetime.timedelta(seconds=int(time.time() - verified['verified']))) + ' ago.'))
+            logging.info('Skipping verification of ' + shard_repo + ' - verified ' + str(datetime.timedelta(seconds=int(time.time() - verified['verified']))) + ' ago (repository ID: ' + str(verified.get('id')) + ').')
+            continue
+        borg_info_cmd = '{borg} {common_options} info {repo_str}'.format(
+            borg = args.borg_executable,
+            common_options = common_options,
+            repo_str = shard_repo
         )
-        sys.exit(4)
-    else:
-        if info_out:
-            for l in info_out:
-                logging.debug('INFO OUTPUT: ' + l)
+        try:
+            (info_out, info_ec) = _run_process(borg_info_cmd)
+        except Exception as e:
+            printe(_subsubstep('Unable to verify repository - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to verify repository - ' + str(e) + '.')
+            send_email(
+                'Unable to verify repository',
+                emails.INFO_EXCEPTION,
+                'error'
+            )
+            sys.exit(4)
+        logging.debug('INFO EXIT CODE: ' + str(info_ec))
+        if info_ec == 1:
+            if info_out:
+                for l in info_out:
+                    logging.warning('INFO OUTPUT: ' + l)
+            printe(_subsubstep('Warning: Repository verification subprocess returned warning-level exit code.', C_ORANGE))
+            logging.warning('Repository verification subprocess returned warning-level exit code.')
+            send_email(
+                'Repository verification subproces returned warning-level exit code',
+                emails.INFO_WARN,
+                'warning'
+            )
+        elif info_ec > 1:
+            if info_out:
+                for l in info_out:
+                    logging.critical('INFO OUTPUT: ' + l)
+            printe(_subsubstep('Unable to verify repository - subprocess returned error-level exit code.', C_RED))
+            printe(_subsubstep('Make sure the destination repository was created via "borg init" prior to running the script.', C_RED))
+            logging.critical('Unable to verify repository - subprocess returned error-level exit code.')
+            send_email(
+                'UUnable to verify repository',
+                emails.INFO_ERR,
+                'error'
+            )
+            sys.exit(4)
+        else:
+            repo_id = None
+            if info_out:
+                for l in info_out:
+                    logging.debug('INFO OUTPUT: ' + l)
+                    if l.startswith('Repository ID:'): repo_id = l.split(':', 1)[1].strip()
+            try:
+                _save_state(os.path.join('verified', _repo_key(shard_repo) + '.json'), {'repo': shard_repo, 'id': repo_id, 'verified': time.time()})
+            except Exception as e:
+                logging.warning('Unable to record repository verification - ' + str(e) + '.')
     if pre_run and not args.dry_run:
+        _phase('pre_run')
         logging.info('Executing pre-run command "' + pre_run + '"...')
         print(_substep(pre_run))
         try:
@@ -553,20 +3021,45 @@ def handle_backup():
             if pre_out:
                 for l in pre_out:
                     logging.info('PRE RUN OUTPUT: ' + l)
+    if not scan_first:
+        (backup_skipped, source_index) = scan_sources()
+        if backup_skipped:
+            execute_post_run()
+            return
+    _phase('create')
     logging.info('Performing backup...')
     print(_substep('Performing backup...'))
+    global archive_started
+    archive_started = time.time()
     try:
-        backup_process = subprocess.Popen(
-            borg_create_cmd,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.STDOUT,
-            shell = True
-        )
-        for line in iter(backup_process.stdout.readline, ''):
-            backup_output += line
-            logging.info('BACKUP OUTPUT: ' + line.rstrip())
-        while backup_process.poll() is None: time.sleep(0.5)
-        backup_exit_code = backup_process.returncode
+        backup_results = []
+        (backup_output, backup_exit_codes) = _stream_processes(borg_create_cmds, 'BACKUP', keep_output=args.log_level != 'debug', results=backup_results, restart=reshare)
+        run_report['exit_codes']['create'] = backup_exit_codes
+        for (shard, result) in enumerate(backup_results):
+            if result['json'] is None or not 'archive' in result['json']: continue
+            archive = result['json']['archive']
+            run_report['archives'].append({
+                'repository': result['json'].get('repository', {}).get('location'),
+                'name': archive.get('name'),
+                'start': archive.get('start'),
+                'end': archive.get('end'),
+                'duration': archive.get('duration'),
+                'files': archive.get('stats', {}).get('nfiles'),
+                'original_size': archive.get('stats', {}).get('original_size'),
+                'compressed_size': archive.get('stats', {}).get('compressed_size'),
+                'deduplicated_size': archive.get('stats', {}).get('deduplicated_size')
+            })
+            if len(backup_results) > 1:
+                (log_prefix, output_prefix) = ('BACKUP STATS [' + str(shard) + ']: ', '[' + str(shard) + '] ')
+            else:
+                (log_prefix, output_prefix) = ('BACKUP STATS: ', '')
+            try:
+                for l in _format_archive_stats(result['json']).splitlines():
+                    logging.info(log_prefix + l)
+                    if args.log_level != 'debug': backup_output += output_prefix + l + '\n'
+            except (KeyError, TypeError, ValueError) as e:
+                logging.warning('Unable to parse archive statistics - ' + str(e) + '.')
+        backup_exit_code = max(backup_exit_codes)
         logging.debug('BACKUP EXIT CODE: ' + str(backup_exit_code))
     except Exception as e:
         printe(_subsubstep('Unable to perform backup - ' + str(e) + '.', C_RED))
@@ -588,13 +3081,28 @@ def handle_backup():
     elif backup_exit_code > 1:
         printe(_subsubstep('Unable to perform backup - subprocess returned error-level exit code.', C_RED))
         logging.critical('Unable to perform backup - subprocess returned error-level exit code.')
+        cached = [r for r in shard_repos if os.path.isfile(os.path.join(args.state_dir, 'verified', _repo_key(r) + '.json'))]
+        if cached:
+            printe(_subsubstep('Make sure the destination repository was created via "borg init" prior to running the script.', C_RED))
+            logging.info('Discarding cached repository verification...')
+            for shard_repo in cached:
+                try:
+                    os.remove(os.path.join(args.state_dir, 'verified', _repo_key(shard_repo) + '.json'))
+                except OSError as e:
+                    logging.warning('Unable to discard cached repository verification - ' + str(e) + '.')
         send_email(
             'Unable to perform backup',
             emails.BACKUP_ERR,
             'error'
         )
         sys.exit(4)
+    if source_index is not None and backup_exit_code == 0 and not args.dry_run:
+        try:
+            _save_state(index_state_path, {'repo': repo_str, 'archive': archive_str, 'sources': source_index})
+        except Exception as e:
+            logging.warning('Unable to record source path index - ' + str(e) + '.')
     if not keep: return
+    _phase('prune')
     logging.info('Pruning old backups...')
     print(_substep('Pruning old backups...'))
     if args.dry_run:
@@ -602,7 +3110,7 @@ def handle_backup():
     else:
         prune_options = '--stats'
     if args.force_prune: prune_options += ' --force'
-    if args.log_level == 'debug': prune_options += ' --list'
+    prune_options += ' --list'
     keep_str = ''
     if 'hourly' in keep: keep_str += ' --keep-hourly ' + str(keep['hourly'])
     if 'daily' in keep: keep_str += ' --keep-daily ' + str(keep['daily'])
@@ -610,26 +3118,24 @@ def handle_backup():
     if 'monthly' in keep: keep_str += ' --keep-monthly ' + str(keep['monthly'])
     if 'yearly' in keep: keep_str += ' --keep-yearly ' + str(keep['yearly'])
     keep_str.lstrip(' ')
-    borg_prune_cmd = '{borg} {common_options} prune {prune_options} {keep} {repo_str}'.format(
-        borg = args.borg_executable,
-        common_options = common_options,
-        prune_options = prune_options,
-        keep = keep_str,
-        repo_str = repo_str
-    )
-    logging.debug('Borg Prune Command: ' + borg_prune_cmd)
-    try:
-        prune_process = subprocess.Popen(
-            borg_prune_cmd,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.STDOUT,
-            shell = True
+    borg_prune_cmds = []
+    for shard_repo in shard_repos:
+        borg_prune_cmd = '{borg} {common_options} --log-json prune {prune_options} {keep} {repo_str}'.format(
+            borg = args.borg_executable,
+            common_options = common_options,
+            prune_options = prune_options,
+            keep = keep_str,
+            repo_str = shard_repo
         )
-        for line in iter(prune_process.stdout.readline, ''):
-            prune_output += line
-            logging.info('PRUNE OUTPUT: ' + line.rstrip())
-        while prune_process.poll() is None: time.sleep(0.5)
-        prune_exit_code = prune_process.returncode
+        logging.debug('Borg Prune Command: ' + borg_prune_cmd)
+        borg_prune_cmds.append(borg_prune_cmd)
+    try:
+        prune_results = []
+        (prune_output, prune_exit_codes) = _stream_processes(borg_prune_cmds, 'PRUNE', keep_output=True, results=prune_results)
+        run_report['exit_codes']['prune'] = prune_exit_codes
+        run_report['pruned_archives'] = sum([r['pruned'] for r in prune_results])
+        run_report['kept_archives'] = sum([r['kept'] for r in prune_results])
+        prune_exit_code = max(prune_exit_codes)
         logging.debug('PRUNE EXIT CODE: ' + str(prune_exit_code))
     except Exception as e:
         printe(_subsubstep('Unable to prune old backups - ' + str(e) + '.', C_RED))
@@ -657,38 +3163,339 @@ def handle_backup():
             'error'
         )
         sys.exit(5)
-    if post_run and not args.dry_run:
-        logging.info('Executing post-run command "' + post_run + '"...')
-        print(_substep(post_run))
+    execute_post_run()
+
+
+def handle_bench_target():
+    '''
+    Handles the "--bench-target" flag.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    print(_step('Benchmarking chunker parameters of ' + args.target + '...'))
+    logging.info('Benchmarking chunker parameters of ' + args.target + '...')
+    _phase('prepare')
+    prepare_execution()
+    _phase('sample')
+    print(_substep('Sampling source paths...'))
+    logging.info('Sampling source paths...')
+    try:
+        (sample, sample_size) = _sample_sources(args.bench_sample)
+    except Exception as e:
+        printe(_subsubstep('Unable to sample source paths - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to sample source paths - ' + str(e) + '.')
+        sys.exit(14)
+    if not sample:
+        printe(_subsubstep('Unable to sample source paths - no files were selected (try a larger "--bench-sample").', C_RED))
+        logging.critical('Unable to sample source paths - no files were selected.')
+        sys.exit(14)
+    print(_subsubstep('Selected ' + str(len(sample)) + ' files (' + _format_bytes(sample_size) + ').'))
+    logging.info('Selected ' + str(len(sample)) + ' files (' + _format_bytes(sample_size) + ').')
+    _phase('bench')
+    results = []
+    bench_dir = tempfile.mkdtemp(prefix='backuputil-bench-')
+    try:
+        changes = _bench_changes(sample, os.path.join(bench_dir, 'changed'))
+        print(_subsubstep('Modified ' + str(len(changes)) + ' of the sampled files for the second backup.'))
+        logging.info('Modified ' + str(len(changes)) + ' of the sampled files for the second backup.')
+        patterns_paths = [os.path.join(bench_dir, 'patterns-1'), os.path.join(bench_dir, 'patterns-2')]
+        with open(patterns_paths[0], 'w') as f:
+            for p in src_paths: f.write('R ' + p + '\n')
+            for p in sample: f.write('+ pf:' + p + '\n')
+            f.write('- sh:**\n')
+        with open(patterns_paths[1], 'w') as f:
+            for p in src_paths: f.write('R ' + p + '\n')
+            f.write('R ' + os.path.join(bench_dir, 'changed') + '\n')
+            for p in sample: f.write('+ pf:' + changes.get(p, p) + '\n')
+            f.write('- sh:**\n')
+        for chunker_params in BENCH_CHUNKER_PARAMS:
+            print(_substep('Benchmarking "' + chunker_params + '"...'))
+            logging.info('Benchmarking "' + chunker_params + '"...')
+            results.append(_bench_chunker_params(bench_dir, patterns_paths, chunker_params))
+    except Exception as e:
+        printe(_subsubstep('Unable to benchmark chunker parameters - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to benchmark chunker parameters - ' + str(e) + '.')
+        sys.exit(14)
+    finally:
+        shutil.rmtree(bench_dir, ignore_errors=True)
+    print(_substep('Results:'))
+    print(_subsubstep('%-16s  %12s  %7s  %10s  %10s  %10s  %10s' % ('CHUNKER PARAMS', 'THROUGHPUT', 'DEDUP', 'STORED', 'CHANGE', 'CHUNKS', 'INDEX')))
+    for r in results:
+        r['index_size'] = r['chunks'] * BENCH_INDEX_ENTRY
+        line = '%-16s  %12s  %6.2fx  %10s  %10s  %10d  %10s' % (
+            r['chunker_params'],
+            _format_bytes(r['throughput']) + '/s',
+            r['original_size'] / float(max(r['deduplicated_size'], 1)),
+            _format_bytes(r['deduplicated_size']),
+            _format_bytes(r['changed_size']),
+            r['chunks'],
+            _format_bytes(r['index_size'])
+        )
+        print(_subsubstep(line))
+        logging.info('BENCH RESULT: ' + line)
+    fastest = max([r['throughput'] for r in results])
+    candidates = [r for r in results if r['throughput'] >= fastest * BENCH_MIN_THROUGHPUT]
+    best = min(candidates, key=lambda r: r['deduplicated_size'] + r['index_size'])
+    print(_substep('Best chunker parameters: ' + best['chunker_params'] + ' (estimated chunk index of the whole target: ' + _format_bytes(best['index_size'] / args.bench_sample) + ')'))
+    logging.info('Best chunker parameters: ' + best['chunker_params'] + '.')
+    if target.get('chunker_params') == best['chunker_params']:
+        print(_subsubstep('The target already uses these chunker parameters.'))
+    elif args.dry_run:
+        print(_subsubstep('Not updating the target specification (dry run).'))
+    else:
         try:
-            (post_out, post_ec) = _run_process(post_run)
-        except Exception as e:  
-            printe(_subsubstep('Unable to execute post-run command - ' + str(e) + '.', C_RED))
-            logging.critical('Unable to execute post-run command - ' + str(e) + '.')
-            send_email(
-                'Unable to execute post-run command',
-                emails.POST_RUN_EXCEPTION,
-                'error'
-            )
-            sys.exit(4)
-        logging.debug('POST RUN EXIT CODE: ' + str(post_ec))
-        if post_ec != 0:
-            if post_out:
-                for l in post_out:
-                    logging.critical('POST RUN OUTPUT: ' + l)
-            printe(_subsubstep('Unable to proceed - post-run command returned non-zero exit code.', C_RED))
-            logging.critical('Unable to proceed - post-run command returned non-zero exit code.')
-            send_email(
-                'Specified post-run command returned non-zero exit code',
-                emails.POST_RUN_EXIT,
-                'error'
+            path = _write_target_option('chunker_params', best['chunker_params'])
+        except Exception as e:
+            printe(_subsubstep('Unable to update target specification - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to update target specification - ' + str(e) + '.')
+            printe(_subsubstep('Set "chunker_params: \'' + best['chunker_params'] + '\'" within the target specification manually.', C_RED))
+            sys.exit(14)
+        print(_subsubstep('Updated "chunker_params" of the target within "' + path + '".'))
+        logging.info('Updated "chunker_params" of the target within "' + path + '".')
+    logging.info('Process complete.')
+    sys.exit(0)
+
+
+def handle_check_config():
+    '''
+    Handles the "--check-config" flag by validating every target concurrently
+    (sharing the hostname resolution of each destination server between them),
+    optionally probing each unique destination server via SSH.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    print(_step('Checking ' + str(len(selected_targets)) + ' targets...'))
+    logging.info('Checking ' + str(len(selected_targets)) + ' targets...')
+    for name in selected_targets:
+        spec = config['targets'][name]
+        if isinstance(spec, dict) and isinstance(spec.get('dst_srv'), str):
+            _start_resolution(spec['dst_srv'])
+    problems = dict(zip(selected_targets, _parallel_map(lambda n: _target_problems(config['targets'][n]), selected_targets)))
+    if args.probe_servers:
+        destinations = {}
+        for name in selected_targets:
+            spec = config['targets'][name]
+            if problems[name] or not 'dst_srv' in spec: continue
+            destination = (
+                spec.get('user') or args.user or getpass.getuser(),
+                spec['dst_srv'],
+                os.path.expanduser(os.path.expandvars(spec.get('cert_path', args.cert_path)))
             )
-            sys.exit(4)
+            destinations.setdefault(destination, []).append(name)
+        print(_substep('Probing ' + str(len(destinations)) + ' destination servers...'))
+        logging.info('Probing ' + str(len(destinations)) + ' destination servers...')
+        for (destination, problem) in _probe_servers(destinations).items():
+            if problem is None: continue
+            for name in destinations[destination]:
+                problems[name].append('unable to run Borg on destination server "' + destination[1] + '" via SSH (' + problem + ')')
+    print(_step('Report'))
+    logging.info('Report:')
+    report = ''
+    for name in selected_targets:
+        if problems[name]:
+            line = name + ': ' + str(len(problems[name])) + ' problem(s)'
+            print(_substep(line, C_RED))
+            logging.error(line)
+            report += line + '\n'
+            for problem in problems[name]:
+                print(_subsubstep(problem[0].upper() + problem[1:] + '.', C_RED))
+                logging.error('    ' + problem)
+                report += '    ' + problem + '\n'
         else:
-            if post_out:
-                for l in post_out:
-                    logging.info('POST RUN OUTPUT: ' + l)
-    
+            print(_substep(name + ': OK', C_GREEN))
+            logging.info(name + ': OK')
+    failures = [n for n in selected_targets if problems[n]]
+    if failures:
+        send_email(
+            'Configuration check found problems in ' + str(len(failures)) + ' of ' + str(len(selected_targets)) + ' targets',
+            'The backuputil script reports that it has found problems in the following targets:\n\n' + report,
+            'error'
+        )
+        logging.info('Process complete.')
+        sys.exit(3)
+    logging.info('Process complete.')
+    sys.exit(0)
+
+
+def handle_daemon():
+    '''
+    Handles the "--daemon" flag by running as a long-lived scheduler. Each target
+    defining an "rpo" is executed within its own worker process whenever the age
+    of its last successful backup exceeds that recovery point objective, most
+    overdue target first. The configuration file is reloaded whenever it changes
+    (or upon SIGHUP), and SIGTERM stops the daemon once running workers finish.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    print(_step('Starting scheduler daemon...'))
+    logging.info('Starting scheduler daemon...')
+    global config
+    global selected_targets
+    global worker_results
+    worker_results = []
+    global daemon_signal
+    daemon_signal = None
+    def on_signal(signum, frame):
+        global daemon_signal
+        daemon_signal = signum
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGHUP, on_signal)
+    config_stamp = _config_stamp()
+    last_success = {}
+    for name in config['targets']:
+        last_success[name] = _load_state(os.path.join('targets', name + '.json'), {}).get('last_success')
+    next_pass = 0
+    retry_at = {}
+    running = {}
+    if not selected_targets:
+        logging.warning('No targets specify an "rpo" - waiting for configuration changes...')
+    while True:
+        if daemon_signal == signal.SIGTERM:
+            if not running: break
+        elif daemon_signal == signal.SIGHUP or _config_stamp() != config_stamp:
+            daemon_signal = None
+            logging.info('Reloading configuration file...')
+            previous = (config, selected_targets)
+            try:
+                parse_yaml_config()
+                for name in config['targets']:
+                    if not name in last_success:
+                        last_success[name] = _load_state(os.path.join('targets', name + '.json'), {}).get('last_success')
+            except SystemExit:
+                (config, selected_targets) = previous
+                logging.error('Unable to reload configuration file - continuing with previous configuration.')
+            config_stamp = _config_stamp()
+            next_pass = 0
+        if daemon_signal != signal.SIGTERM and time.time() >= next_pass:
+            now = time.time()
+            next_pass = now + DAEMON_INTERVAL
+            deliver_mail()
+            due = []
+            for name in selected_targets:
+                if name in running or retry_at.get(name, 0) > now: continue
+                rpo = _parse_duration(config['targets'][name]['rpo'])
+                if last_success.get(name) is None:
+                    due.append((float('inf'), name))
+                elif now - last_success[name] >= rpo:
+                    due.append((now - last_success[name] - rpo, name))
+            due_names = [n for (o, n) in due]
+            for (overdue, name) in sorted(due, reverse=True):
+                rpo = _parse_duration(config['targets'][name]['rpo'])
+                if [d for d in _target_list(config['targets'][name].get('depends_on')) if d in running or d in due_names or d in retry_at]: continue
+                server = _target_server(name)
+                if not _worker_slot_available(server, running): continue
+                rate_share = _rate_share(server, running, len([n for n in due_names if n != name and not n in running and _target_server(n) == server]))
+                if overdue == float('inf'):
+                    logging.info('Dispatching ' + name + ' (no previous successful backup)...')
+                else:
+                    logging.info('Dispatching ' + name + ' (overdue by ' + str(datetime.timedelta(seconds=int(overdue))) + ')...')
+                if not _start_worker(name, running, rate_share):
+                    retry_at[name] = now + min(rpo, DAEMON_RETRY_DELAY)
+            _rebalance_shares(running)
+        finished = _wait_worker()
+        if finished is None: continue
+        (name, exit_code) = finished
+        del running[name]
+        _release_share(name)
+        next_pass = 0
+        logging.info('Finished ' + name + ' with exit code ' + str(exit_code) + '.')
+        if exit_code == 0:
+            last_success[name] = _load_state(os.path.join('targets', name + '.json'), {}).get('last_success')
+            retry_at.pop(name, None)
+        elif name in config['targets'] and 'rpo' in config['targets'][name]:
+            retry_at[name] = time.time() + min(_parse_duration(config['targets'][name]['rpo']), DAEMON_RETRY_DELAY)
+            logging.warning('Retrying ' + name + ' in ' + str(datetime.timedelta(seconds=int(retry_at[name] - time.time()))) + '.')
+    logging.info('Scheduler daemon stopped.')
+    sys.exit(0)
+
+
+def handle_deliver_mail():
+    '''
+    Handles the "--deliver-mail" flag.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    print(_step('Delivering queued emails...'))
+    logging.info('Delivering queued emails...')
+    try:
+        delivered = _deliver_mail()
+    except Exception as e:
+        printe(_subsubstep('Unable to deliver queued emails - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to deliver queued emails - ' + str(e) + '.')
+        sys.exit(15)
+    print(_substep('Handed ' + str(delivered) + ' email(s) to sendmail.'))
+    logging.info('Handed ' + str(delivered) + ' email(s) to sendmail.')
+    digest_dir = os.path.join(args.state_dir, 'mail', 'digest')
+    queued = len([n for n in os.listdir(digest_dir) if n.endswith('.json')]) if os.path.isdir(digest_dir) else 0
+    if queued:
+        print(_substep(str(queued) + ' notification(s) remain queued for the next digest.'))
+        logging.info(str(queued) + ' notification(s) remain queued for the next digest.')
+    logging.info('Process complete.')
+    sys.exit(0)
+
+
+def handle_history():
+    '''
+    Handles the "--history" flag.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    print(_step('Reading run history of ' + args.target + '...'))
+    logging.info('Reading run history of ' + args.target + '...')
+    try:
+        db = _history_db()
+        runs = db.execute('SELECT id, started, duration, exit_code, failed_phase, skipped, archive, files, original_size, deduplicated_size FROM runs WHERE target = ? ORDER BY started DESC', (args.target,)).fetchall()
+        phases = db.execute('SELECT phases.phase, phases.duration FROM phases JOIN runs ON runs.id = phases.run_id WHERE runs.target = ? AND runs.exit_code = 0', (args.target,)).fetchall()
+        db.close()
+    except Exception as e:
+        printe(_subsubstep('Unable to read run history - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to read run history - ' + str(e) + '.')
+        sys.exit(13)
+    if not runs:
+        print(_substep('No runs of ' + args.target + ' have been recorded.'))
+        logging.info('Process complete.')
+        sys.exit(0)
+    def fmt_time(t):
+        return datetime.datetime.fromtimestamp(t).strftime('%Y-%m-%d %H:%M:%S')
+    def fmt_bytes(size):
+        if size is None: return '-'
+        return _format_bytes(size)
+    def fmt_duration(seconds):
+        if seconds < 60: return '%.1fs' % seconds
+        return str(datetime.timedelta(seconds=int(seconds)))
+    successes = [r for r in runs if r[3] == 0]
+    print(_substep('Recorded runs: ' + str(len(runs)) + ' (' + str(len(successes)) + ' successful)'))
+    if successes:
+        print(_substep('Last success: ' + fmt_time(successes[0][1]) + ' (' + str(datetime.timedelta(seconds=int(time.time() - successes[0][1]))) + ' ago)'))
+    print(_substep('Recent runs:'))
+    print(_subsubstep('%-19s  %10s  %4s  %9s  %10s  %10s  %s' % ('STARTED', 'DURATION', 'EXIT', 'FILES', 'ORIGINAL', 'DEDUP', 'ARCHIVE')))
+    for (run_id, started, duration, exit_code, failed_phase, skipped, archive, files, original_size, deduplicated_size) in runs[:HISTORY_RUNS]:
+        if skipped:
+            archive = '(skipped - unchanged)'
+        elif exit_code != 0:
+            archive = '(failed during ' + str(failed_phase) + ')'
+        print(_subsubstep('%-19s  %10s  %4d  %9s  %10s  %10s  %s' % (
+            fmt_time(started),
+            fmt_duration(duration),
+            exit_code,
+            '-' if files is None else str(files),
+            fmt_bytes(original_size),
+            fmt_bytes(deduplicated_size),
+            archive or '-'
+        ), C_RED if exit_code > 1 else None))
+    if successes:
+        print(_substep('Percentiles of successful runs:'))
+        print(_subsubstep('%-24s' % 'METRIC' + ''.join(['  %10s' % ('P' + str(p)) for p in HISTORY_PERCENTILES])))
+        metrics = [('duration', [r[2] for r in successes], fmt_duration)]
+        for phase in sorted(set([p for (p, d) in phases])):
+            metrics.append(('phase ' + phase, [d for (p, d) in phases if p == phase], fmt_duration))
+        metrics.append(('original size', [r[8] for r in successes if r[8] is not None], _format_bytes))
+        metrics.append(('deduplicated size', [r[9] for r in successes if r[9] is not None], _format_bytes))
+        for (name, values, formatter) in metrics:
+            if not values: continue
+            print(_subsubstep('%-24s' % name + ''.join(['  %10s' % formatter(_percentile(values, p)) for p in HISTORY_PERCENTILES])))
+    logging.info('Process complete.')
+    sys.exit(0)
 
 
 def handle_info():
@@ -703,40 +3510,46 @@ def handle_info():
     else:
         print(_step('Getting local repository information...'))
         logging.info('Getting local repository information...')
+    _phase('prepare')
     prepare_execution()
-    print(_substep('Getting info...'))
-    logging.debug('Getting info...')
-    borg_info_cmd = '{borg} info {repo_str}'.format(
-        borg = args.borg_executable,
-        repo_str = repo_str
-    )
-    try:
-        (info_out, info_ec) = _run_process(borg_info_cmd)
-    except Exception as e:
-        printe(_subsubstep('Unable to obtain info - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to obtain info - ' + str(e) + '.')
-        sys.exit(8)
-    logging.debug('INFO EXIT CODE: ' + str(info_ec))
-    if info_ec == 1:
-        if info_out:
-            for l in info_out:
-                printe(_subsubstep(l))
-                logging.warning('INFO OUTPUT: ' + l)
-        printe(_subsubstep('Warning: subprocess returned warning-level exit code.', C_ORANGE))
-        logging.warning('Subprocess returned warning-level exit code.')
-    elif info_ec > 1:
-        if info_out:
-            for l in info_out:
-                printe(_subsubstep(l))
-                logging.critical('INFO OUTPUT: ' + l)
-        printe(_subsubstep('Error: subprocess returned error-level exit code.', C_RED))
-        logging.critical('Subprocess returned error-level exit code.')
-        sys.exit(8)
-    else:
-        if info_out:
-            for l in info_out:
-                print(_subsubstep(l))
-                logging.info('INFO OUTPUT: ' + l)
+    _phase('info')
+    for (shard, shard_repo) in enumerate(shard_repos):
+        if len(shard_repos) > 1:
+            print(_step('Shard ' + str(shard) + ' (' + shard_repo + ')'))
+            logging.info('Shard ' + str(shard) + ' (' + shard_repo + ')')
+        print(_substep('Getting info...'))
+        logging.debug('Getting info...')
+        borg_info_cmd = '{borg} info {repo_str}'.format(
+            borg = args.borg_executable,
+            repo_str = shard_repo
+        )
+        try:
+            (info_out, info_ec) = _run_process(borg_info_cmd)
+        except Exception as e:
+            printe(_subsubstep('Unable to obtain info - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to obtain info - ' + str(e) + '.')
+            sys.exit(8)
+        logging.debug('INFO EXIT CODE: ' + str(info_ec))
+        if info_ec == 1:
+            if info_out:
+                for l in info_out:
+                    printe(_subsubstep(l))
+                    logging.warning('INFO OUTPUT: ' + l)
+            printe(_subsubstep('Warning: subprocess returned warning-level exit code.', C_ORANGE))
+            logging.warning('Subprocess returned warning-level exit code.')
+        elif info_ec > 1:
+            if info_out:
+                for l in info_out:
+                    printe(_subsubstep(l))
+                    logging.critical('INFO OUTPUT: ' + l)
+            printe(_subsubstep('Error: subprocess returned error-level exit code.', C_RED))
+            logging.critical('Subprocess returned error-level exit code.')
+            sys.exit(8)
+        else:
+            if info_out:
+                for l in info_out:
+                    print(_subsubstep(l))
+                    logging.info('INFO OUTPUT: ' + l)
     logging.info('Process complete.')
     sys.exit(0)
 
@@ -753,40 +3566,58 @@ def handle_list_archives():
     else:
         print(_step('Listing local repository archives...'))
         logging.info('Listing local repository archives...')
+    _phase('prepare')
     prepare_execution()
+    _phase('list')
     print(_substep('Getting archive list...'))
     logging.debug('Getting archive list...')
-    borg_list_cmd = '{borg} list --short {repo_str}'.format(
-        borg = args.borg_executable,
-        repo_str = repo_str
-    )
-    try:
-        (list_out, list_ec) = _run_process(borg_list_cmd)
-    except Exception as e:
-        printe(_subsubstep('Unable to obtain archive list - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to obtain archive list - ' + str(e) + '.')
-        sys.exit(9)
-    logging.debug('LIST EXIT CODE: ' + str(list_ec))
-    if list_ec == 1:
-        if list_out:
-            for l in list_out:
-                printe(_subsubstep(l))
-                logging.warning('LIST OUTPUT: ' + l)
-        printe(_subsubstep('Warning: subprocess returned warning-level exit code.', C_ORANGE))
-        logging.warning('Subprocess returned warning-level exit code.')
-    elif list_ec > 1:
-        if list_out:
-            for l in list_out:
-                printe(_subsubstep(l))
-                logging.critical('LIST OUTPUT: ' + l)
-        printe(_subsubstep('Error: subprocess returned error-level exit code.', C_RED))
-        logging.critical('Subprocess returned error-level exit code.')
-        sys.exit(9)
-    else:
-        if list_out:
+    shard_archives = []
+    for shard_repo in shard_repos:
+        borg_list_cmd = '{borg} list --short {repo_str}'.format(
+            borg = args.borg_executable,
+            repo_str = shard_repo
+        )
+        list_archives = []
+        list_status = {}
+        try:
+            for l in _process_lines(borg_list_cmd, list_status):
+                logging.info('LIST OUTPUT: ' + l)
+                if len(shard_repos) == 1:
+                    print(_subsubstep(l))
+                else:
+                    list_archives.append(l)
+            list_ec = list_status['exit_code']
+        except Exception as e:
+            printe(_subsubstep('Unable to obtain archive list - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to obtain archive list - ' + str(e) + '.')
+            sys.exit(9)
+        logging.debug('LIST EXIT CODE: ' + str(list_ec))
+        if list_ec == 1:
+            printe(_subsubstep('Warning: subprocess returned warning-level exit code.', C_ORANGE))
+            logging.warning('Subprocess returned warning-level exit code.')
+        elif list_ec > 1:
+            if list_archives:
+                for l in list_archives:
+                    printe(_subsubstep(l))
+            printe(_subsubstep('Error: subprocess returned error-level exit code.', C_RED))
+            logging.critical('Subprocess returned error-level exit code.')
+            sys.exit(9)
+        shard_archives.append(list_archives)
+    if len(shard_repos) > 1:
+        archive_sets = [set(list_out) for list_out in shard_archives]
+        archive_names = []
+        seen = set()
+        for list_out in shard_archives:
             for l in list_out:
+                if not l in seen:
+                    seen.add(l)
+                    archive_names.append(l)
+        for l in archive_names:
+            missing = [str(i) for (i, archive_set) in enumerate(archive_sets) if not l in archive_set]
+            if missing:
+                print(_subsubstep(l + ' (incomplete - missing from shard ' + ', '.join(missing) + ')', C_ORANGE))
+            else:
                 print(_subsubstep(l))
-                logging.info('LIST OUTPUT: ' + l)
     logging.info('Process complete.')
     sys.exit(0)
 
@@ -799,9 +3630,15 @@ def handle_list_targets():
     issue. The only output will be the list of targets.
     '''
     try:
-        with open(args.config_file, 'r') as f:
-            targets = [t for t in yaml.safe_load(f.read())['targets']]
-        for target in targets: print(target)
+        cache = _read_config_cache(load_targets=False)
+        if cache:
+            targets = cache[0]['names']
+        else:
+            targets = []
+            for path in _config_files():
+                with open(path, 'r') as f:
+                    targets.extend([t for t in (_yaml_load(f.read()) or {}).get('targets', {})])
+        for target in sorted(targets): print(target)
     except Exception as e: sys.exit(1)
     sys.exit(0)
 
@@ -819,33 +3656,39 @@ def handle_repair():
     else:
         print(_step('Repairing local repository...'))
         logging.info('Repairing local repository...')
-    prepare_execution()
+    _phase('prepare')
+    prepare_execution(lock=True)
+    _phase('repair')
     if args.log_level == 'debug':
         common_options = '--debug'
     else:
         common_options = '--info'
-    print(_substep('Repairing repository...'))
-    logging.debug('Repairing repository...')
-    try:
-        repair_ec = os.system(
-            '{borg} {common_options} check --repair {repo}'.format(
-                borg = args.borg_executable,
-                common_options = common_options,
-                repo = repo_str
+    for (shard, shard_repo) in enumerate(shard_repos):
+        if len(shard_repos) > 1:
+            print(_step('Shard ' + str(shard) + ' (' + shard_repo + ')'))
+            logging.info('Shard ' + str(shard) + ' (' + shard_repo + ')')
+        print(_substep('Repairing repository...'))
+        logging.debug('Repairing repository...')
+        try:
+            repair_ec = os.system(
+                '{borg} {common_options} check --repair {repo}'.format(
+                    borg = args.borg_executable,
+                    common_options = common_options,
+                    repo = shard_repo
+                )
             )
-        )
-    except Exception as e:
-        printe(_subsubstep('Unable to repair repository - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to repair repository - ' + str(e) + '.')
-        sys.exit(EC)
-    logging.debug('REPAIR EXIT CODE: ' + str(repair_ec))
-    if repair_ec == 1:
-        printe(_subsubstep('Warning: Repository integrity repair returned warning-level exit code.', C_ORANGE))
-        logging.warning('Repository integrity repair returned warning-level exit code.')
-    elif repair_ec > 1:
-        printe(_subsubstep('Repository integrity repair returned error-level exit code.', C_RED))
-        logging.critical('Repository integrity repair returned error-level exit code.')
-        sys.exit(EC)
+        except Exception as e:
+            printe(_subsubstep('Unable to repair repository - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to repair repository - ' + str(e) + '.')
+            sys.exit(EC)
+        logging.debug('REPAIR EXIT CODE: ' + str(repair_ec))
+        if repair_ec == 1:
+            printe(_subsubstep('Warning: Repository integrity repair returned warning-level exit code.', C_ORANGE))
+            logging.warning('Repository integrity repair returned warning-level exit code.')
+        elif repair_ec > 1:
+            printe(_subsubstep('Repository integrity repair returned error-level exit code.', C_RED))
+            logging.critical('Repository integrity repair returned error-level exit code.')
+            sys.exit(EC)
     logging.info('Process complete.')
     sys.exit(0)
     
@@ -857,13 +3700,16 @@ def handle_restore():
 
     Note that this function will call "sys.exit()" on its own.
     '''
+    if not args.restore_to: args.restore_to = os.getcwd()
     if 'dst_srv' in target:
         print(_step('Restoring from remote archive...'))
         logging.info('Restoring from remote archive...')
     else:
         print(_step('Restoring from local archive...'))
         logging.info('Restoring from local archive...')
+    _phase('prepare')
     prepare_execution()
+    _phase('restore')
     print(_substep('Preparing restoration...'))
     logging.debug('Preparing restoration...')
     if ':' in args.restore:
@@ -887,26 +3733,45 @@ def handle_restore():
         printe(_subsubstep('Specified restoration destination is an existing file...', C_RED))
         logging.critical('Specified restoration destination is an existing file...')
         sys.exit(6)
+    restore_shards = list(range(len(shard_repos)))
+    if len(shard_repos) > 1 and restore_path:
+        assignment = _load_state(os.path.join('shards', args.target + '.json'), {})
+        matching = set()
+        for (p, info) in assignment.get('paths', {}).items():
+            p = p.lstrip('/')
+            if p == restore_path or p.startswith(restore_path.rstrip('/') + '/') or restore_path.startswith(p.rstrip('/') + '/'):
+                matching.add(info['shard'])
+        if matching: restore_shards = sorted(matching)
+        logging.debug('Restore Shards: ' + ', '.join([str(i) for i in restore_shards]))
+    borg_cmds = []
     if args.restore_to.endswith('.tar.gz') or args.restore_to.endswith('.tar.bz2') or args.restore_to.endswith('.tar.xz'):
-        borg_cmd = '{borg} {common_args} export-tar {extra_args} {repo_str}::{archive} {restore_to}'.format(
-            borg = args.borg_executable,
-            common_args = common_args,
-            extra_args = extra_args,
-            repo_str = repo_str,
-            archive = restore_archive,
+        for shard in restore_shards:
             restore_to = args.restore_to
-        )
-        if restore_path: borg_cmd += ' ' + restore_path
+            if len(restore_shards) > 1:
+                (restore_base, restore_ext) = restore_to.rsplit('.tar.', 1)
+                restore_to = restore_base + '.' + str(shard) + '.tar.' + restore_ext
+            borg_cmd = '{borg} {common_args} export-tar {extra_args} {repo_str}::{archive} {restore_to}'.format(
+                borg = args.borg_executable,
+                common_args = common_args,
+                extra_args = extra_args,
+                repo_str = shard_repos[shard],
+                archive = restore_archive,
+                restore_to = restore_to
+            )
+            if restore_path: borg_cmd += ' ' + restore_path
+            borg_cmds.append(borg_cmd)
         cwd = ''
     else:
-        borg_cmd = '{borg} {common_args} extract {extra_args} {repo_str}::{archive}'.format(
-            borg = args.borg_executable,
-            common_args = common_args,
-            extra_args = extra_args,
-            repo_str = repo_str,
-            archive = restore_archive
-        )
-        if restore_path: borg_cmd += ' ' + restore_path
+        for shard in restore_shards:
+            borg_cmd = '{borg} {common_args} extract {extra_args} {repo_str}::{archive}'.format(
+                borg = args.borg_executable,
+                common_args = common_args,
+                extra_args = extra_args,
+                repo_str = shard_repos[shard],
+                archive = restore_archive
+            )
+            if restore_path: borg_cmd += ' ' + restore_path
+            borg_cmds.append(borg_cmd)
         cwd = os.getcwd()
         logging.debug('Switching working directories...')
         try:
@@ -917,20 +3782,13 @@ def handle_restore():
             printe(_subsubstep('Unable to prepare restoration - unable to switch working directories - ' + str(e) + '.', C_RED))
             logging.critical('Unable to prepare restoration - unable to switch working directories - ' + str(e) + '.')
             sys.exit(6)
-    logging.debug('RESTORATION COMMAND: ' + borg_cmd)
+    for borg_cmd in borg_cmds:
+        logging.debug('RESTORATION COMMAND: ' + borg_cmd)
     logging.info('Restoring files...')
     print(_substep('Restoring files...'))
     try:
-        restore_process = subprocess.Popen(
-            borg_cmd,
-            stdout = subprocess.PIPE,
-            stderr = subprocess.STDOUT,
-            shell = True
-        )
-        for line in iter(restore_process.stdout.readline, ''):
-            logging.info('RESTORE OUTPUT: ' + line.rstrip())
-        while restore_process.poll() is None: time.sleep(0.5)
-        restore_exit_code = restore_process.returncode
+        (restore_output, restore_exit_codes) = _stream_processes(borg_cmds, 'RESTORE')
+        restore_exit_code = max(restore_exit_codes)
         logging.debug('RESTORE EXIT CODE: ' + str(restore_exit_code))
     except Exception as e:
         printe(_subsubstep('Unable to restore files - ' + str(e) + '.', C_RED))
@@ -957,6 +3815,91 @@ def handle_restore():
     sys.exit(0)
 
 
+def handle_targets():
+    '''
+    Handles the "--targets", "--group", and "--all-targets" flags by executing
+    each selected target within its own worker process, bounded by "--jobs" and
+    "--server-jobs". A target is started as soon as all of its dependencies
+    (among the selected targets) have succeeded, and is skipped if any of them
+    did not.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    if args.dry_run:
+        print(_step('Executing ' + str(len(selected_targets)) + ' targets (DRY RUN)...'))
+        logging.info('Executing ' + str(len(selected_targets)) + ' targets (DRY RUN)...')
+    else:
+        print(_step('Executing ' + str(len(selected_targets)) + ' targets...'))
+        logging.info('Executing ' + str(len(selected_targets)) + ' targets...')
+    global worker_results
+    worker_results = []
+    pending = list(selected_targets)
+    running = {}
+    results = {}
+    def waiting_for(server, name):
+        return len([p for p in pending if p != name and _target_server(p) == server and not [d for d in _target_list(config['targets'][p].get('depends_on')) if d in selected_targets and results.get(d, {}).get('exit_code') != 0]])
+    while pending or running:
+        for name in list(pending):
+            dependencies = [d for d in _target_list(config['targets'][name].get('depends_on')) if d in selected_targets]
+            failed = [d for d in dependencies if d in results and results[d]['exit_code'] != 0]
+            if failed:
+                pending.remove(name)
+                results[name] = {'exit_code': None, 'duration': 0, 'failed_dependency': failed[0]}
+                printe(_subsubstep('Skipping ' + name + ' - dependency "' + failed[0] + '" did not succeed.', C_ORANGE))
+                logging.warning('Skipping ' + name + ' - dependency "' + failed[0] + '" did not succeed.')
+                continue
+            if [d for d in dependencies if not d in results]: continue
+            server = _target_server(name)
+            if not _worker_slot_available(server, running): continue
+            pending.remove(name)
+            if not _start_worker(name, running, _rate_share(server, running, waiting_for(server, name))):
+                results[name] = {'exit_code': 4, 'duration': 0}
+        if not running: continue
+        _rebalance_shares(running)
+        finished = _wait_worker()
+        if finished is None: continue
+        (name, exit_code) = finished
+        results[name] = {
+            'exit_code': exit_code,
+            'duration': time.time() - running[name]['start']
+        }
+        del running[name]
+        _release_share(name)
+        logging.info('Finished ' + name + ' with exit code ' + str(exit_code) + '.')
+    print(_step('Summary'))
+    logging.info('Summary:')
+    summary = ''
+    for name in selected_targets:
+        if results[name]['exit_code'] is None:
+            line = name + ': skipped (dependency "' + results[name]['failed_dependency'] + '" did not succeed)'
+            color = C_ORANGE
+        else:
+            if results[name]['exit_code'] == 0:
+                status = 'succeeded'
+                color = C_GREEN
+            else:
+                status = 'failed'
+                color = C_RED
+            line = '{name}: {status} (exit code {ec}) in {duration}'.format(
+                name = name,
+                status = status,
+                ec = results[name]['exit_code'],
+                duration = datetime.timedelta(seconds=int(results[name]['duration']))
+            )
+        print(_substep(line, color))
+        logging.info(line)
+        summary += line + '\n'
+    failures = [n for n in selected_targets if results[n]['exit_code'] != 0]
+    send_email(
+        'Executed ' + str(len(selected_targets)) + ' targets (' + str(len(failures)) + ' failed)',
+        'The backuputil script reports that it has finished executing the following targets:\n\n' + summary,
+        'info'
+    )
+    logging.info('Process complete.')
+    if failures: sys.exit(11)
+    sys.exit(0)
+
+
 def handle_unlock():
     '''
     Handles the "--unlock" flag.
@@ -970,43 +3913,49 @@ def handle_unlock():
     else:
         print(_step('Unlocking local repository...'))
         logging.info('Unlocking local repository...')
+    _phase('prepare')
     prepare_execution()
+    _phase('unlock')
     if args.log_level == 'debug':
         common_options = '--debug'
     else:
         common_options = '--info'
-    print(_substep('Unlocking repository...'))
-    logging.debug('Unlocking repository...')
-    try:
-        (unlock_out, unlock_ec) = _run_process(
-            '{borg} {common_options} break-lock {repo}'.format(
-                borg = args.borg_executable,
-                common_options = common_options,
-                repo = repo_str
+    for (shard, shard_repo) in enumerate(shard_repos):
+        if len(shard_repos) > 1:
+            print(_step('Shard ' + str(shard) + ' (' + shard_repo + ')'))
+            logging.info('Shard ' + str(shard) + ' (' + shard_repo + ')')
+        print(_substep('Unlocking repository...'))
+        logging.debug('Unlocking repository...')
+        try:
+            (unlock_out, unlock_ec) = _run_process(
+                '{borg} {common_options} break-lock {repo}'.format(
+                    borg = args.borg_executable,
+                    common_options = common_options,
+                    repo = shard_repo
+                )
             )
-        )
-    except Exception as e:
-        printe(_subsubstep('Unable to unlock repository - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to unlock repository - ' + str(e) + '.')
-        sys.exit(EC)
-    logging.debug('UNLOCK EXIT CODE: ' + str(unlock_ec))
-    if unlock_ec == 1:
-        for l in unlock_out:
-            logging.warning('UNLOCK OUTPUT: ' + l)
-            printe(_subsubstep(l))
-        printe(_subsubstep('Warning: Repository unlock returned warning-level exit code.', C_ORANGE))
-        logging.warning('Repository unlock returned warning-level exit code.')
-    elif unlock_ec > 1:
-        for l in unlock_out:
-            logging.critical('UNLOCK OUTPUT: ' + l)
-            printe(_subsubstep(l))
-        printe(_subsubstep('Repository unlock returned error-level exit code.', C_RED))
-        logging.critical('Repository unlock returned error-level exit code.')
-        sys.exit(EC)
-    else:
-        for l in unlock_out:
-            logging.info('UNLOCK OUTPUT: ' + l)
-            print(_subsubstep(l))
+        except Exception as e:
+            printe(_subsubstep('Unable to unlock repository - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to unlock repository - ' + str(e) + '.')
+            sys.exit(EC)
+        logging.debug('UNLOCK EXIT CODE: ' + str(unlock_ec))
+        if unlock_ec == 1:
+            for l in unlock_out:
+                logging.warning('UNLOCK OUTPUT: ' + l)
+                printe(_subsubstep(l))
+            printe(_subsubstep('Warning: Repository unlock returned warning-level exit code.', C_ORANGE))
+            logging.warning('Repository unlock returned warning-level exit code.')
+        elif unlock_ec > 1:
+            for l in unlock_out:
+                logging.critical('UNLOCK OUTPUT: ' + l)
+                printe(_subsubstep(l))
+            printe(_subsubstep('Repository unlock returned error-level exit code.', C_RED))
+            logging.critical('Repository unlock returned error-level exit code.')
+            sys.exit(EC)
+        else:
+            for l in unlock_out:
+                logging.info('UNLOCK OUTPUT: ' + l)
+                print(_subsubstep(l))
     logging.info('Process complete.')
     sys.exit(0)
 
@@ -1023,86 +3972,201 @@ def handle_verify_integrity():
     else:
         print(_step('Verifying local repository integrity...'))
         logging.info('Verifying local repository integrity...')
-    prepare_execution()
+    _phase('prepare')
+    prepare_execution(lock=True)
+    _phase('verify_integrity')
     if args.log_level == 'debug':
         common_options = '--debug'
     else:
         common_options = '--info'
     logging.debug('Setting subprocess environment variables...')
-    print(_substep('Verifying repository integrity...'))
-    logging.debug('Verifying repository integrity...')
-    try:
-        (repo_out, repo_ec) = _run_process(
-            '{borg} {common_options} check --repository-only {repo}'.format(
-                borg = args.borg_executable,
-                common_options = common_options,
-                repo = repo_str
-            )
-        )
-    except Exception as e:
-        printe(_subsubstep('Unable to verify repository integrity - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to verify repository integrity - ' + str(e) + '.')
-        sys.exit(7)
-    logging.debug('VERIFY REPO EXIT CODE: ' + str(repo_ec))
-    if repo_ec == 1:
-        if repo_out:
-            for l in repo_out:
-                logging.warning('VERIFY REPO OUTPUT: ' + l)
-                printe(_subsubstep(l))
-        printe(_subsubstep('Warning: Repository integrity check returned warning-level exit code.', C_ORANGE))
-        logging.warning('Repository integrity check returned warning-level exit code.')
-    elif repo_ec > 1:
-        if repo_out:
-            for l in repo_out:
-                logging.critical('VERIFY REPO OUTPUT: ' + l)
-                printe(_subsubstep(l))
-        printe(_subsubstep('Repository integrity check returned error-level exit code.', C_RED))
-        logging.critical('Repository integrity check returned error-level exit code.')
-        sys.exit(7)
-    else:
-        if repo_out:
-            for l in repo_out:
+    for (shard, shard_repo) in enumerate(shard_repos):
+        if len(shard_repos) > 1:
+            print(_step('Shard ' + str(shard) + ' (' + shard_repo + ')'))
+            logging.info('Shard ' + str(shard) + ' (' + shard_repo + ')')
+        print(_substep('Verifying repository integrity...'))
+        logging.debug('Verifying repository integrity...')
+        repo_status = {}
+        try:
+            for l in _process_lines(
+                '{borg} {common_options} check --repository-only {repo}'.format(
+                    borg = args.borg_executable,
+                    common_options = common_options,
+                    repo = shard_repo
+                ),
+                repo_status
+            ):
                 logging.info('VERIFY REPO OUTPUT: ' + l)
                 print(_subsubstep(l))
-    print(_substep('Verifying archive integrity...'))
-    logging.debug('Verifying archive integrity...')
-    try:
-        (arch_out, arch_ec) = _run_process(
-            '{borg} {common_options} check --archives-only {repo}'.format(
-                borg = args.borg_executable,
-                common_options = common_options,
-                repo = repo_str
-            )
-        )
-    except Exception as e:
-        printe(_subsubstep('Unable to verify archive integrity - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to verify archive integrity - ' + str(e) + '.')
-        sys.exit(7)
-    logging.debug('VERIFY ARCHIVE EXIT CODE: ' + str(arch_ec))
-    if arch_ec == 1:
-        if arch_out:
-            for l in arch_out:
-                logging.warning('VERIFY ARCHIVE OUTPUT: ' + l)
-                printe(_subsubstep(l))
-        printe(_subsubstep('Warning: Archive integrity check returned warning-level exit code.', C_ORANGE))
-        logging.warning('Archive integrity check returned warning-level exit code.')
-    elif arch_ec > 1:
-        if arch_out:
-            for l in arch_out:
-                logging.critical('VERIFY ARCHIVE OUTPUT: ' + l)
-                printe(_subsubstep(l))
-        printe(_subsubstep('Archive integrity check returned error-level exit code.', C_RED))
-        logging.critical('Archive integrity check returned error-level exit code.')
-        sys.exit(7)
-    else:
-        if arch_out:
-            for l in arch_out:
+            repo_ec = repo_status['exit_code']
+        except Exception as e:
+            printe(_subsubstep('Unable to verify repository integrity - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to verify repository integrity - ' + str(e) + '.')
+            sys.exit(7)
+        logging.debug('VERIFY REPO EXIT CODE: ' + str(repo_ec))
+        if repo_ec == 1:
+            printe(_subsubstep('Warning: Repository integrity check returned warning-level exit code.', C_ORANGE))
+            logging.warning('Repository integrity check returned warning-level exit code.')
+        elif repo_ec > 1:
+            printe(_subsubstep('Repository integrity check returned error-level exit code.', C_RED))
+            logging.critical('Repository integrity check returned error-level exit code.')
+            sys.exit(7)
+        print(_substep('Verifying archive integrity...'))
+        logging.debug('Verifying archive integrity...')
+        arch_status = {}
+        try:
+            for l in _process_lines(
+                '{borg} {common_options} check --archives-only {repo}'.format(
+                    borg = args.borg_executable,
+                    common_options = common_options,
+                    repo = shard_repo
+                ),
+                arch_status
+            ):
                 logging.info('VERIFY ARCHIVE OUTPUT: ' + l)
                 print(_subsubstep(l))
+            arch_ec = arch_status['exit_code']
+        except Exception as e:
+            printe(_subsubstep('Unable to verify archive integrity - ' + str(e) + '.', C_RED))
+            logging.critical('Unable to verify archive integrity - ' + str(e) + '.')
+            sys.exit(7)
+        logging.debug('VERIFY ARCHIVE EXIT CODE: ' + str(arch_ec))
+        if arch_ec == 1:
+            printe(_subsubstep('Warning: Archive integrity check returned warning-level exit code.', C_ORANGE))
+            logging.warning('Archive integrity check returned warning-level exit code.')
+        elif arch_ec > 1:
+            printe(_subsubstep('Archive integrity check returned error-level exit code.', C_RED))
+            logging.critical('Archive integrity check returned error-level exit code.')
+            sys.exit(7)
     logging.info('Process complete.')
     sys.exit(0)
     
 
+def handle_watch():
+    '''
+    Handles the "--watch" flag by running as a long-lived process that watches
+    the source paths of the target via inotify, keeping a journal of the
+    directories in which changes occur under the state directory. SIGTERM stops
+    the watcher, and SIGUSR1 makes it sync the journal to disk.
+
+    Note that this function will call "sys.exit()" on its own.
+    '''
+    print(_step('Watching ' + args.target + '...'))
+    logging.info('Watching ' + args.target + '...')
+    prepare_execution()
+    print(_substep('Adding watches...'))
+    logging.info('Adding watches...')
+    global inotify_libc
+    global inotify_fd
+    global inotify_watches
+    inotify_watches = {}
+    try:
+        inotify_libc = ctypes.CDLL(ctypes_util.find_library('c') or 'libc.so.6', use_errno=True)
+        inotify_fd = inotify_libc.inotify_init1(IN_CLOEXEC)
+        if inotify_fd < 0: raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        complete = True
+        for p in src_paths:
+            if not _inotify_watch(p): complete = False
+    except Exception as e:
+        printe(_subsubstep('Unable to watch source paths - ' + str(e) + '.', C_RED))
+        logging.critical('Unable to watch source paths - ' + str(e) + '.')
+        send_email(
+            'Unable to watch source paths',
+            emails.WATCH_EXCEPTION,
+            'error'
+        )
+        sys.exit(12)
+    journal_path = os.path.join('journal', args.target + '.json')
+    journal = {
+        'pid': os.getpid(),
+        'sources': src_paths,
+        'exclude': exclude_paths,
+        'started': time.time(),
+        'heartbeat': None,
+        'invalid_at': None,
+        'dirty': {}
+    }
+    if not complete:
+        printe(_subsubstep('Warning: Unable to watch some directories - backups will scan the source paths until the watcher is restarted.', C_ORANGE))
+        logging.warning('Unable to watch some directories - backups will scan the source paths until the watcher is restarted.')
+        journal['invalid_at'] = journal['started']
+    print(_subsubstep('Watching ' + str(len(inotify_watches)) + ' directories.'))
+    logging.info('Watching ' + str(len(inotify_watches)) + ' directories.')
+    global watch_signal
+    watch_signal = None
+    def on_signal(signum, frame):
+        global watch_signal
+        if watch_signal != signal.SIGTERM: watch_signal = signum
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGUSR1, on_signal)
+    next_flush = 0
+    while True:
+        if watch_signal == signal.SIGTERM: break
+        try:
+            (ready, w, x) = select.select([inotify_fd], [], [], 0 if watch_signal else 1)
+        except (select.error, IOError, OSError) as e:
+            if e.args[0] != errno.EINTR: raise
+            ready = []
+        now = time.time()
+        if ready:
+            for (wd, mask, name) in _inotify_events():
+                if mask & IN_Q_OVERFLOW:
+                    logging.warning('Event queue overflowed - the next backup will scan the source paths.')
+                    journal['invalid_at'] = now
+                    continue
+                if not wd in inotify_watches: continue
+                p = inotify_watches[wd]
+                if mask & IN_IGNORED:
+                    del inotify_watches[wd]
+                    if p in src_paths:
+                        logging.warning('Source path "' + p + '" was removed or replaced - backups will scan the source paths until the watcher is restarted.')
+                        journal['invalid_at'] = float('inf')
+                    continue
+                journal['dirty'][p] = now
+                if not mask & IN_ISDIR or not name: continue
+                c = os.path.join(p, name)
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    journal['dirty'][c] = now
+                    if not _inotify_watch(c): journal['invalid_at'] = now
+                elif mask & IN_MOVED_FROM:
+                    for (w, q) in list(inotify_watches.items()):
+                        if q == c or q.startswith(c + '/'):
+                            inotify_libc.inotify_rm_watch(inotify_fd, w)
+                            del inotify_watches[w]
+        if (watch_signal == signal.SIGUSR1 and not ready) or now >= next_flush:
+            watch_signal = None
+            baseline = _load_state(os.path.join('targets', args.target + '.json'), {}).get('last_archive_start')
+            if baseline: journal['dirty'] = dict([(d, t) for (d, t) in journal['dirty'].items() if t >= baseline])
+            journal['heartbeat'] = time.time()
+            try:
+                _save_state(journal_path, journal)
+            except Exception as e:
+                logging.warning('Unable to write change journal - ' + str(e) + '.')
+            next_flush = time.time() + WATCH_FLUSH_INTERVAL
+    journal['pid'] = None
+    try:
+        _save_state(journal_path, journal)
+    except Exception as e:
+        logging.warning('Unable to write change journal - ' + str(e) + '.')
+    logging.info('Watcher stopped.')
+    sys.exit(0)
+
+
+def index_sources():
+    '''
+    Returns a compact index of the current state of the source paths of the
+    target (minus any excluded paths), being a dictionary mapping each source
+    path to a digest of the path, size, modification time, status change time,
+    and inode number of everything beneath it.
+    '''
+    index = {}
+    for p in src_paths:
+        digest = hashlib.sha1()
+        _digest_tree(p, digest)
+        index[p] = digest.hexdigest()
+    return index
+
+
 def main():
     '''
     The entrypoint of the script.
@@ -1114,9 +4178,65 @@ def main():
     if args.list_targets: handle_list_targets()
 
     # Verify some command-line arguments
+    if len([o for o in [args.target, args.targets, args.group, args.all_targets, args.daemon, args.check_config, args.deliver_mail] if o]) != 1:
+        printe(_c('Invalid option combination: exactly one of "TARGET", "--targets", "--group", "--all-targets", "--daemon", "--check-config", or "--deliver-mail" must be specified.', C_RED))
+        sys.exit(1)
+    if args.jobs < 0 or args.server_jobs < 0:
+        printe(_c('Invalid option value: "--jobs" and "--server-jobs" must not be negative.', C_RED))
+        sys.exit(1)
+    if args.bench_target and not args.target:
+        printe(_c('Invalid option combination: "--bench-target" requires a single "TARGET".', C_RED))
+        sys.exit(1)
+    if not args.target and [o for o in [args.info, args.list_archives, args.repair, args.restore, args.unlock, args.verify_integrity] if o]:
+        printe(_c('Invalid option combination: "--info", "--list-archives", "--repair", "--restore", "--unlock", and "--verify-integrity" require a single "TARGET".', C_RED))
+        sys.exit(1)
+    if not 0 < args.bench_sample <= 1:
+        printe(_c('Invalid option value: "--bench-sample" must be greater than 0 and at most 1.', C_RED))
+        sys.exit(1)
+    if args.probe_servers and not args.check_config:
+        printe(_c('Invalid option combination: "--probe-servers" requires "--check-config".', C_RED))
+        sys.exit(1)
+    if args.compression_ttl < 0:
+        printe(_c('Invalid option value: "--compression-ttl" must not be negative.', C_RED))
+        sys.exit(1)
+    if args.checkpoint_interval != 'auto':
+        if not args.checkpoint_interval.isdigit():
+            printe(_c('Invalid option value: "--checkpoint-int" must be a non-negative integer or "auto".', C_RED))
+            sys.exit(1)
+        args.checkpoint_interval = int(args.checkpoint_interval)
+    if args.history and not args.target:
+        printe(_c('Invalid option combination: "--history" requires a single "TARGET".', C_RED))
+        sys.exit(1)
+    if args.output == 'json' and not args.target:
+        printe(_c('Invalid option combination: "--output json" requires a single "TARGET".', C_RED))
+        sys.exit(1)
+    if args.output_lines < 0:
+        printe(_c('Invalid option value: "--output-lines" must not be negative.', C_RED))
+        sys.exit(1)
+    if args.ssh_persist < 0:
+        printe(_c('Invalid option value: "--ssh-persist" must not be negative.', C_RED))
+        sys.exit(1)
+    if args.watch and not args.target:
+        printe(_c('Invalid option combination: "--watch" requires a single "TARGET".', C_RED))
+        sys.exit(1)
+    if args.verify_ttl < 0:
+        printe(_c('Invalid option value: "--verify-ttl" must not be negative.', C_RED))
+        sys.exit(1)
+    if args.email_digest < 0:
+        printe(_c('Invalid option value: "--email-digest" must not be negative.', C_RED))
+        sys.exit(1)
+    if not re.match(r'^((error|warning|info)=\d+(,|$))*$', args.email_thresholds):
+        printe(_c('Invalid option value: "--email-thresholds" must be a comma-separated list of "LEVEL=COUNT" thresholds.', C_RED))
+        sys.exit(1)
     if args.email_level != 'never' and not args.email_to:
         printe(_c('Invalid option combination: "--email-to" not specified.', C_RED))
         sys.exit(1)
+
+    # Reserve stdout for the run report when "--output json" is specified
+    if args.output == 'json':
+        global report_stdout
+        report_stdout = sys.stdout
+        sys.stdout = sys.stderr
     
     # Setup logging
     _setup_logging()
@@ -1128,6 +4248,12 @@ def main():
         logging.debug(a + ' : ' + str(dargs[a]))
     logging.debug('-------------------------')
 
+    # Handle --deliver-mail
+    if args.deliver_mail: handle_deliver_mail()
+
+    # Handle --history
+    if args.history: handle_history()
+
     # Get the hostname of the machine
     get_hostname()
 
@@ -1137,6 +4263,21 @@ def main():
     # Parse the YAML configuration file
     parse_yaml_config()
 
+    # Handle --check-config
+    if args.check_config: handle_check_config()
+
+    # Handle --daemon
+    if args.daemon: handle_daemon()
+
+    # Handle --targets, --group, and --all-targets
+    if not args.target: handle_targets()
+
+    # Handle --bench-target
+    if args.bench_target: handle_bench_target()
+
+    # Handle --watch
+    if args.watch: handle_watch()
+
     # Handle --unlock
     if args.unlock: handle_unlock()
 
@@ -1158,9 +4299,23 @@ def main():
     # Handle the backup process
     handle_backup()
 
+    # Record the successful run
+    if not args.dry_run:
+        try:
+            state = _load_state(os.path.join('targets', args.target + '.json'), {})
+            state['last_success'] = time.time()
+            if not backup_skipped:
+                state['last_archive'] = archive_str
+                state['last_archive_start'] = archive_started
+            _save_state(os.path.join('targets', args.target + '.json'), state)
+        except Exception as e:
+            logging.warning('Unable to record successful run - ' + str(e) + '.')
+
     # We are done
     logging.info('Process complete.')
     email_body = 'The backuputil script reports that it has successfully finished executing the "' + args.target + '" target.'
+    if backup_skipped:
+        email_body += ' No new archive was created since its source paths are unchanged since the last successful archive.'
     if args.log_level == 'debug':
         email_body += '\n\nThe output of the underlying process has been suppressed from this email since the script was executed at a "debug" log level.'
         email_body += ' Please check the configured log file on the executing machine for the full output.'
@@ -1190,9 +4345,24 @@ def parse_yaml_config():
     logging.info('Loading configuration file...')
     print(_substep('Reading configuration file...'))
     logging.debug('Reading configuration file...')
+    global config
+    cache = None
     try:
-        with open(args.config_file, 'r') as f:
-            config_raw = f.read()
+        if os.getenv('BACKUPUTIL_WORKER_SPEC'):
+            logging.debug('Using target specification provided by parent process...')
+            config_raws = [('', os.getenv('BACKUPUTIL_WORKER_SPEC'))]
+        else:
+            stamp = _config_stamp()
+            cache = _read_config_cache()
+            if cache:
+                logging.debug('Using compiled configuration cache "' + _config_cache_path() + '"...')
+                config = dict(cache[0]['base'])
+                config['targets'] = cache[1]
+            else:
+                config_raws = []
+                for path in _config_files():
+                    with open(path, 'r') as f:
+                        config_raws.append((path, f.read()))
     except Exception as e:
         printe(_subsubstep('Unable to read configuration file - ' + str(e) + '.', C_RED))
         logging.critical('Unable to read configuration file - ' + str(e) + '.')
@@ -1205,7 +4375,9 @@ def parse_yaml_config():
     print(_substep('Parsing configuration file...'))
     logging.debug('Parsing configuration file...')
     try:
-        config = yaml.safe_load(config_raw)
+        if not cache:
+            documents = [(path, _yaml_load(raw)) for (path, raw) in config_raws]
+            config = documents[0][1] or {}
     except Exception as e:
         printe(_subsubstep('Unable to parse configuration file - ' + str(e) + '.', C_RED))
         logging.critical('Unable to parse configuration file - ' + str(e) + '.')
@@ -1217,6 +4389,8 @@ def parse_yaml_config():
         sys.exit(3)
     print(_substep('Validating base configuration...'))
     logging.debug('Validating base configuration...')
+    if not cache and len(documents) > 1 and not 'targets' in config:
+        config['targets'] = {}
     if not 'targets' in config:
         printe(_subsubstep('Invalid configuration - "targets" key not found.', C_RED))
         logging.critical('Invalid configuration - "targets" key not found.')
@@ -1235,227 +4409,159 @@ def parse_yaml_config():
             'error'
         )
         sys.exit(3)
-    print(_substep('Validating selected target...'))
-    logging.debug('Validating selected target...')
-    if not args.target in config['targets']:
-        printe(_subsubstep('Invalid target - the specified target is not defined in the specified configuration file.', C_RED))
-        logging.critical('Invalid target - the specified target is not defined in the specified configuration file.')
-        send_email(
-            'Invalid target',
-            emails.INVALID_TARGET,
-            'error'
-        )
-        sys.exit(3)
-    global target
-    target = config['targets'][args.target]
-    if not isinstance(target, dict):
-        printe(_subsubstep('Invalid target specification - value of target key not dictionary of target parameters.', C_RED))
-        logging.critical('Invalid target specification - value of target key not dictionary of target parameters.')
-        send_email(
-            'Invalid target specification',
-            emails.INVALID_TARGET_SPEC,
-            'error'
-        )
-        sys.exit(3)
-    logging.debug('Relevant Target Specification: ' + str(target))
-    if not 'src_path' in target or not 'dst_path' in target:
-        printe(_subsubstep('Invalid target specification - target does not specify a value for "src_path" or "dst_path".', C_RED))
-        logging.critical('Invalid target specification - target does not specify a value for "src_path" or "dst_path".')
-        send_email(
-            'Invalid target specification',
-            emails.INVALID_TARGET_SPEC,
-            'error'
-        )
-        sys.exit(3)
-    if not isinstance(target['dst_path'], str):
-        printe(_subsubstep('Invalid target specification - destination path is not a path string.', C_RED))
-        logging.critical('Invalid target specification - destination path is not a path string.')
-        send_email(
-            'Invalid target specification',
-            emails.INVALID_TARGET_SPEC,
-            'error'
-        )
-        sys.exit(3)
-    if isinstance(target['src_path'], str):
-        if '*' in target['src_path']:
-            src_paths = glob.glob(os.path.expanduser(os.path.expandvars(target['src_path'])))
-            if not src_paths:
-                printe(_subsubstep('Invalid target specification - specified source path wildcard does not resolve to existing paths on the local filesystem.', C_RED))
-                logging.critical('Invalid target specification - specified source path wildcard does not resolve to existing paths on the local filesystem.')
-                send_email(
-                    'Invalid target specification',
-                    emails.INVALID_TARGET_SPEC,
-                    'error'
-                )
-                sys.exit(3)
-        else:
-            if not os.path.exists(os.path.expanduser(os.path.expandvars(target['src_path']))):
-                printe(_subsubstep('Invalid target specification - specified source path does not exist on the local filesystem.', C_RED))
-                logging.critical('Invalid target specification - specified source path does not exist on the local filesystem.')
-                send_email(
-                    'Invalid target specification',
-                    emails.INVALID_TARGET_SPEC,
-                    'error'
-                )
-                sys.exit(3)
-    elif isinstance(target['src_path'], list):
-        for p in target['src_path']:
-            if not isinstance(p, str):
-                printe(_subsubstep('Invalid target specification - one or more specified source paths is not a path string.', C_RED))
-                logging.critical('Invalid target specification - one or more specified source paths is not a path string.')
+    if not cache:
+        for (path, document) in documents[1:]:
+            if not isinstance(document, dict) or list(document) != ['targets'] or not isinstance(document['targets'], dict):
+                printe(_subsubstep('Invalid configuration - "' + path + '" does not solely consist of a dictionary of target specifications under the "targets" key.', C_RED))
+                logging.critical('Invalid configuration - "' + path + '" does not solely consist of a dictionary of target specifications under the "targets" key.')
                 send_email(
-                    'Invalid target specification',
-                    emails.INVALID_TARGET_SPEC,
+                    'Invalid configuration',
+                    emails.INVALID_CONF,
                     'error'
                 )
                 sys.exit(3)
-            if '*' in p:
-                p_paths = glob.glob(os.path.expanduser(os.path.expandvars(p)))
-                if not p_paths:
-                    printe(_subsubstep('Invalid target specification - specified source path wildcard does not resolve to existing paths on the local filesystem.', C_RED))
-                    logging.critical('Invalid target specification - specified source path wildcard does not resolve to existing paths on the local filesystem.')
+            for (t, spec) in document['targets'].items():
+                if t in config['targets']:
+                    printe(_subsubstep('Invalid configuration - target "' + t + '" of "' + path + '" is already defined.', C_RED))
+                    logging.critical('Invalid configuration - target "' + t + '" of "' + path + '" is already defined.')
+                    send_email(
+                        'Invalid configuration',
+                        emails.INVALID_CONF,
+                        'error'
+                    )
+                    sys.exit(3)
+                config['targets'][t] = spec
+    if 'server_limits' in config:
+        if not isinstance(config['server_limits'], dict) or [l for l in config['server_limits'].values() if isinstance(l, bool) or not isinstance(l, int) or l < 1]:
+            printe(_subsubstep('Invalid configuration - value of "server_limits" key not dictionary of positive integer rate limits.', C_RED))
+            logging.critical('Invalid configuration - value of "server_limits" key not dictionary of positive integer rate limits.')
+            send_email(
+                'Invalid configuration',
+                emails.INVALID_CONF,
+                'error'
+            )
+            sys.exit(3)
+    if not os.getenv('BACKUPUTIL_WORKER_SPEC') and not cache:
+        print(_substep('Validating target dependencies...'))
+        logging.debug('Validating target dependencies...')
+        for (t, spec) in config['targets'].items():
+            if not isinstance(spec, dict): continue
+            for key in ['depends_on', 'group']:
+                if key in spec and (not isinstance(spec[key], (str, list)) or [v for v in _target_list(spec[key]) if not isinstance(v, str)]):
+                    printe(_subsubstep('Invalid target specification - "' + key + '" specification of "' + t + '" not a string or list of strings.', C_RED))
+                    logging.critical('Invalid target specification - "' + key + '" specification of "' + t + '" not a string or list of strings.')
                     send_email(
                         'Invalid target specification',
                         emails.INVALID_TARGET_SPEC,
                         'error'
                     )
                     sys.exit(3)
-            else:
-                if not os.path.exists(os.path.expanduser(os.path.expandvars(p))):
-                    printe(_subsubstep('Invalid target specification - one or more specified source paths do not exist on the local filesystem.', C_RED))
-                    logging.critical('Invalid target specification - one or more specified source paths do not exist on the local filesystem.')
+            for d in _target_list(spec.get('depends_on')):
+                if not d in config['targets']:
+                    printe(_subsubstep('Invalid target specification - "' + t + '" depends on undefined target "' + d + '".', C_RED))
+                    logging.critical('Invalid target specification - "' + t + '" depends on undefined target "' + d + '".')
                     send_email(
                         'Invalid target specification',
                         emails.INVALID_TARGET_SPEC,
                         'error'
                     )
                     sys.exit(3)
-    else:
-        printe(_subsubstep('Invalid target specification - "src_path" does not correspond to a path string or list of path strings.', C_RED))
-        logging.critical('Invalid target specification - "src_path" does not correspond to a path string or list of path strings.')
-        send_email(
-            'Invalid target specification',
-            emails.INVALID_TARGET_SPEC,
-            'error'
-        )
-        sys.exit(3)
-    if 'keep' in target:
-        if not isinstance(target['keep'], dict):
-            printe(_subsubstep('Invalid target specification - "keep" specification not a dictionary of time slices.', C_RED))
-            logging.critical('Invalid target specification - "keep" specification not a dictionary of time slices.')
-            send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
-                'error'
-            )
-            sys.exit(3)
-        for slice_spec in target['keep']:
-            if slice_spec not in ['hourly', 'daily', 'weekly', 'monthly', 'yearly']:
-                printe(_subsubstep('Invalid target specification - "keep" specification contains one or more unknown time slices.', C_RED))
-                logging.critical('Invalid target specification - "keep" specification contains one or more unknown time slices.')
-                send_email(
-                    'Invalid target specification',
-                    emails.INVALID_TARGET_SPEC,
-                    'error'
-                )
-                sys.exit(3)
-    if 'exclude' in target:
-        if not isinstance(target['exclude'], list):
-            printe(_subsubstep('Invalid target specification - "exclude" specification not a list of paths.', C_RED))
-            logging.critical('Invalid target specification - "exclude" specification not a list of paths.')
-            send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
-                'error'
-            )
-            sys.exit(3)
-    if 'post_run' in target:
-        if not isinstance(target['post_run'], str): 
-            printe(_subsubstep('Invalid target specification - "post_run" specification not a command string.', C_RED))
-            logging.critical('Invalid target specification - "post_run" specification not a command string.')
-            send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
-                'error'
-            )
-            sys.exit(3)
-    if 'pre_run' in target:
-        if not isinstance(target['pre_run'], str): 
-            printe(_subsubstep('Invalid target specification - "pre_run" specification not a command string.', C_RED))
-            logging.critical('Invalid target specification - "pre_run" specification not a command string.')
-            send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
-                'error'
-            )
-            sys.exit(3)
-    if 'rate_limit' in target:
-        if not isinstance(target['rate_limit'], int):
-            printe(_subsubstep('Invalid target specification - "rate_limit" specification not a positive integer value.', C_RED))
-            logging.critical('Invalid target specification - "rate_limit" specification not a positive integer value.')
-            send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
-                'error'
-            )
-            sys.exit(3)
-        if target['rate_limit'] < 0:
-            printe(_subsubstep('Invalid target specification - "rate_limit" specification not a positive integer value.', C_RED))
-            logging.critical('Invalid target specification - "rate_limit" specification not a positive integer value.')
-            send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
-                'error'
-            )
-            sys.exit(3)
-    if 'dst_srv' in target:
-        if not 'cert_path' in target:
-            cert_path = args.cert_path
-        else:
-            cert_path = target['cert_path']
-        if not os.path.isfile(cert_path):
-            printe(_subsubstep('Invalid target specification - certificate file path does not correspond to an existing file.', C_RED))
-            logging.critical('Invalid target specification - certificate file path does not correspond to an existing file.')
+        cycle = _dependency_cycle(config['targets'])
+        if cycle:
+            printe(_subsubstep('Invalid configuration - circular target dependency (' + ' -> '.join(cycle) + ').', C_RED))
+            logging.critical('Invalid configuration - circular target dependency (' + ' -> '.join(cycle) + ').')
             send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
+                'Invalid configuration',
+                emails.INVALID_CONF,
                 'error'
             )
             sys.exit(3)
         try:
-            dst_srv_ip = socket.gethostbyname(target['dst_srv'])
+            _write_config_cache(stamp)
         except Exception as e:
-            printe(_subsubstep('Invalid target specification - unable to resolve hostname of destination server via DNS.', C_RED))
-            logging.critical('Invalid target specification - unable to resolve hostname of destination server via DNS.')
+            logging.warning('Unable to write compiled configuration cache - ' + str(e) + '.')
+    global selected_targets
+    if args.all_targets or args.check_config:
+        selected_targets = sorted(config['targets'])
+        if args.check_config: return
+    elif args.daemon:
+        selected_targets = sorted([t for t in config['targets'] if isinstance(config['targets'][t], dict) and 'rpo' in config['targets'][t]])
+    elif args.group:
+        groups = [g.strip() for g in args.group.split(',') if g.strip()]
+        selected_targets = sorted([t for t in config['targets'] if isinstance(config['targets'][t], dict) and [g for g in _target_list(config['targets'][t].get('group')) if g in groups]])
+        if not selected_targets:
+            printe(_subsubstep('Invalid group - no targets belong to the specified group.', C_RED))
+            logging.critical('Invalid group - no targets belong to the specified group.')
             send_email(
-                'Invalid target specification',
-                emails.INVALID_TARGET_SPEC,
+                'Invalid group',
+                emails.INVALID_TARGET,
                 'error'
             )
             sys.exit(3)
+    elif args.targets:
+        selected_targets = _target_names(args.targets)
+    else:
+        selected_targets = [args.target]
+    if not args.target:
+        print(_substep('Validating selected targets...'))
+        logging.debug('Validating selected targets...')
+        for t in selected_targets:
+            if not t in config['targets'] or not isinstance(config['targets'][t], dict):
+                printe(_subsubstep('Invalid target - "' + t + '" is not properly defined in the specified configuration file.', C_RED))
+                logging.critical('Invalid target - "' + t + '" is not properly defined in the specified configuration file.')
+                send_email(
+                    'Invalid target',
+                    emails.INVALID_TARGET,
+                    'error'
+                )
+                sys.exit(3)
+            if 'rpo' in config['targets'][t] and _parse_duration(config['targets'][t]['rpo']) is None:
+                printe(_subsubstep('Invalid target specification - "rpo" specification of "' + t + '" not a positive duration.', C_RED))
+                logging.critical('Invalid target specification - "rpo" specification of "' + t + '" not a positive duration.')
+                send_email(
+                    'Invalid target specification',
+                    emails.INVALID_TARGET_SPEC,
+                    'error'
+                )
+                sys.exit(3)
+        return
+    print(_substep('Validating selected target...'))
+    logging.debug('Validating selected target...')
+    if not args.target in config['targets']:
+        printe(_subsubstep('Invalid target - the specified target is not defined in the specified configuration file.', C_RED))
+        logging.critical('Invalid target - the specified target is not defined in the specified configuration file.')
+        send_email(
+            'Invalid target',
+            emails.INVALID_TARGET,
+            'error'
+        )
+        sys.exit(3)
+    global target
+    target = config['targets'][args.target]
+    logging.debug('Relevant Target Specification: ' + str(target))
+    problems = _target_problems(target)
+    if problems:
+        printe(_subsubstep('Invalid target specification - ' + problems[0] + '.', C_RED))
+        logging.critical('Invalid target specification - ' + problems[0] + '.')
+        send_email(
+            'Invalid target specification',
+            emails.INVALID_TARGET_SPEC,
+            'error'
+        )
+        sys.exit(3)
 
 
-def prepare_execution():
+def prepare_execution(lock=False):
     '''
-    Prepares the execution environment (by setting a bunch of global variables).
+    Prepares the execution environment (by setting a bunch of global variables),
+    optionally acquiring the lock on the resolved repository.
     '''
     logging.debug('Preparing execution environment...')
     global dst_path
     dst_path = os.path.expandvars(os.path.expanduser(target['dst_path'])) 
     logging.debug('Destination Path: ' + dst_path)
     global src_paths
-    if isinstance(target['src_path'], str):
-        if '*' in target['src_path']:
-            src_paths = glob.glob(os.path.expanduser(os.path.expandvars(target['src_path'])))
-        else:
-            src_paths = [os.path.expanduser(os.path.expandvars(target['src_path']))]
-    else:
-        src_paths = []
-        for p in target['src_path']:
-            if '*' in p:
-                src_paths.extend(glob.glob(os.path.expanduser(os.path.expandvars(p))))
-            else:
-                src_paths.append(os.path.expanduser(os.path.expandvars(p)))
+    src_paths = resolve_source_paths()
     logging.debug('Source Paths: ' + str(src_paths))
     global exclude_paths
     if 'exclude' in target:
@@ -1467,10 +4573,11 @@ def prepare_execution():
         exclude_paths = []
     logging.debug('Excluded Paths: ' + str(exclude_paths))
     global rate_limit
-    if 'rate_limit' in target:
-        rate_limit = str(target['rate_limit'])
+    if os.getenv('BACKUPUTIL_WORKER_RATE_SHARE'):
+        logging.info('Bandwidth share of destination server: ' + os.getenv('BACKUPUTIL_WORKER_RATE_SHARE') + ' KiB/s')
+        rate_limit = _shared_rate_limit(int(os.getenv('BACKUPUTIL_WORKER_RATE_SHARE')))
     else:
-        rate_limit = str(args.rate_limit)
+        rate_limit = _shared_rate_limit()
     logging.debug('Transfer Rate Limit: ' + rate_limit + ' KiB/s')
     global dst_srv
     if 'dst_srv' in target:
@@ -1498,7 +4605,7 @@ def prepare_execution():
     if 'user' in target:
         user = target['user']
     else:
-        user = args.user
+        user = args.user or getpass.getuser()
     logging.debug('Remote Connection User: ' + user)
     global keep
     if 'keep' in target:
@@ -1528,12 +4635,27 @@ def prepare_execution():
     else:
         repo_str = dst_path
     logging.debug('Repository Reference String: ' + repo_str)
+    global shard_repos
+    if target.get('shards', 1) > 1:
+        shard_repos = [repo_str + '.' + str(i) for i in range(target['shards'])]
+        logging.debug('Shard Repositories: ' + str(shard_repos))
+    else:
+        shard_repos = [repo_str]
     print(_substep('Instantiating subprocess environment...'))
     logging.debug('Instantiating subprocess environment...')
     try:
         os.environ['BORG_RSH'] = 'ssh -i {cert} -o StrictHostKeyChecking=no'.format(
-            cert=os.path.expanduser(os.path.expandvars(cert_path))
+            cert=os.path.abspath(os.path.expanduser(os.path.expandvars(cert_path)))
         )
+        if dst_srv and args.ssh_persist:
+            control_path = _ssh_control_path(user + '@' + dst_srv, os.environ['BORG_RSH'])
+            if control_path:
+                os.environ['BORG_RSH'] += ' -o ControlMaster=auto -o ControlPath={path} -o ControlPersist={persist}'.format(
+                    path = control_path,
+                    persist = args.ssh_persist
+                )
+            else:
+                logging.warning('Not sharing SSH connections - unable to place a control socket within the state directory.')
         logging.debug('BORG_RSH = ' + os.environ['BORG_RSH'])
         os.environ['BORG_PASSPHRASE'] = password
         logging.debug('BORG_PASSPHRASE = ' + os.environ['BORG_PASSPHRASE'])
@@ -1546,6 +4668,7 @@ def prepare_execution():
             'error'
         )
         sys.exit(3)
+    if lock: acquire_repository_lock()
 
 
 def printe(instring):
@@ -1555,6 +4678,92 @@ def printe(instring):
     sys.stderr.write(instring + '\n')
 
 
+def read_watch_journal():
+    '''
+    Returns the list of directories beneath the source paths of the target that
+    changed since the start of its last archive according to the journal of its
+    "--watch" process, or "None" if the journal can not be trusted (in which
+    case the source paths need to be scanned in full).
+    '''
+    journal_path = os.path.join('journal', args.target + '.json')
+    journal = _load_state(journal_path, {})
+    baseline = _load_state(os.path.join('targets', args.target + '.json'), {}).get('last_archive_start')
+    reason = ''
+    if journal.get('sources') != src_paths or journal.get('exclude') != exclude_paths:
+        reason = 'the watched paths differ from the source paths of the target'
+    elif not journal.get('pid') or not _pid_alive(journal['pid']):
+        reason = 'the watcher is not running'
+    elif baseline is None or journal['started'] > baseline:
+        reason = 'the journal does not go back to the start of the last archive'
+    if not reason:
+        requested = time.time()
+        try:
+            os.kill(journal['pid'], signal.SIGUSR1)
+            while journal.get('heartbeat') is None or journal['heartbeat'] < requested:
+                if time.time() - requested >= WATCH_SYNC_TIMEOUT:
+                    reason = 'the watcher did not sync its journal in time'
+                    break
+                time.sleep(0.1)
+                journal = _load_state(journal_path, {})
+        except Exception as e:
+            reason = str(e)
+    if not reason and journal.get('invalid_at') is not None and journal['invalid_at'] >= baseline:
+        reason = 'the watcher missed events since the start of the last archive'
+    if reason:
+        logging.info('Not using change journal - ' + reason + '.')
+        return None
+    return sorted([d for (d, t) in journal['dirty'].items() if t >= baseline])
+
+
+def record_run_history():
+    '''
+    Records the (completed) current backup run, along with each of its phases,
+    within the run history database.
+    '''
+    sizes = {}
+    for key in ['files', 'original_size', 'compressed_size', 'deduplicated_size']:
+        values = [a[key] for a in run_report['archives'] if a[key] is not None]
+        sizes[key] = sum(values) if values else None
+    db = _history_db()
+    with db:
+        run_id = db.execute(
+            'INSERT INTO runs (target, hostname, started, finished, duration, exit_code, failed_phase, skipped, archive, files, original_size, compressed_size, deduplicated_size, pruned_archives) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (
+                args.target,
+                run_report['hostname'],
+                run_report['started'],
+                run_report['finished'],
+                run_report['duration'],
+                run_report['exit_code'],
+                run_report.get('failed_phase'),
+                int(run_report['skipped']),
+                run_report['archive'],
+                sizes['files'],
+                sizes['original_size'],
+                sizes['compressed_size'],
+                sizes['deduplicated_size'],
+                run_report['pruned_archives']
+            )
+        ).lastrowid
+        db.executemany('INSERT INTO phases (run_id, phase, duration) VALUES (?, ?, ?)', [(run_id, p, d) for (p, d) in run_report['phases'].items()])
+    db.close()
+
+
+def resolve_source_paths():
+    '''
+    Returns the sorted and deduplicated list of paths matched by the source path
+    patterns of the target.
+    '''
+    if isinstance(target['src_path'], list):
+        patterns = target['src_path']
+    else:
+        patterns = [target['src_path']]
+    paths = set()
+    for p in patterns:
+        paths.update(_resolve_pattern(p))
+    return sorted(paths)
+
+
 def send_email(subject, body, level='error'):
     '''
     Sends an email to the configured recipients with the specified body, subject,
@@ -1564,9 +4773,9 @@ def send_email(subject, body, level='error'):
     logging.debug('EMAIL CALL: ' + str({'subject': subject, 'body': body, 'level': level}))
     try:
         if args.log_level == 'debug':
-            _send_email('backuputil@' + fqdn + ' - ' + subject, body, level, debug=True)
+            _send_email(subject, body, level, debug=True)
         else:
-            _send_email('backuputil@' + fqdn + ' - ' + subject, body, level)
+            _send_email(subject, body, level)
     except Exception as mail_e:
         logging.warning('Unable to send email - ' + str(mail_e) + '.')
 
@@ -1599,33 +4808,112 @@ def validate_environment():
             'error'
         )
         sys.exit(2)
-    print(_substep('Checking for existing backup processes...'))
-    logging.debug('Checking for existing backup processes...')
+
+
+def write_run_metrics():
+    '''
+    Writes the Prometheus metrics of the (completed) current backup run to the
+    "--metrics-dir" directory, replacing those of the previous run of the target.
+    '''
+    labels = 'target="' + args.target.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+    metrics = [
+        ('last_run_timestamp_seconds', 'Unix time at which the last run of the target finished.', [('', run_report['finished'])]),
+        ('last_success_timestamp_seconds', 'Unix time at which the last successful run of the target finished.', [('', _load_state(os.path.join('targets', args.target + '.json'), {}).get('last_success'))]),
+        ('last_run_exit_code', 'Exit code of the last run of the target.', [('', run_report['exit_code'])]),
+        ('last_run_skipped', 'Whether the last run of the target skipped creating an archive since its sources were unchanged.', [('', int(run_report['skipped']))]),
+        ('last_run_duration_seconds', 'Duration of the last run of the target.', [('', run_report['duration'])]),
+        ('last_run_phase_duration_seconds', 'Duration of each phase of the last run of the target.', [(',phase="' + p + '"', d) for (p, d) in sorted(run_report['phases'].items())]),
+        ('last_run_original_bytes', 'Original size of the source paths read by the last run of the target.', [('', sum([a['original_size'] or 0 for a in run_report['archives']]))]),
+        ('last_run_compressed_bytes', 'Compressed size of the source paths read by the last run of the target.', [('', sum([a['compressed_size'] or 0 for a in run_report['archives']]))]),
+        ('last_run_deduplicated_bytes', 'Deduplicated (and thus newly stored) size of the archive created by the last run of the target.', [('', sum([a['deduplicated_size'] or 0 for a in run_report['archives']]))]),
+        ('last_run_files', 'Number of files processed by the last run of the target.', [('', sum([a['files'] or 0 for a in run_report['archives']]))]),
+        ('last_run_pruned_archives', 'Number of archives pruned by the last run of the target.', [('', run_report['pruned_archives'])]),
+        ('archives', 'Number of archives of the target remaining after the last pruning.', [('', run_report['kept_archives'])])
+    ]
+    lines = []
+    for (name, description, samples) in metrics:
+        samples = [(l, v) for (l, v) in samples if v is not None]
+        if not samples: continue
+        lines.append('# HELP backuputil_' + name + ' ' + description)
+        lines.append('# TYPE backuputil_' + name + ' gauge')
+        for (extra_labels, value) in samples:
+            lines.append('backuputil_' + name + '{' + labels + extra_labels + '} ' + (repr(value) if isinstance(value, float) else str(int(value))))
+    path = os.path.join(args.metrics_dir, 'backuputil_' + args.target + '.prom')
+    tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+
+
+def write_run_profile():
+    '''
+    Writes the resource usage of each phase of the run (see "--profile") as a
+    table to the log file, and as JSON to "STATE_DIR/profiles/TARGET.json".
+    '''
+    if run_phase is None and not run_profile: return
+    _phase(None)
+    if not run_profile: return
+    def fmt(value, formatter):
+        if value is None: return '-'
+        return formatter(value)
+    logging.info('----- Profile -----')
+    logging.info('%-16s %10s %10s %10s %10s %10s %10s' % ('PHASE', 'WALL', 'USER', 'SYSTEM', 'READ', 'WRITTEN', 'PEAK RSS'))
+    for usage in run_profile:
+        logging.info('%-16s %9.3fs %9.3fs %9.3fs %10s %10s %10s' % (
+            usage['phase'],
+            usage['wall'],
+            usage['user'],
+            usage['system'],
+            fmt(usage['rchar'], _format_bytes),
+            fmt(usage['wchar'], _format_bytes),
+            fmt(usage['peak_rss'], _format_bytes)
+        ))
+    logging.info('-------------------')
     try:
-        (pid_out, pid_ec) = _run_process(
-            'pidof -x ' + os.path.basename(args.borg_executable),
-            splitlines = False
-        )
+        _save_state(os.path.join('profiles', args.target + '.json'), {'target': args.target, 'finished': time.time(), 'phases': run_profile})
     except Exception as e:
-        printe(_subsubstep('Unable to check for existing backup processes - ' + str(e) + '.', C_RED))
-        logging.critical('Unable to check for existing backup processes - ' + str(e) + '.')
-        send_email(
-            'Unable to validate environment',
-            emails.CANT_CHECK_FOR_RUNNING_BACKUPS,
-            'error'
-        )
-        sys.exit(2)
-    logging.debug('Existing Process Check Exit Code: ' + str(pid_ec))
-    if pid_out: logging.debug('Existing Process ID (or subprocess output): ' + pid_out)
-    if pid_ec == 0:
-        printe(_subsubstep('Unable to proceed - another backup process is already running.', C_RED))
-        logging.critical('Unable to proceed - another backup process is already running.')
-        send_email(
-            'Unable to validate environment',
-            emails.EXISTING_BACKUP_RUNNING,
-            'error'
-        )
-        sys.exit(2)
+        logging.warning('Unable to write profile - ' + str(e) + '.')
+
+
+def write_run_report(exit_code):
+    '''
+    Completes the report of the current backup run (if any) with the specified
+    exit code, writing it to "--report-file" and/or stdout (for "--output json"),
+    along with the corresponding metrics to "--metrics-dir".
+    '''
+    if run_report is None: return
+    if run_phase is not None and exit_code != 0: run_report['failed_phase'] = run_phase[0]
+    _phase(None)
+    if args.profile: run_report['profile'] = run_profile
+    run_report['exit_code'] = exit_code
+    run_report['finished'] = time.time()
+    run_report['duration'] = round(run_report['finished'] - run_report['started'], 3)
+    run_report['skipped'] = bool(globals().get('backup_skipped'))
+    run_report['archive'] = None if run_report['skipped'] or args.dry_run else globals().get('archive_str')
+    if not args.dry_run:
+        try:
+            record_run_history()
+        except Exception as e:
+            logging.warning('Unable to record run history - ' + str(e) + '.')
+    report = json.dumps(run_report, indent=4, separators=(',', ': '), sort_keys=True)
+    if args.report_file:
+        path = args.report_file.replace('{target}', args.target)
+        tmp_path = path + '.' + str(os.getpid()) + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(report + '\n')
+            os.rename(tmp_path, path)
+        except Exception as e:
+            logging.warning('Unable to write run report - ' + str(e) + '.')
+    if args.metrics_dir and not args.dry_run:
+        try:
+            write_run_metrics()
+        except Exception as e:
+            logging.warning('Unable to write run metrics - ' + str(e) + '.')
+    if args.output == 'json':
+        report_stdout.write(report + '\n')
+        report_stdout.flush()
 
 
 # --------------------------------------
@@ -1636,9 +4924,22 @@ def validate_environment():
 
 if __name__ == '__main__':
     try:
-        main()
-    except (KeyboardInterrupt, EOFError) as ki:
-        sys.stderr.write('Recieved keyboard interrupt!\n')
-        sys.exit(100)
+        try:
+            main()
+        except (KeyboardInterrupt, EOFError) as ki:
+            sys.stderr.write('Recieved keyboard interrupt!\n')
+            sys.exit(100)
+    except SystemExit as e:
+        if e.code is None:
+            write_run_report(0)
+        elif isinstance(e.code, int):
+            write_run_report(e.code)
+        else:
+            write_run_report(1)
+        write_run_profile()
+        raise
+    finally:
+        close_ssh_masters()
+        deliver_mail()
 
 # --------------------------------------
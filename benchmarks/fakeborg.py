@@ -0,0 +1,145 @@
+#!/bin/env python2.7
+'''
+Fake Borg
+
+A scriptable stand-in for the borg executable, used to measure the overhead of
+backuputil itself (select it via "--borg-executable"). It understands just
+enough of the borg command-line to produce plausible output for the commands
+run by backuputil, and is controlled through the following environment
+variables:
+
+FAKEBORG_LATENCY
+    The number of seconds to sleep before producing any output. Defaults to 0.
+
+FAKEBORG_LINES
+    The number of file lines printed by "create" (and "list"). Defaults to 10.
+
+FAKEBORG_RATE
+    The maximum number of file lines printed per second (0 being unlimited).
+    Defaults to 0.
+
+FAKEBORG_EXIT / FAKEBORG_EXIT_<COMMAND>
+    The exit code to return (for all commands, or only for the specified command
+    such as "FAKEBORG_EXIT_PRUNE"). Defaults to 0.
+'''
+
+
+# ------- Python Library Imports -------
+
+import json
+import os
+import sys
+import time
+
+# --------------------------------------
+
+
+
+# ----------- Initialization -----------
+
+# The borg commands recognized by the fake executable.
+COMMANDS = ['break-lock', 'check', 'create', 'extract', 'info', 'init', 'list', 'prune']
+
+# The number of lines written at a time when not limited by "FAKEBORG_RATE".
+WRITE_BATCH = 4096
+
+# --------------------------------------
+
+
+
+# ---------- Private Functions ---------
+
+def _log(message, name='borg.archiver', level='INFO'):
+    '''
+    Writes the specified log message to stderr, formatted according to
+    "--log-json".
+    '''
+    if log_json:
+        sys.stderr.write(json.dumps({'type': 'log_message', 'time': time.time(), 'levelname': level, 'name': name, 'message': message}) + '\n')
+    else:
+        sys.stderr.write(message + '\n')
+
+
+def _write_lines(count, formatter, stream):
+    '''
+    Writes the specified number of lines (as produced by the specified formatter
+    for each line index) to the specified stream, honoring "FAKEBORG_RATE".
+    '''
+    rate = float(os.getenv('FAKEBORG_RATE', '0'))
+    start = time.time()
+    batch = []
+    for i in range(count):
+        batch.append(formatter(i))
+        if rate:
+            stream.write(batch.pop())
+            delay = start + (i + 1) / rate - time.time()
+            if delay > 0: time.sleep(delay)
+        elif len(batch) >= WRITE_BATCH:
+            stream.write(''.join(batch))
+            batch = []
+    stream.write(''.join(batch))
+    stream.flush()
+
+# --------------------------------------
+
+
+
+# ---------- Public Functions ----------
+
+def main():
+    '''
+    The entrypoint of the fake executable.
+    '''
+    global log_json
+    argv = sys.argv[1:]
+    log_json = '--log-json' in argv
+    command = ([a for a in argv if a in COMMANDS] or ['info'])[0]
+    options = argv[argv.index(command) + 1:] if command in argv else []
+    positional = [a for a in options if not a.startswith('-')]
+    time.sleep(float(os.getenv('FAKEBORG_LATENCY', '0')))
+    lines = int(os.getenv('FAKEBORG_LINES', '10'))
+    if command == 'create':
+        archive = ([a for a in positional if '::' in a] or ['repo::archive'])[0]
+        _log('Creating archive at "' + archive + '"')
+        if log_json:
+            _write_lines(lines, lambda i: '{"type": "file_status", "status": "A", "path": "/src/dir%d/file%d"}\n' % (i // 100, i), sys.stderr)
+        else:
+            _write_lines(lines, lambda i: 'A /src/dir%d/file%d\n' % (i // 100, i), sys.stderr)
+        if '--json' in options:
+            sys.stdout.write(json.dumps({
+                'archive': {
+                    'name': archive.split('::')[-1],
+                    'start': '2019-01-01T00:00:00.000000',
+                    'end': '2019-01-01T00:00:01.000000',
+                    'duration': 1.0,
+                    'stats': {'nfiles': lines, 'original_size': lines * 4096, 'compressed_size': lines * 2048, 'deduplicated_size': lines * 512}
+                },
+                'repository': {'location': archive.split('::')[0]}
+            }, indent=4) + '\n')
+    elif command == 'prune':
+        for i in range(3):
+            _log('Keeping archive: archive' + str(i), name='borg.output.list')
+        _log('Pruning archive: archive3', name='borg.output.list')
+    elif command == 'list':
+        _write_lines(lines, lambda i: 'archive%d                   Tue, 2019-01-01 00:00:00 [%064x]\n' % (i, i), sys.stdout)
+    elif command == 'info':
+        sys.stdout.write('Repository ID: ' + '0' * 64 + '\n')
+        sys.stdout.write('Location: ' + (positional[-1] if positional else 'repo') + '\n')
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return int(os.getenv('FAKEBORG_EXIT_' + command.upper().replace('-', '_'), os.getenv('FAKEBORG_EXIT', '0')))
+
+# --------------------------------------
+
+
+
+# ---------- Boilerplate Magic ---------
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except (KeyboardInterrupt, EOFError) as ki:
+        sys.stderr.write('Recieved keyboard interrupt!\n')
+        sys.exit(100)
+
+# --------------------------------------
@@ -0,0 +1,269 @@
+#!/bin/env python2.7
+'''
+Backuputil Benchmarks
+
+Measures the overhead of backuputil itself (interpreter startup, configuration
+parsing, source path expansion, environment setup, and output streaming) by
+timing complete runs of the script against the fake borg executable in
+"fakeborg.py", and compares the results against the baselines stored in
+"baselines.json".
+'''
+
+
+# ------- Python Library Imports -------
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# --------------------------------------
+
+
+
+# ----------- Initialization -----------
+
+# The directory containing the benchmarks.
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The path of the script being benchmarked, and of the fake borg executable.
+BACKUPUTIL = os.path.join(os.path.dirname(BENCH_DIR), 'backuputil.py')
+FAKEBORG = os.path.join(BENCH_DIR, 'fakeborg.py')
+
+# The default path of the stored baselines.
+BASELINES = os.path.join(BENCH_DIR, 'baselines.json')
+
+# The number of seconds by which a scenario may always exceed its baseline
+# (absorbing timer noise on very short scenarios).
+NOISE_ALLOWANCE = 0.05
+
+# The maximum number of seconds certain scenarios may take regardless of their
+# baselines (monitoring may invoke the script many times per minute).
+BUDGETS = {
+    'startup': 0.2
+}
+
+# --------------------------------------
+
+
+
+# ---------- Private Functions ---------
+
+def _command(work, cli):
+    '''
+    Returns the command running backuputil with the specified arguments against
+    the configuration file, fake borg executable, and log file of a scenario.
+    '''
+    return [args.python, BACKUPUTIL, '-c', os.path.join(work, 'conf.yaml'), '-b', FAKEBORG, '-f', os.path.join(work, 'backuputil.log'), '-e', 'never', '--no-color'] + cli
+
+
+def _make_tree(root, dirs, files):
+    '''
+    Creates the specified number of directories, each containing the specified
+    number of (empty) files and a sub-directory, under the specified root.
+    '''
+    for d in range(dirs):
+        path = os.path.join(root, 'dir' + str(d))
+        os.makedirs(os.path.join(path, 'sub'))
+        for f in range(files):
+            open(os.path.join(path, 'file' + str(f)), 'w').close()
+
+
+def _scaled(count):
+    '''
+    Scales the specified size of a scenario by "--scale".
+    '''
+    return max(1, int(count * args.scale))
+
+
+def _write_config(path, targets):
+    '''
+    Writes a configuration file defining the specified dictionary of targets
+    (each given as a tuple of its source path and destination path).
+    '''
+    with open(path, 'w') as f:
+        f.write('targets:\n')
+        for name in sorted(targets):
+            f.write('  ' + name + ':\n')
+            f.write('    src_path: "' + targets[name][0] + '"\n')
+            f.write('    dst_path: "' + targets[name][1] + '"\n')
+
+# --------------------------------------
+
+
+
+# ---------- Public Functions ----------
+
+def scenario_all_targets(work):
+    '''
+    Executes 50 targets at once via "--all-targets" (worker process overhead).
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), dict([('t' + str(i), (work, os.path.join(work, 'repo' + str(i)))) for i in range(_scaled(50))]))
+    return (['--all-targets', '--jobs', '8', '--server-jobs', '8'], {}, None)
+
+
+def scenario_many_targets(work):
+    '''
+    Executes a single target of a configuration defining 5000 targets, with a
+    warm configuration cache.
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), dict([('t' + str(i), (work, os.path.join(work, 'repo' + str(i)))) for i in range(_scaled(5000))]))
+    return (['t0'], {}, None)
+
+
+def scenario_many_targets_cold(work):
+    '''
+    Executes a single target of a configuration defining 5000 targets, parsing
+    the configuration file from scratch each time.
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), dict([('t' + str(i), (work, os.path.join(work, 'repo' + str(i)))) for i in range(_scaled(5000))]))
+    def reset():
+        shutil.rmtree(os.path.join(work, 'state', 'config'), ignore_errors=True)
+    return (['t0'], {}, reset)
+
+
+def scenario_output_lines(work):
+    '''
+    Executes a single target whose backup prints 1,000,000 lines.
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), {'t': (work, os.path.join(work, 'repo'))})
+    return (['t'], {'FAKEBORG_LINES': str(_scaled(1000000))}, None)
+
+
+def scenario_output_rate(work):
+    '''
+    Executes a single target whose backup prints 20,000 lines at 20,000 lines
+    per second (streaming overhead on top of a fixed one second).
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), {'t': (work, os.path.join(work, 'repo'))})
+    return (['t'], {'FAKEBORG_LINES': str(_scaled(20000)), 'FAKEBORG_RATE': str(_scaled(20000))}, None)
+
+
+def scenario_startup(work):
+    '''
+    Lists the targets of a small configuration file with a warm configuration
+    cache (interpreter startup, as paid by monitoring checks).
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), {'t': (work, os.path.join(work, 'repo'))})
+    env = dict(os.environ)
+    env['BACKUPUTIL_STATE_DIR'] = os.path.join(work, 'state')
+    with open(os.devnull, 'w') as devnull:
+        subprocess.call(_command(work, ['t']), env=env, stdout=devnull, stderr=subprocess.STDOUT)
+    return (['--list-targets'], {}, None)
+
+
+def scenario_startup_cold(work):
+    '''
+    Lists the targets of a small configuration file without a configuration
+    cache (interpreter startup plus loading PyYAML).
+    '''
+    _write_config(os.path.join(work, 'conf.yaml'), {'t': (work, os.path.join(work, 'repo'))})
+    return (['--list-targets'], {}, None)
+
+
+def scenario_wildcards(work):
+    '''
+    Executes a single target whose source paths are "~/*" and "~/*/sub" wildcards
+    over a tree of 1000 directories.
+    '''
+    _make_tree(os.path.join(work, 'home'), _scaled(1000), 5)
+    with open(os.path.join(work, 'conf.yaml'), 'w') as f:
+        f.write('targets:\n  t:\n    src_path:\n      - "~/*"\n      - "~/*/sub"\n    dst_path: "' + os.path.join(work, 'repo') + '"\n')
+    return (['t'], {'HOME': os.path.join(work, 'home')}, None)
+
+
+def main():
+    '''
+    The entrypoint of the benchmarks.
+    '''
+    global args
+    argparser = argparse.ArgumentParser(description='Measures the overhead of backuputil against stored baselines.')
+    argparser.add_argument('scenarios', help='Specifies the scenarios to run (defaults to all of them).', metavar='SCENARIO', nargs='*')
+    argparser.add_argument('--baselines', default=BASELINES, help='Specifies the baselines file. Defaults to "benchmarks/baselines.json".', metavar='FILE')
+    argparser.add_argument('--list', action='store_true', help='Lists the available scenarios.')
+    argparser.add_argument('--python', default='python2.7', help='Specifies the interpreter to run backuputil with. Defaults to "python2.7".', metavar='EXE')
+    argparser.add_argument('--repeat', default=3, help='Specifies the number of times each scenario is measured (after an initial warm-up run), taking the fastest run. Defaults to 3.', metavar='INT', type=int)
+    argparser.add_argument('--scale', default=1.0, help='Specifies a factor by which to scale the size of each scenario. Defaults to 1.', metavar='FLOAT', type=float)
+    argparser.add_argument('--tolerance', default=0.25, help='Specifies the fraction by which a scenario may exceed its baseline before failing. Defaults to 0.25.', metavar='FLOAT', type=float)
+    argparser.add_argument('--update', action='store_true', help='Stores the results as the new baselines instead of comparing against them.')
+    args = argparser.parse_args()
+    scenarios = dict([(name[len('scenario_'):].replace('_', '-'), f) for (name, f) in globals().items() if name.startswith('scenario_')])
+    if args.list:
+        for name in sorted(scenarios):
+            print(name.ljust(20) + ' ' + ' '.join(scenarios[name].__doc__.split()))
+        return 0
+    selected = args.scenarios or sorted(scenarios)
+    unknown = [s for s in selected if not s in scenarios]
+    if unknown:
+        sys.stderr.write('Unknown scenarios: ' + ', '.join(unknown) + '\n')
+        return 1
+    try:
+        with open(args.baselines, 'r') as f:
+            baselines = json.load(f)
+    except (IOError, ValueError):
+        baselines = {}
+    results = {}
+    regressions = []
+    over_budget = []
+    devnull = open(os.devnull, 'w')
+    for name in selected:
+        work = tempfile.mkdtemp(prefix='backuputil-bench-')
+        (cli, env, reset) = scenarios[name](work)
+        run_env = dict(os.environ)
+        run_env.update(env)
+        run_env['BACKUPUTIL_STATE_DIR'] = os.path.join(work, 'state')
+        cmd = _command(work, cli)
+        timings = []
+        for i in range(args.repeat + 1):
+            if reset: reset()
+            start = time.time()
+            exit_code = subprocess.call(cmd, env=run_env, stdout=devnull, stderr=subprocess.STDOUT)
+            if i: timings.append(time.time() - start)
+            if exit_code != 0:
+                sys.stderr.write(name + ': backuputil returned exit code ' + str(exit_code) + ' (see "' + os.path.join(work, 'backuputil.log') + '")\n')
+                return 1
+        shutil.rmtree(work, ignore_errors=True)
+        results[name] = round(min(timings), 3)
+        line = name.ljust(20) + ' %8.3fs' % results[name]
+        if not args.update and name in baselines:
+            line += '  (baseline %.3fs, %+.0f%%)' % (baselines[name], (results[name] / baselines[name] - 1) * 100)
+            if results[name] > baselines[name] * (1 + args.tolerance) + NOISE_ALLOWANCE:
+                line += '  REGRESSION'
+                regressions.append(name)
+        if name in BUDGETS and results[name] > BUDGETS[name]:
+            line += '  OVER BUDGET (%.3fs)' % BUDGETS[name]
+            over_budget.append(name)
+        print(line)
+        sys.stdout.flush()
+    if args.update:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=4, separators=(',', ': '), sort_keys=True)
+            f.write('\n')
+        print('Stored baselines in "' + args.baselines + '".')
+    elif regressions:
+        print(str(len(regressions)) + ' scenario(s) regressed against their baseline: ' + ', '.join(regressions))
+        return 1
+    if over_budget:
+        print(str(len(over_budget)) + ' scenario(s) exceeded their time budget: ' + ', '.join(over_budget))
+        return 1
+    return 0
+
+# --------------------------------------
+
+
+
+# ---------- Boilerplate Magic ---------
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except (KeyboardInterrupt, EOFError) as ki:
+        sys.stderr.write('Recieved keyboard interrupt!\n')
+        sys.exit(100)
+
+# --------------------------------------
@@ -16,8 +16,8 @@ BACKUP_WARN = """
 {pre} it encountered a warning-level exit code from the backup subprocess.
 """.format(pre=PRE_MSG)
 
-CANT_CHECK_FOR_RUNNING_BACKUPS = """
-{pre} it encountered an exception while trying to check for existing backup processes.
+CANT_LOCK_REPO = """
+{pre} it encountered an exception while trying to acquire the repository lock.
 """.format(pre=PRE_MSG)
 
 CANT_PARSE_CONF = """
@@ -40,10 +40,6 @@ BORG_DOESNT_EXIST = """
 {pre} the specified path for the Borg Backup executable binary does not exist on the local filesystem.
 """.format(pre=PRE_MSG)
 
-EXISTING_BACKUP_RUNNING = """
-{pre} it was unable to proceed with the backup process because another backup process was already running.
-""".format(pre=PRE_MSG)
-
 INFO_ERR = """
 {pre} it encountered an error-level exit code from the repository verification subprocess.
 Make sure the destination repository was created via "borg init" prior to running the script.
@@ -96,3 +92,11 @@ PRUNE_EXCEPTION = """
 PRUNE_WARN = """
 {pre} it encountered a warning-level exit code from the pruning subprocess.
 """.format(pre=PRE_MSG)
+
+REPO_LOCKED = """
+{pre} it was unable to proceed because another backuputil process held the lock on the destination repository.
+""".format(pre=PRE_MSG)
+
+WATCH_EXCEPTION = """
+{pre} it encountered an exception while watching the source paths of the specified target.
+""".format(pre=PRE_MSG)
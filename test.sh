@@ -8,5 +8,6 @@ export BACKUPUTIL_CONFIG_FILE='example/backuputil.yaml'
 export BACKUPUTIL_LOG_FILE='/tmp/backuputil.log'
 export BACKUPUTIL_LOG_LVL='debug'
 export BACKUPUTIL_LOG_MODE='overwrite'
+export BACKUPUTIL_STATE_DIR='/tmp/backuputil'
 
 ./backuputil.py $@